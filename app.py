@@ -1,498 +1,143 @@
-from flask import Flask, flash, render_template, request, redirect, url_for, send_file, jsonify
-import openpyxl
-from openpyxl import load_workbook
-from openpyxl.utils import column_index_from_string
-from datetime import datetime, date
-import os, glob, time
-from dateutil import parser
+from flask import Flask, Request, Response, flash, render_template, request, redirect, url_for, send_file, jsonify
+from werkzeug.exceptions import RequestEntityTooLarge
+import os, glob, json, time
+from processing import (
+    PROCESSED_FOLDER, STREAMING_MIN_FILE_SIZE, FILE_SPECS, SPECIFIC_NAME, ensure_folders, get_file_type,
+    options_from_settings, process_uploaded_file
+)
+from jobs import submit_job, submit_batch_job, get_job, list_jobs, job_counts, job_status, wait_for_job
+from batch import BATCH_WORKERS, extract_zip, process_batch, batch_messages
+from ingest import MAX_UPLOAD_BYTES, MAX_UPLOAD_ROWS, HashingUpload, UploadRejected, UploadTooLarge, validate_upload
+from metrics import observe_summary, render_metrics
+from workspace import WORKSPACE_FOLDER, WORKSPACE_MAX_AGE, new_workspace, remove_expired, remove_workspace
+
+# Request whose file uploads are written straight to disk as the body is read,
+# hashed and size-checked on the way, instead of buffered in a temporary file first
+class UploadRequest(Request):
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return HashingUpload(app.config['WORKSPACE_FOLDER'], app.config['MAX_UPLOAD_BYTES'])
 
 app = Flask(__name__)
 app.secret_key = 'key_DQApp'
+app.request_class = UploadRequest
 
-PROCESSED_FOLDER = 'processed'
-DATA_QUALITY_FOLDER = 'data quality'
-INDIVIDUAL_BORROWER_FOLDER = 'individual_borrower'
-CORPORATE_BORROWER_FOLDER = 'corporate_borrower'
-CREDIT_INFORMATION_FOLDER = 'credit_information'
-GUARANTORS_INFORMATION_FOLDER = 'guarantors_information'
-PRINCIPAL_OFFICERS_FOLDER = 'principal_officers'
-
-# Ensure the upload folder exists
-os.makedirs(PROCESSED_FOLDER, exist_ok=True)
-os.makedirs(DATA_QUALITY_FOLDER, exist_ok=True)
-os.makedirs(INDIVIDUAL_BORROWER_FOLDER, exist_ok=True)
-os.makedirs(CORPORATE_BORROWER_FOLDER, exist_ok=True)
-os.makedirs(CREDIT_INFORMATION_FOLDER, exist_ok=True)
-os.makedirs(GUARANTORS_INFORMATION_FOLDER, exist_ok=True)
-os.makedirs(PRINCIPAL_OFFICERS_FOLDER, exist_ok=True)
-
-app.config['PROCESSED_FOLDER'] = PROCESSED_FOLDER
-app.config['DATA_QUALITY_FOLDER'] = DATA_QUALITY_FOLDER
-app.config['INDIVIDUAL_BORROWER_FOLDER'] = INDIVIDUAL_BORROWER_FOLDER
-app.config['CORPORATE_BORROWER_FOLDER'] = CORPORATE_BORROWER_FOLDER
-app.config['CREDIT_INFORMATION_FOLDER'] = CREDIT_INFORMATION_FOLDER
-app.config['GUARANTORS_INFORMATION_FOLDER'] = GUARANTORS_INFORMATION_FOLDER
-app.config['PRINCIPAL_OFFICERS_FOLDER'] = PRINCIPAL_OFFICERS_FOLDER
-
-app.config['ALLOWED_EXTENSIONS'] = {'xlsx'}
-
-# Define the specific names to check for in the file name
-SPECIFIC_NAME = [
-    "Individual-Borrower", "Credit-Information", "Corporate-Borrower", 
-    "Guarantors-Information", "Principal-Officers"
-]
+# Create the output folder and the folder for each file type, which processing writes to
+ensure_folders()
 
-# Function to check allowed file
-def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
+# Workbooks, and CSV, tab- and pipe-delimited text read without a workbook (see delimited.py)
+app.config['ALLOWED_EXTENSIONS'] = {'xlsx', 'csv', 'tsv', 'txt'}
 
-# Function to check if the specific name is part of the file name
-def allowed_file_name(filename):
-    return any(name in filename for name in SPECIFIC_NAME)
+# Files at or above this size are processed in streaming mode (read-only input,
+# write-only outputs) so memory stays flat. Set to 0 to stream every upload.
+app.config['STREAMING_MIN_FILE_SIZE'] = STREAMING_MIN_FILE_SIZE
 
-# Function to process the uploaded file based on its type
-def process_uploaded_file(file_path):
-    if "Individual-Borrower" in file_path:
-        process_individual_borrower(file_path)
-    elif "Credit-Information" in file_path:
-        process_credit_information(file_path)
-    elif "Corporate-Borrower" in file_path:
-        process_corporate_borrower(file_path)
-    elif "Principal-Officers" in file_path:
-        process_principal_officers(file_path)
-    elif "Guarantors-Information" in file_path:
-        process_guarantors_information(file_path)
-    else:
-        flash("Unknown file type.", 'danger')
-
-# Function to parse and format date columns
-def format_date_columns(sheet, date_columns):
-    for col_letter in date_columns:
-        for row in range(2, sheet.max_row + 1):
-            cell = sheet[f'{col_letter}{row}']
-            if isinstance(cell.value, str):
-                try:
-                    parsed_date = parser.parse(cell.value, dayfirst=True)
-                    formatted_date = parsed_date.strftime('%d-%b-%Y')
-                    cell.value = formatted_date
-                except (ValueError, TypeError):
-                    continue
-            elif isinstance(cell.value, (datetime, date)):
-                cell.value = cell.value.strftime('%d-%b-%Y')
-
-# Function to remove duplicates
-def remove_duplicates(sheet):
-    seen_rows = set()
-    rows_to_delete = set()
-
-    for row_idx, row in enumerate(sheet.iter_rows(min_row=2, values_only=True), start=2):
-        row_key = tuple(row)
-        if row_key in seen_rows:
-            rows_to_delete.add(row_idx)
-        else:
-            seen_rows.add(row_key)
+# Cleaning engine: 'openpyxl' (default) or 'pandas' for vectorized column operations
+app.config['PROCESSING_ENGINE'] = 'openpyxl'
 
-    if rows_to_delete:
-        for row in sorted(rows_to_delete, reverse=True):
-            sheet.delete_rows(row)
-        return True
-    else:
-        return False
-    
+# Process uploads on the background worker pool and return a job ID straight away.
+# Set to False to process inside the request as before.
+app.config['BACKGROUND_JOBS'] = True
 
-# Function to clean cell values
-def clean_cell_value(value):
-    changes = {
-        'exponential': 0,
-        'pipe': 0,
-        'carriage_return': 0,
-        'line_break': 0
-    }
-
-    if isinstance(value, str):
-        if 'E+' in value:
-            value = value.replace('E+', '')
-            changes['exponential'] += 1
-        if '|' in value:
-            value = value.replace('|', '')
-            changes['pipe'] += 1
-        if '\r' in value:
-            value = value.replace('\r', '')
-            changes['carriage_return'] += 1
-        if '\n' in value:
-            value = value.replace('\n', '')
-            changes['line_break'] += 1
-
-    return value, changes
-
-# Function to clean the entire worksheet
-def clean_worksheet(sheet):
-    total_changes = {
-        'exponential': 0,
-        'pipe': 0,
-        'carriage_return': 0,
-        'line_break': 0
-    }
-
-    for row in sheet.iter_rows():
-        for cell in row:
-            if cell.value:
-                cleaned_value, changes = clean_cell_value(cell.value)
-                cell.value = cleaned_value
-                for key in total_changes:
-                    total_changes[key] += changes[key]
-
-    return total_changes
-
-# Function to print cleaning summary
-def print_summary(changes):
-    if any(changes.values()):
-        flash("Cleaning Summary:",'success')
-        if changes['exponential'] > 0:
-            flash(f"Removed {changes['exponential']} exponentials (E+).",'success')
-        if changes['pipe'] > 0:
-            flash(f"Removed {changes['pipe']} pipe symbols (|).",'success')
-        if changes['carriage_return'] > 0:
-            flash(f"Removed {changes['carriage_return']} carriage returns (\\r).",'success')
-        if changes['line_break'] > 0:
-            flash(f"Removed {changes['line_break']} line breaks (\\n).",'success')
-    else:
-        flash(f"No cleaning needed.",'success')
-
-# Function to check for and handle blank rows in specified columns
-def check_blank_rows_in_columns(sheet, column_letters):
-    blank_rows = []
-    blank_row_indices = []
-
-    for row in sheet.iter_rows(min_row=2, max_row=sheet.max_row):
-        is_blank = False
-        row_num = row[0].row
-        row_values = [cell.value for cell in row]
-        for col_letter in column_letters:
-            col_idx = column_index_from_string(col_letter) - 1
-            cell_value = row[col_idx].value
-            if cell_value in [None, '']:
-                is_blank = True
-                break
-        if is_blank:
-            blank_rows.append(row_values)
-            blank_row_indices.append(row_num)
-
-    return blank_rows, blank_row_indices
-
-# Function to copy blank rows to a new workbook
-def copy_blank_rows_to_new_workbook(sheet, blank_rows, new_workbook_path):
-    new_workbook = openpyxl.Workbook()
-    new_sheet = new_workbook.active
-    new_sheet.title = "Blank Rows"
-
-    headers = list(sheet.iter_rows(min_row=1, max_row=1, values_only=True))[0]
-    for col, header in enumerate(headers, start=1):
-        new_sheet.cell(row=1, column=col, value=header)
-
-    for row_idx, row_data in enumerate(blank_rows, start=2):
-        for col_idx, cell_value in enumerate(row_data, start=1):
-            new_sheet.cell(row=row_idx, column=col_idx, value=cell_value)
-
-    new_workbook.save(new_workbook_path)
-    flash(f"Blank rows copied to: {new_workbook_path}",'success')
-
-# Function to delete blank rows from the original sheet
-def delete_blank_rows_from_original(sheet, blank_row_indices):
-    for row_idx in sorted(blank_row_indices, reverse=True):
-        sheet.delete_rows(row_idx)
-
-# Function to check rows where BVN No does not start with '2'
-def check_bvn_not_starting_with_2(sheet):
-    non_bvn_rows = []
-    non_bvn_row_indices = []
-
-    for row in sheet.iter_rows(min_row=2):
-        bvn_cell_value = row[8].value  # BVN No is the 9th column (index 8)
-        if isinstance(bvn_cell_value, str) and not bvn_cell_value.startswith('2'):
-            non_bvn_rows.append([cell.value for cell in row])
-            non_bvn_row_indices.append(row[0].row)
-
-    return non_bvn_rows, non_bvn_row_indices
-
-# Function to copy rows to a new worksheet
-def copy_rows_to_new_workbook(sheet, rows, new_workbook_path, title):
-        new_workbook = openpyxl.Workbook()
-        new_sheet = new_workbook.active
-        new_sheet.title = title
-
-        headers = list(sheet.iter_rows(min_row=1, max_row=1, values_only=True))[0]
-        for col, header in enumerate(headers, start=1):
-            new_sheet.cell(row=1, column=col, value=header)
-
-        for row_idx, row_data in enumerate(rows, start=2):
-            for col_idx, cell_value in enumerate(row_data, start=1):
-                new_sheet.cell(row=row_idx, column=col_idx, value=cell_value)
-
-        new_workbook.save(new_workbook_path)
-        flash(f"Invalid Bvn copied to: {new_workbook_path}",'success')
-
-# Function to delete rows from the original sheet
-def delete_rows_from_original(sheet, row_indices):
-        for row_idx in sorted(row_indices, reverse=True):
-            sheet.delete_rows(row_idx)
-
-# Function to replace gender values
-def replace_gender_values(sheet, column_letter):
-    for cell in sheet[column_letter]:
-        if cell.value in ["M", "Male"]:
-            cell.value = "001"
-        elif cell.value in ["F", "Female"]:
-            cell.value = "002"
-
-
-# Find all Excel files in the directory
-def excel_to_pipe_delimited_text(file_path):
-    workbook = load_workbook(file_path)
-    sheet = workbook.active
-
-    text_file_path = os.path.join(app.config['PROCESSED_FOLDER'], os.path.splitext(os.path.basename(file_path))[0] + '.txt')
-    
-    with open(text_file_path, 'w', errors='ignore') as text_file:
-        for row in sheet.iter_rows(values_only=True):
-            # Replace None with an empty string for each element in the row
-            line = '|'.join(['' if cell is None else str(cell) for cell in row])
-            text_file.write(line + '\n')
+# Worker processes used for multi-file and zip uploads
+app.config['BATCH_WORKERS'] = BATCH_WORKERS
 
-    flash(f"Conversion completed. The text file is saved as: {text_file_path}",'success')
-    return text_file_path
+# Reuse the outputs of an identical file already processed under the same rules
+app.config['RESULT_CACHE'] = True
 
+# Compression of the pipe-delimited export: None for .txt or 'gzip' for .txt.gz
+app.config['TEXT_COMPRESSION'] = None
 
-# Individual Borrower processing
-def process_individual_borrower(file_path):
-    
-    flash(f"Processing file: {file_path}",'success')
-
-    workbook = load_workbook(file_path)
-    sheet = workbook.active
-
-    # Remove duplicates
-    duplicates_removed = remove_duplicates(sheet)
-    if duplicates_removed:
-        flash(f'Duplicates were removed.','success')
-    else:
-        flash(f'No duplicates found.','success')
-
-    # Clean worksheet
-    total_changes = clean_worksheet(sheet)
-    print_summary(total_changes)
-
-    # Check for and handle blank rows
-    column_letters_to_check = ['A', 'C', 'D', 'F', 'I']
-    blank_rows, blank_row_indices = check_blank_rows_in_columns(sheet, column_letters_to_check)
-    if blank_rows:
-        new_workbook_path = os.path.join(app.config['DATA_QUALITY_FOLDER'],f"{os.path.splitext(os.path.basename(file_path))[0]}_BlankRows.xlsx")
-        copy_blank_rows_to_new_workbook(sheet, blank_rows, new_workbook_path)
-        delete_blank_rows_from_original(sheet, blank_row_indices)
-
-    # Check for rows where BVN No does not start with '2'
-    non_bvn_rows, non_bvn_row_indices = check_bvn_not_starting_with_2(sheet)
-    if non_bvn_rows:
-        new_workbook_path = os.path.join(app.config['DATA_QUALITY_FOLDER'],
-                                            f"{os.path.splitext(os.path.basename(file_path))[0]}_InvalidBVN.xlsx") #NonBVNStartWith2
-        copy_rows_to_new_workbook(sheet, non_bvn_rows, new_workbook_path, "Non-BVN Start With 2")
-        delete_rows_from_original(sheet, non_bvn_row_indices)
-   
-    # Format the date columns in the Excel sheet
-    date_columns_to_format = ['F']
-    format_date_columns(sheet, date_columns_to_format)
-
-    # Replace gender values
-    replace_gender_values(sheet, 'K')
-    
-    # Save the modified workbook
-    workbook.save(file_path)
-
-    # Convert to pipe-delimited text file
-    excel_to_pipe_delimited_text(file_path)
-
-
-# Credit Information processing
-def process_credit_information(file_path):
-    flash(f"Processing file: {file_path}",'success')
-
-    workbook = load_workbook(file_path)
-    sheet = workbook.active
-
-    # Remove duplicates
-    duplicates_removed = remove_duplicates(sheet)
-    if duplicates_removed:
-        flash(f'Duplicates were removed.','success')
-    else:
-        flash(f'No duplicates found.','success')
-
-    # Clean worksheet
-    total_changes = clean_worksheet(sheet)
-    print_summary(total_changes)
-
-    # Check for and handle blank rows
-    column_letters_to_check = ['A', 'B','C','D','E', 'H', 'J','M','S']
-    blank_rows, blank_row_indices = check_blank_rows_in_columns(sheet, column_letters_to_check)
-    if blank_rows:
-        new_workbook_path = os.path.join(app.config['DATA_QUALITY_FOLDER'],f"{os.path.splitext(os.path.basename(file_path))[0]}_BlankRows.xlsx")
-        copy_blank_rows_to_new_workbook(sheet, blank_rows, new_workbook_path)
-        delete_blank_rows_from_original(sheet, blank_row_indices)
-
-    # Check for rows where BVN No does not start with '2'
-    non_bvn_rows, non_bvn_row_indices = check_bvn_not_starting_with_2(sheet)
-    if non_bvn_rows:
-        new_workbook_path = os.path.join(app.config['DATA_QUALITY_FOLDER'],
-                                            f"{os.path.splitext(os.path.basename(file_path))[0]}_InvalidBVN.xlsx") #NonBVNStartWith2
-        copy_rows_to_new_workbook(sheet, non_bvn_rows, new_workbook_path, "Non-BVN Start With 2")
-        delete_rows_from_original(sheet, non_bvn_row_indices)
-   
-    # Format the date columns in the Excel sheet
-    date_columns_to_format = ['D','E','P','R','U']
-    format_date_columns(sheet, date_columns_to_format)
-    
-    # Save the modified workbook
-    workbook.save(file_path)
+# Also export the data quality exceptions as 'csv' or 'parquet' (None for the workbook only)
+app.config['EXCEPTION_EXPORT'] = None
 
-    # Convert to pipe-delimited text file
-    excel_to_pipe_delimited_text(file_path)
+# Run every job under cProfile, dumping the stats to the profiles folder. A single
+# upload can also ask for it with a `profile=1` form field or query parameter.
+app.config['PROFILE_JOBS'] = False
 
-# Corporate Borrower processing
-def process_corporate_borrower(file_path):
-    flash(f"Processing file: {file_path}",'success')
+# SQLite customer index for the cross-file checks: borrower files add their customers
+# and BVNs to it and Credit-Information rows are checked against it (None to turn off).
+# The result cache is not used while it is on.
+app.config['CUSTOMER_INDEX'] = None
 
-    workbook = load_workbook(file_path)
-    sheet = workbook.active
+# SQLite store of the rows of the last submission of each file type from each
+# institution: only new and changed rows go through the rules, and a _Delta.csv report
+# lists the added, changed and removed rows (None to turn off). The result cache and
+# the pandas engine are not used while it is on.
+app.config['DELTA_STORE'] = None
 
-    # Remove duplicates
-    duplicates_removed = remove_duplicates(sheet)
-    if duplicates_removed:
-        flash(f'Duplicates were removed.','success')
-    else:
-        flash(f'No duplicates found.','success')
-
-    # Clean worksheet
-    total_changes = clean_worksheet(sheet)
-    print_summary(total_changes)
-
-    # Check for and handle blank rows
-    column_letters_to_check = ['B', 'F']
-    blank_rows, blank_row_indices = check_blank_rows_in_columns(sheet, column_letters_to_check)
-    if blank_rows:
-        new_workbook_path = os.path.join(app.config['DATA_QUALITY_FOLDER'],f"{os.path.splitext(os.path.basename(file_path))[0]}_BlankRows.xlsx")
-        copy_blank_rows_to_new_workbook(sheet, blank_rows, new_workbook_path)
-        delete_blank_rows_from_original(sheet, blank_row_indices)
-
-    # Check for rows where BVN No does not start with '2'
-    non_bvn_rows, non_bvn_row_indices = check_bvn_not_starting_with_2(sheet)
-    if non_bvn_rows:
-        new_workbook_path = os.path.join(app.config['DATA_QUALITY_FOLDER'],
-                                            f"{os.path.splitext(os.path.basename(file_path))[0]}_InvalidBVN.xlsx") #NonBVNStartWith2
-        copy_rows_to_new_workbook(sheet, non_bvn_rows, new_workbook_path, "Non-BVN Start With 2")
-        delete_rows_from_original(sheet, non_bvn_row_indices)
-   
-    # Format the date columns in the Excel sheet
-    date_columns_to_format = ['E']
-    format_date_columns(sheet, date_columns_to_format)
-    
-    # Save the modified workbook
-    workbook.save(file_path)
+# Keep the parsed sheet of each upload as Arrow files under parse_cache/, so a file
+# processed again (after a rule change, for example) is not parsed again. Needs pyarrow.
+app.config['PARSE_CACHE'] = False
 
+# Save and process each upload in its own folder under WORKSPACE_FOLDER, publishing the
+# outputs to the shared folders once they are complete, so uploads with the same name
+# and several app processes (or nodes sharing the folders) do not overwrite each other
+app.config['JOB_WORKSPACES'] = True
+app.config['WORKSPACE_FOLDER'] = WORKSPACE_FOLDER
 
-# Principal Officers processing
-def process_principal_officers(file_path):
-    
-    flash(f"Processing file: {file_path}",'success')
+# Seconds the workspace of a failed job (kept with its upload to look into), an upload
+# never finished and the status of a job are kept before the next upload removes them
+app.config['WORKSPACE_MAX_AGE'] = WORKSPACE_MAX_AGE
 
-    workbook = load_workbook(file_path)
-    sheet = workbook.active
+# Processes that parse and check the rows of one large file (streaming mode) in chunks,
+# with the same outputs as one process. None to leave each file on one core; batches
+# already spread files across BATCH_WORKERS processes.
+app.config['ROW_WORKERS'] = None
 
-    # Remove duplicates
-    duplicates_removed = remove_duplicates(sheet)
-    if duplicates_removed:
-        flash(f'Duplicates were removed.','success')
-    else:
-        flash(f'No duplicates found.','success')
-
-    # Clean worksheet
-    total_changes = clean_worksheet(sheet)
-    print_summary(total_changes)
-
-    # Check for and handle blank rows
-    column_letters_to_check = ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H', 'I', 'J', 'K', 'L', 'M', 'N', 'O', 'P', 'Q', 'R', 'S', 'T', 'U', 'V'] #Add remaining columns
-    blank_rows, blank_row_indices = check_blank_rows_in_columns(sheet, column_letters_to_check)
-    if blank_rows:
-        new_workbook_path = os.path.join(app.config['DATA_QUALITY_FOLDER'],f"{os.path.splitext(os.path.basename(file_path))[0]}_BlankRows.xlsx")
-        copy_blank_rows_to_new_workbook(sheet, blank_rows, new_workbook_path)
-        delete_blank_rows_from_original(sheet, blank_row_indices)
-
-    # Check for rows where BVN No does not start with '2'
-    non_bvn_rows, non_bvn_row_indices = check_bvn_not_starting_with_2(sheet)
-    if non_bvn_rows:
-        new_workbook_path = os.path.join(app.config['DATA_QUALITY_FOLDER'],
-                                            f"{os.path.splitext(os.path.basename(file_path))[0]}_InvalidBVN.xlsx") #NonBVNStartWith2
-        copy_rows_to_new_workbook(sheet, non_bvn_rows, new_workbook_path, "Non-BVN Start With 2")
-        delete_rows_from_original(sheet, non_bvn_row_indices)
-   
-    # Format the date columns in the Excel sheet
-    date_columns_to_format = ['E','V']
-    format_date_columns(sheet, date_columns_to_format)
-
-    # Replace gender values
-    replace_gender_values(sheet, ['F','W'])
-    
-    # Save the modified workbook
-    workbook.save(file_path)
+# Largest file accepted per upload, checked as it is received, and largest number of
+# data rows, checked from the workbook zip before it is parsed (None for no limit)
+app.config['MAX_UPLOAD_BYTES'] = MAX_UPLOAD_BYTES
+app.config['MAX_UPLOAD_ROWS'] = MAX_UPLOAD_ROWS
 
-    # Convert to pipe-delimited text file
-    excel_to_pipe_delimited_text(file_path)
+# Largest request body, refused from its Content-Length before anything is read.
+# Multi-file uploads come in one request, so this is larger than MAX_UPLOAD_BYTES.
+app.config['MAX_CONTENT_LENGTH'] = 1024 * 1024 * 1024
 
-# Guarantors Information processing
-def process_guarantors_information(file_path):
-    
-    flash(f"Processing file: {file_path}",'success')
+# Function to check allowed file
+def allowed_file(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
 
-    workbook = load_workbook(file_path)
-    sheet = workbook.active
+# Function to check if the specific name is part of the file name
+def allowed_file_name(filename):
+    return any(name in filename for name in SPECIFIC_NAME)
 
-    # Remove duplicates
-    duplicates_removed = remove_duplicates(sheet)
-    if duplicates_removed:
-        flash(f'Duplicates were removed.','success')
+# Function to build the processing options from the app config. A single upload can
+# also ask to be profiled.
+def upload_options():
+    return dict(options_from_settings(app.config),
+                profile=app.config['PROFILE_JOBS'] or request.values.get('profile') == '1')
+
+# Function to create the workspace for an upload, with the folders processing writes to.
+# Returns None when uploads are processed in the shared folders.
+def upload_workspace():
+    remove_expired(app.config['WORKSPACE_FOLDER'], app.config['WORKSPACE_MAX_AGE'])
+    if not app.config['JOB_WORKSPACES']:
+        return None
+    workspace = new_workspace(app.config['WORKSPACE_FOLDER'])
+    ensure_folders(workspace)
+    return workspace
+
+# Function to check if a file is a zip of workbooks
+def is_zip_file(filename):
+    return filename.lower().endswith('.zip')
+
+# Function to check if the client asked for a JSON response instead of a page
+def wants_json():
+    return request.accept_mimetypes.best == 'application/json'
+
+# Function to refuse an upload that is too large or not a readable workbook
+@app.errorhandler(UploadRejected)
+@app.errorhandler(RequestEntityTooLarge)
+def upload_rejected(error):
+    too_large = isinstance(error, (UploadTooLarge, RequestEntityTooLarge))
+    if isinstance(error, RequestEntityTooLarge):
+        message = f"Upload is larger than the {app.config['MAX_CONTENT_LENGTH'] / (1024 * 1024):g} MB limit."
     else:
-        flash(f'No duplicates found.','success')
-
-    # Clean worksheet
-    total_changes = clean_worksheet(sheet)
-    print_summary(total_changes)
-
-    # Check for and handle blank rows
-    column_letters_to_check = ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H', 'I', 'J', 'K', 'L', 'M', 'N', 'O', 'P', 'Q', 'R', 'S', 'T', 'U', 'V']
-    blank_rows, blank_row_indices = check_blank_rows_in_columns(sheet, column_letters_to_check)
-    if blank_rows:
-        new_workbook_path = os.path.join(app.config['DATA_QUALITY_FOLDER'],f"{os.path.splitext(os.path.basename(file_path))[0]}_BlankRows.xlsx")
-        copy_blank_rows_to_new_workbook(sheet, blank_rows, new_workbook_path)
-        delete_blank_rows_from_original(sheet, blank_row_indices)
-
-    # Check for rows where BVN No does not start with '2'
-    non_bvn_rows, non_bvn_row_indices = check_bvn_not_starting_with_2(sheet)
-    if non_bvn_rows:
-        new_workbook_path = os.path.join(app.config['DATA_QUALITY_FOLDER'],
-                                            f"{os.path.splitext(os.path.basename(file_path))[0]}_InvalidBVN.xlsx") #NonBVNStartWith2
-        copy_rows_to_new_workbook(sheet, non_bvn_rows, new_workbook_path, "Non-BVN Start With 2")
-        delete_rows_from_original(sheet, non_bvn_row_indices)
-   
-    # Format the date columns in the Excel sheet
-    date_columns_to_format = ['I']
-    format_date_columns(sheet, date_columns_to_format)
-
-    # Replace gender values
-    replace_gender_values(sheet, 'J')
-    
-    # Save the modified workbook
-    workbook.save(file_path)
-
-    # Convert to pipe-delimited text file
-    excel_to_pipe_delimited_text(file_path)
+        message = str(error)
+    if wants_json():
+        return jsonify({'error': message}), 413 if too_large else 400
+    flash(f'File not processed! {message}', 'danger')
+    return redirect(url_for('upload_file'))
 
 # Upload route
 @app.route('/',methods=['GET','POST'])
@@ -508,34 +153,47 @@ def upload_file():
         if 'file' not in request.files:
             flash('No file part', 'error')
             return redirect(request.url)
-        file = request.files['file']
+        files = [file for file in request.files.getlist('file') if file.filename != '']
         
         # Check if a file is selected
-        if file.filename == '':
+        if not files:
             flash('No selected file', 'error')
             return redirect(request.url)
+
+        # Several files or a zip file are processed as a batch across worker processes
+        if len(files) > 1 or is_zip_file(files[0].filename):
+            return upload_batch(files)
+        file = files[0]
         
         # Check if the file is allowed and contains a specific name
         if allowed_file(file.filename) and allowed_file_name(file.filename):
             folder = None
-            if "Individual-Borrower" in file.filename:
-                folder = app.config['INDIVIDUAL_BORROWER_FOLDER']
-            elif "Credit-Information" in file.filename:
-                folder = app.config['CREDIT_INFORMATION_FOLDER']
-            elif "Corporate-Borrower" in file.filename:
-                folder = app.config['CORPORATE_BORROWER_FOLDER']
-            elif "Guarantors-Information" in file.filename:
-                folder = app.config['GUARANTORS_INFORMATION_FOLDER']
-            elif "Principal-Officers" in file.filename:
-                folder = app.config['PRINCIPAL_OFFICERS_FOLDER']
+            file_type = get_file_type(file.filename)
+            if file_type:
+                folder = FILE_SPECS[file_type]['folder']
 
             if folder:
-                # Save the file to the appropriate folder
-                filepath = os.path.join(folder, file.filename)
-                file.save(filepath)
+                # The upload was hashed as it was received; check it is a workbook within
+                # the limits before moving it to the appropriate folder of its workspace
+                validate_upload(file.stream.path, file.filename, app.config['MAX_UPLOAD_ROWS'])
+                workspace = upload_workspace()
+                options = dict(upload_options(), workspace=workspace)
+                filepath = os.path.join(workspace or '', folder, file.filename)
+                file.stream.move_to(filepath)
+                content_hash = file.stream.hexdigest()
+
+                # Queue the file and let the page poll /jobs/<job_id> for the results
+                if app.config['BACKGROUND_JOBS']:
+                    job = submit_job(filepath, file.filename, options, content_hash)
+                    if wants_json():
+                        return jsonify(job_status(job)), 202
+                    return redirect(url_for('upload_file', job=job['id']))
+
                 start_time = time.time()
                 # Process the file
-                process_uploaded_file(filepath)
+                observe_summary(process_uploaded_file(filepath, flash, options, content_hash))
+                if workspace:
+                    remove_workspace(workspace)
                 # Calculate processing time
                 end_time = time.time()
                 processing_time = end_time - start_time
@@ -547,7 +205,109 @@ def upload_file():
         flash('File not allowed! Upload file with correct name and file type.', 'danger')
         return redirect(request.url)
     
-    return render_template('upload.html')
+    return render_template('upload.html', job_id=request.args.get('job'))
+
+# Function to save a multi-file or zip upload and process it as a batch
+def upload_batch(files):
+    workspace = upload_workspace()
+    options = dict(upload_options(), workspace=workspace)
+    file_paths = []
+    content_hashes = []
+    for file in files:
+        if is_zip_file(file.filename):
+            extracted, skipped = extract_zip(file.stream, workspace or '', app.config['MAX_UPLOAD_BYTES'])
+            file_paths.extend(extracted)
+            content_hashes.extend([None] * len(extracted))
+            for filename in skipped:
+                flash(f'{filename} skipped: not an allowed file name, type or size.', 'danger')
+        elif allowed_file(file.filename) and allowed_file_name(file.filename):
+            filepath = os.path.join(workspace or '', FILE_SPECS[get_file_type(file.filename)]['folder'], file.filename)
+            file.stream.move_to(filepath)
+            file_paths.append(filepath)
+            content_hashes.append(file.stream.hexdigest())
+        else:
+            flash(f'{file.filename} skipped: not an allowed file name or type.', 'danger')
+
+    # Files that are damaged or too long are left out of the batch
+    accepted = []
+    for filepath, content_hash in zip(file_paths, content_hashes):
+        try:
+            validate_upload(filepath, filepath, app.config['MAX_UPLOAD_ROWS'])
+        except UploadRejected as e:
+            flash(f'{os.path.basename(filepath)} skipped: {e}', 'danger')
+            os.remove(filepath)
+        else:
+            accepted.append((filepath, content_hash))
+    file_paths = [filepath for filepath, _ in accepted]
+    content_hashes = [content_hash for _, content_hash in accepted]
+
+    if not file_paths:
+        if workspace:
+            remove_workspace(workspace)
+        flash('File not allowed! Upload file with correct name and file type.', 'danger')
+        return redirect(request.url)
+
+    label = ', '.join(file.filename for file in files)
+    if app.config['BACKGROUND_JOBS']:
+        job = submit_batch_job(file_paths, label, app.config['BATCH_WORKERS'], options, content_hashes)
+        if wants_json():
+            return jsonify(job_status(job)), 202
+        return redirect(url_for('upload_file', job=job['id']))
+
+    batch = process_batch(file_paths, app.config['BATCH_WORKERS'], options, content_hashes=content_hashes)
+    for result in batch['files']:
+        observe_summary(result['summary'])
+    if workspace and not any(result['error'] for result in batch['files']):
+        remove_workspace(workspace)
+    for category, message in batch_messages(batch):
+        flash(message, category)
+    return redirect(url_for('upload_file'))
+
+# Job status routes
+@app.route('/jobs')
+def jobs_index():
+    return jsonify([job_status(job) for job in list_jobs()])
+@app.route('/jobs/<job_id>')
+def job_detail(job_id):
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job ID'}), 404
+    return jsonify(job_status(job))
+
+# Server-sent events with the status of a job (stage, rows per second, ETA and
+# messages) each time it changes, ending once the job is done or failed
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job ID'}), 404
+
+    def stream():
+        nonlocal job
+        version = None
+        while True:
+            # An unchanged job is sent again every 15 seconds to keep the connection open
+            job = wait_for_job(job, version, timeout=15)
+            version = job['version']
+            yield f"data: {json.dumps(job_status(job))}\n\n"
+            if job['status'] in ('done', 'failed'):
+                return
+
+    return Response(stream(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# Prometheus metrics: per-stage totals by file type and the job counts
+@app.route('/metrics')
+def prometheus_metrics():
+    return render_metrics(job_counts()), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+# Download route for the pipe-delimited exports, streamed from the processed folder
+@app.route('/download/<filename>')
+def download_text(filename):
+    # Only the base name is used so the path cannot leave the processed folder
+    filepath = os.path.join(PROCESSED_FOLDER, os.path.basename(filename))
+    if not os.path.isfile(filepath):
+        return jsonify({'error': 'Unknown file'}), 404
+    return send_file(os.path.abspath(filepath), as_attachment=True, download_name=os.path.basename(filepath))
 
 if __name__ == "__main__":
    app.run()
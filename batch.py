@@ -0,0 +1,135 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import os, shutil, time, zipfile
+
+from processing import FILE_SPECS, INPUT_EXTENSIONS, get_file_type, institution_name, process_uploaded_file
+from progress import ProgressReporter
+
+# Number of worker processes for a batch (one per core by default)
+BATCH_WORKERS = os.cpu_count() or 1
+
+
+# Function to check if a file name is a workbook or delimited file of a known type
+def is_batch_member(filename):
+    return filename.lower().endswith(INPUT_EXTENSIONS) and get_file_type(filename) is not None
+
+# Function to copy a file into the folder for its type, as the upload route does
+def stage_file(source_path):
+    filename = os.path.basename(source_path)
+    file_path = os.path.join(FILE_SPECS[get_file_type(filename)]['folder'], filename)
+    if os.path.abspath(source_path) != os.path.abspath(file_path):
+        shutil.copyfile(source_path, file_path)
+    return file_path
+
+# Function to extract the workbooks of a zip file into the folders for their types,
+# under `root`. `source` is a path or a file object. Members that unzip to more than
+# `max_bytes` are skipped. Returns the extracted paths and skipped names.
+def extract_zip(source, root='', max_bytes=None):
+    file_paths = []
+    skipped = []
+    with zipfile.ZipFile(source) as archive:
+        for member in archive.infolist():
+            if member.is_dir():
+                continue
+            # Only the base name is used so members cannot escape the type folder
+            filename = os.path.basename(member.filename)
+            if not is_batch_member(filename) or (max_bytes is not None and member.file_size > max_bytes):
+                skipped.append(member.filename)
+                continue
+            file_path = os.path.join(root, FILE_SPECS[get_file_type(filename)]['folder'], filename)
+            with archive.open(member) as src, open(file_path, 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+            file_paths.append(file_path)
+    return file_paths, skipped
+
+# Function run in a worker process: processes one file and collects its messages
+def process_file_in_worker(file_path, options, content_hash=None):
+    messages = []
+
+    def notify(message, category='message'):
+        messages.append((category, message))
+
+    start_time = time.perf_counter()
+    start_cpu = time.process_time()
+    summary = None
+    error = None
+    try:
+        summary = process_uploaded_file(file_path, notify, options, content_hash)
+    except Exception as e:
+        error = str(e)
+        notify(f"Processing failed: {e}", 'danger')
+
+    return {
+        'file_path': file_path,
+        'summary': summary,
+        'messages': messages,
+        'error': error,
+        'wall_time': time.perf_counter() - start_time,
+        'cpu_time': time.process_time() - start_cpu,
+    }
+
+# Function to split a batch into groups of files run one group after another. With
+# the customer index on, the borrower files of each institution are indexed before
+# those of the next, and all of them before the files checked against the index, so
+# the cross-file flags do not depend on which worker runs first. Returns lists of
+# positions in `file_paths`; files without a role go in the first group.
+def batch_waves(file_paths, options=None):
+    if not (options or {}).get('customer_index'):
+        return [list(range(len(file_paths)))]
+    roles = [FILE_SPECS[get_file_type(file_path)].get('customer_index') for file_path in file_paths]
+    waves = {}
+    for position, (file_path, role) in enumerate(zip(file_paths, roles)):
+        if role == 'borrower':
+            waves.setdefault(institution_name(file_path), []).append(position)
+    waves = list(waves.values()) or [[]]
+    waves[0] += [position for position, role in enumerate(roles) if role is None]
+    waves.append([position for position, role in enumerate(roles) if role == 'reference'])
+    return [sorted(wave) for wave in waves if wave]
+
+# Function to process several files across a pool of worker processes.
+# Results come back in the same order as `file_paths`. `progress` is called
+# as files finish, with the files done counted as rows of a 'files' stage.
+# `content_hashes`, if given, has the SHA-256 of each file in the same order.
+def process_batch(file_paths, workers=None, options=None, progress=None, content_hashes=None):
+    workers = max(1, min(workers or BATCH_WORKERS, len(file_paths) or 1))
+    reporter = ProgressReporter(progress, every=1)
+    reporter.stage('files', len(file_paths))
+    start_time = time.perf_counter()
+    content_hashes = content_hashes or [None] * len(file_paths)
+    results = [None] * len(file_paths)
+    files_done = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for wave in batch_waves(file_paths, options):
+            futures = {pool.submit(process_file_in_worker, file_paths[position], options, content_hashes[position]):
+                       position for position in wave}
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+                files_done += 1
+                reporter.rows(files_done)
+    wall_time = time.perf_counter() - start_time
+    cpu_time = sum(result['cpu_time'] for result in results)
+
+    return {
+        'files': results,
+        'workers': workers,
+        'wall_time': wall_time,
+        'cpu_time': cpu_time,
+        # How many cores' worth of work the pool did at once
+        'parallelism': cpu_time / wall_time if wall_time else 0,
+    }
+
+# Function to turn a batch result into messages, file by file, ending with the totals
+def batch_messages(batch):
+    messages = []
+    for result in batch['files']:
+        filename = os.path.basename(result['file_path'])
+        for category, message in result['messages']:
+            messages.append((category, f"{filename}: {message}"))
+        if result['error'] is None:
+            messages.append(('success', f"{filename}: processed in {result['wall_time']:.2f} seconds"))
+
+    failed = sum(1 for result in batch['files'] if result['error'] is not None)
+    messages.append(('success' if not failed else 'danger',
+                     f"Processed {len(batch['files']) - failed} of {len(batch['files'])} files in "
+                     f"{batch['wall_time']:.2f} seconds ({batch['cpu_time']:.2f} seconds of CPU "
+                     f"time across {batch['workers']} processes)"))
+    return messages
@@ -0,0 +1,152 @@
+# Throughput benchmark for the whole pipeline.
+#
+# Generates synthetic workbooks for each file type and size (see synthetic_data.py)
+# and processes each one in a fresh worker process, recording the metrics of every
+# stage (wall and CPU time, rows in and out, memory), the total wall and CPU time,
+# rows per second and the peak RSS of the worker. Results are written as JSON. With --baseline, the totals are compared
+# with an earlier results file and the script exits with status 1 if any case
+# got slower by more than --max-regression.
+#
+#   python benchmarks/bench_pipeline.py --sizes 1000 100000 --output results.json
+#   python benchmarks/bench_pipeline.py --baseline results.json
+import argparse, json, multiprocessing, os, platform, shutil, sys, tempfile, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from processing import FILE_SPECS, ensure_folders, process_uploaded_file
+from metrics import peak_rss
+from synthetic_data import DEFAULT_DIRT, write_workbook
+
+DEFAULT_SIZES = [1000, 100000, 1000000]
+
+# Summary counts copied into the results
+SUMMARY_KEYS = ['rows', 'rows_written', 'duplicates', 'blank_rows', 'invalid_bvn', 'unparsed_dates']
+
+
+# Function run in the worker process: processes a copy of one workbook in an empty folder
+def run_case(source, file_type, workdir, options):
+    os.chdir(workdir)
+    ensure_folders()
+    file_path = os.path.join(FILE_SPECS[file_type]['folder'], f"Benchmark-{file_type}.xlsx")
+    shutil.copyfile(source, file_path)
+
+    start_time = time.perf_counter()
+    start_cpu = time.process_time()
+    summary = process_uploaded_file(file_path, options=options)
+    wall_time = time.perf_counter() - start_time
+    cpu_time = time.process_time() - start_cpu
+
+    return {
+        'wall_time': wall_time,
+        'cpu_time': cpu_time,
+        'rows_per_second': summary['rows'] / wall_time if wall_time else None,
+        'peak_rss': peak_rss(),
+        'stages': summary['stages'],
+        'summary': {key: summary[key] for key in SUMMARY_KEYS},
+        'input_size': os.path.getsize(source),
+    }
+
+# Function to process a workbook in a fresh process, so its peak RSS is its own
+def run_isolated(source, file_type, options):
+    workdir = tempfile.mkdtemp(prefix='dq-bench-')
+    try:
+        context = multiprocessing.get_context('spawn')
+        with context.Pool(1) as pool:
+            return pool.apply(run_case, (source, file_type, workdir, options))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+# Function to find the workbook for a case, generating it the first time
+def workbook_for(data_dir, file_type, rows, seed, dirt):
+    name = f"{file_type}-{rows}-{seed}-" + '-'.join(f"{dirt[key]:g}" for key in sorted(dirt)) + '.xlsx'
+    path = os.path.join(data_dir, name)
+    generated = None
+    if not os.path.exists(path):
+        start = time.perf_counter()
+        write_workbook(path + '.tmp', file_type, rows, seed, **dirt)
+        os.replace(path + '.tmp', path)
+        generated = time.perf_counter() - start
+    return path, generated
+
+# Function to compare results with a baseline. Returns a line per slower case.
+def regressions(results, baseline, max_regression):
+    previous = {(case['file_type'], case['rows']): case for case in baseline['results']}
+    slower = []
+    for case in results:
+        before = previous.get((case['file_type'], case['rows']))
+        if before and case['wall_time'] > before['wall_time'] * max_regression:
+            slower.append(f"{case['file_type']} {case['rows']} rows: {before['wall_time']:.2f}s -> "
+                          f"{case['wall_time']:.2f}s")
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline on synthetic workbooks")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help="data rows per workbook")
+    parser.add_argument('--types', nargs='+', choices=list(FILE_SPECS), default=list(FILE_SPECS), help="file types")
+    parser.add_argument('--engine', choices=['openpyxl', 'pandas'], default='openpyxl', help="cleaning engine")
+    parser.add_argument('--streaming', choices=['auto', 'always', 'never'], default='auto',
+                        help="streaming mode: by file size (default), for every file or never")
+    parser.add_argument('--seed', type=int, default=0, help="random seed for the synthetic data")
+    for name, share in DEFAULT_DIRT.items():
+        parser.add_argument('--' + name.replace('_', '-'), type=float, default=share,
+                            help=f"share of rows with {name.replace('_', ' ')} (default {share})")
+    parser.add_argument('--data-dir', help="folder to keep generated workbooks in between runs")
+    parser.add_argument('--output', help="JSON results file (default: print to stdout)")
+    parser.add_argument('--baseline', help="earlier JSON results to compare with")
+    parser.add_argument('--max-regression', type=float, default=1.25,
+                        help="allowed wall time ratio against the baseline (default 1.25)")
+    args = parser.parse_args()
+
+    dirt = {name: getattr(args, name) for name in DEFAULT_DIRT}
+    options = {'engine': args.engine}
+    if args.streaming != 'auto':
+        options['streaming_min_file_size'] = 0 if args.streaming == 'always' else float('inf')
+
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix='dq-bench-data-')
+    os.makedirs(data_dir, exist_ok=True)
+    results = []
+    try:
+        for rows in args.sizes:
+            for file_type in args.types:
+                source, generated = workbook_for(data_dir, file_type, rows, args.seed, dirt)
+                case = dict(file_type=file_type, rows=rows, generate_time=generated,
+                            **run_isolated(source, file_type, options))
+                results.append(case)
+                print(f"{file_type:<24} {rows:>9} rows  {case['wall_time']:8.2f}s  "
+                      f"{case['rows_per_second'] or 0:10.0f} rows/s  "
+                      f"{(case['peak_rss'] or 0) / 1024 / 1024:8.1f} MB peak", file=sys.stderr)
+    finally:
+        if not args.data_dir:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    report = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'engine': args.engine,
+        'streaming': args.streaming,
+        'seed': args.seed,
+        'dirt': dirt,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            slower = regressions(results, json.load(baseline_file), args.max_regression)
+        for line in slower:
+            print(f"Slower than baseline: {line}", file=sys.stderr)
+        sys.exit(1 if slower else 0)
+
+
+if __name__ == '__main__':
+    main()
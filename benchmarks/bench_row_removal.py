@@ -0,0 +1,79 @@
+# Regression benchmark for bulk row removal.
+#
+# Builds sheets where every other data row has to be removed and times
+# processing.delete_rows_from_original as the number of removed rows grows.
+# The time per removed row should stay flat; the script exits with status 1
+# if it grows by more than --max-growth between the smallest and largest size.
+#
+#   python benchmarks/bench_row_removal.py
+#   python benchmarks/bench_row_removal.py --compare   # also time per-row sheet.delete_rows
+import argparse, gc, os, sys, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import openpyxl
+from processing import delete_rows_from_original
+
+COLUMNS = 10
+
+
+# Function to build a sheet with `rows` data rows below a header
+def build_sheet(rows):
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.append([f"Column {col}" for col in range(COLUMNS)])
+    for row in range(rows):
+        sheet.append([f"{row}-{col}" for col in range(COLUMNS)])
+    return sheet
+
+
+# Function to time one removal of every other data row
+def time_removal(rows, remove):
+    sheet = build_sheet(rows)
+    row_indices = list(range(2, rows + 2, 2))
+    gc.collect()
+    start = time.perf_counter()
+    remove(sheet, row_indices)
+    elapsed = time.perf_counter() - start
+
+    # Check the kept rows were moved up in order
+    assert sheet.max_row == rows - len(row_indices) + 1
+    assert sheet.cell(row=2, column=1).value == "1-0"
+    return len(row_indices), elapsed
+
+
+# Old behaviour: one sheet.delete_rows call per row, bottom up
+def delete_rows_one_by_one(sheet, row_indices):
+    for row_idx in sorted(row_indices, reverse=True):
+        sheet.delete_rows(row_idx)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark bulk row removal")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[2000, 8000, 32000, 128000],
+                        help="data rows per sheet (half of them are removed)")
+    parser.add_argument('--max-growth', type=float, default=3.0,
+                        help="allowed growth of the time per removed row")
+    parser.add_argument('--compare', action='store_true',
+                        help="also time per-row sheet.delete_rows on the two smallest sizes")
+    args = parser.parse_args()
+
+    print(f"{'removed rows':>12} {'bulk (s)':>10} {'us/row':>8}" + (f" {'per-row (s)':>12}" if args.compare else ""))
+    per_row = []
+    for index, rows in enumerate(args.sizes):
+        removed, elapsed = time_removal(rows, delete_rows_from_original)
+        per_row.append(elapsed / removed)
+        line = f"{removed:>12} {elapsed:>10.4f} {elapsed / removed * 1e6:>8.2f}"
+        if args.compare and index < 2:
+            line += f" {time_removal(rows, delete_rows_one_by_one)[1]:>12.4f}"
+        print(line)
+
+    growth = per_row[-1] / per_row[0]
+    print(f"time per removed row grew {growth:.2f}x from {args.sizes[0]} to {args.sizes[-1]} rows")
+    if growth > args.max_growth:
+        print(f"FAIL: growth above {args.max_growth}x, row removal is no longer linear")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
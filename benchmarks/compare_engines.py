@@ -0,0 +1,115 @@
+# Cross-check of the openpyxl and pandas engines.
+#
+# Processes a copy of each workbook with both engines in separate working
+# folders and checks that the cleaned workbook, the text file, the exception
+# workbook, the messages and the summary counts are identical. With --row-workers
+# the file is also processed in streaming mode, parsed in row chunks across that
+# many processes (see chunked.py). The cleaned workbook and text file must also be
+# no wider than the source, as rows are only padded for the rules to read. Exits
+# with status 1 on any difference.
+#
+#   python benchmarks/compare_engines.py individual_borrower/Bank-Individual-Borrower.xlsx ...
+import argparse, os, shutil, sys, tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from openpyxl import load_workbook
+from processing import FILE_SPECS, ensure_folders, get_file_type, process_uploaded_file
+
+SUMMARY_KEYS = ['rows', 'rows_written', 'duplicates', 'blank_rows', 'invalid_bvn', 'unparsed_dates', 'changes']
+
+
+# Function to process a copy of `source` with one engine in an empty working folder
+def run_engine(source, engine, workdir, row_workers=None):
+    os.makedirs(workdir)
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        ensure_folders()
+        filename = os.path.basename(source)
+        file_path = os.path.join(FILE_SPECS[get_file_type(filename)]['folder'], filename)
+        shutil.copyfile(source, file_path)
+        messages = []
+        summary = process_uploaded_file(file_path, lambda message, category='message': messages.append((category, message)),
+                                        {'engine': engine, 'row_workers': row_workers,
+                                         'streaming_min_file_size': 0 if row_workers else float('inf')})
+        outputs = {name: read_output(path) for name, path in summary['outputs'].items()}
+        widths = {name: output_width(summary['outputs'][name]) for name in ('xlsx', 'text') if name in summary['outputs']}
+    finally:
+        os.chdir(cwd)
+    return messages, {key: summary[key] for key in SUMMARY_KEYS}, outputs, summary['timings'], widths
+
+# Function to strip the trailing empty cells that read-only sheets pad rows with
+def trim_row(row):
+    row = list(row)
+    while row and row[-1] is None:
+        row.pop()
+    return row
+
+# Function to find the width of a cleaned workbook (from its dimension, which the
+# in-memory engine keeps, or its widest row) or of a text file (its widest line)
+def output_width(path):
+    if path.endswith('.xlsx'):
+        workbook = load_workbook(path, read_only=True)
+        sheet = workbook.active
+        width = sheet.max_column
+        if width is None:
+            sheet.reset_dimensions()
+            width = max((len(row) for row in sheet.iter_rows(values_only=True)), default=0)
+        workbook.close()
+        return width
+    with open(path, encoding='utf-8') as text_file:
+        return max((line.count('|') + 1 for line in text_file), default=0)
+
+# Function to get the width of the active sheet of a source workbook
+def source_width(path):
+    workbook = load_workbook(path, read_only=True)
+    width = workbook.active.max_column
+    workbook.close()
+    return width
+
+# Function to read an output file as comparable values (the rows of every sheet for workbooks)
+def read_output(path):
+    if path.endswith('.xlsx'):
+        workbook = load_workbook(path, read_only=True)
+        sheets = {sheet.title: [trim_row(row) for row in sheet.iter_rows(values_only=True)]
+                  for sheet in workbook.worksheets}
+        workbook.close()
+        return sheets
+    with open(path, 'rb') as output_file:
+        return output_file.read()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cross-check the openpyxl and pandas engines")
+    parser.add_argument('files', nargs='+', help="workbooks to process with both engines")
+    parser.add_argument('--row-workers', type=int, help="also process each file in row chunks across this many processes")
+    args = parser.parse_args()
+
+    failed = False
+    for source in args.files:
+        source = os.path.abspath(source)
+        workdir = tempfile.mkdtemp()
+        try:
+            results = {engine: run_engine(source, engine, os.path.join(workdir, engine))
+                       for engine in ('openpyxl', 'pandas')}
+            if args.row_workers:
+                results['chunked'] = run_engine(source, 'openpyxl', os.path.join(workdir, 'chunked'), args.row_workers)
+        finally:
+            shutil.rmtree(workdir)
+
+        differences = [name for index, name in enumerate(['messages', 'summary', 'outputs'])
+                       if any(result[index] != results['openpyxl'][index] for result in results.values())]
+        width = source_width(source)
+        differences += [f"{engine} width" for engine, result in results.items()
+                        if width is not None and any(value > width for value in result[4].values())]
+        timings = ', '.join(f"{engine} {sum(result[3].values()):.2f}s" for engine, result in results.items())
+        print(f"{os.path.basename(source)}: {'differs in ' + ', '.join(differences) if differences else 'identical'} ({timings})")
+        failed = failed or bool(differences)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
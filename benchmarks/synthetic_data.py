@@ -0,0 +1,167 @@
+# Synthetic CDT workbooks for benchmarks and manual testing.
+#
+# Builds workbooks with the column layout of each file type in FILE_SPECS:
+# required columns are filled, column I holds an 11-digit BVN, date and gender
+# columns hold the values the rules format. The share of duplicate rows, blank
+# required cells, BVNs not starting with 2 and messy dates can be tuned.
+#
+#   python benchmarks/synthetic_data.py Individual-Borrower 100000 --duplicates 0.05
+import argparse, datetime, os, random, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import openpyxl
+from openpyxl.utils import get_column_letter
+from processing import FILE_SPECS, compile_rules
+
+# Default share of rows with each kind of problem
+DEFAULT_DIRT = {
+    'duplicates': 0.02,
+    'blanks': 0.01,
+    'bad_bvn': 0.01,
+    'messy_dates': 0.05,
+}
+
+# Extra free-text columns after the last column the rules read
+EXTRA_COLUMNS = 4
+
+# Number of recent rows that duplicates are copied from
+DUPLICATE_POOL = 1000
+
+FIRST_NAMES = ['Adaeze', 'Babatunde', 'Chinedu', 'Damilola', 'Emeka', 'Funmilayo', 'Ibrahim', 'Ngozi', 'Olumide', 'Yetunde']
+LAST_NAMES = ['Adeyemi', 'Bello', 'Eze', 'Ibrahim', 'Nwosu', 'Ogunleye', 'Okafor', 'Okonkwo', 'Suleiman', 'Usman']
+STREETS = ['Allen Avenue', 'Awolowo Road', 'Broad Street', 'Herbert Macaulay Way', 'Marina Road', 'Ozumba Mbadiwe Avenue']
+CITIES = ['Abuja', 'Enugu', 'Ibadan', 'Kano', 'Lagos', 'Port Harcourt']
+GENDERS = ['M', 'F', 'Male', 'Female']
+UNPARSEABLE_DATES = ['N/A', 'unknown', '31/02/2020', '00/00/0000', 'TBD']
+
+
+# Function to make the header row for a file type
+def header_row(spec, width):
+    names = {spec['bvn_column']: 'BVN'}
+    for col in spec['date_columns']:
+        names[col] = f"Date {col}"
+    for col in spec['gender_columns']:
+        names[col] = f"Gender {col}"
+    return [names.get(get_column_letter(col_idx), f"Field {get_column_letter(col_idx)}")
+            for col_idx in range(1, width + 1)]
+
+# Function to make a well-formed date in one of the formats the uploads use
+def clean_date(rnd):
+    day = datetime.date(1950, 1, 1) + datetime.timedelta(days=rnd.randrange(27000))
+    choice = rnd.random()
+    if choice < 0.4:
+        return day.strftime('%d/%m/%Y')
+    if choice < 0.6:
+        return day.strftime('%Y-%m-%d')
+    if choice < 0.8:
+        return day.strftime('%d-%b-%Y')
+    return datetime.datetime(day.year, day.month, day.day)
+
+# Function to make a date that needs the slow parser or cannot be parsed at all
+def messy_date(rnd):
+    day = datetime.date(1950, 1, 1) + datetime.timedelta(days=rnd.randrange(27000))
+    choice = rnd.random()
+    if choice < 0.3:
+        return day.strftime('%B %d, %Y')
+    if choice < 0.6:
+        return day.strftime('%d %b %y')
+    if choice < 0.8:
+        return day.strftime('%d.%m.%Y ') + '00:00'
+    return rnd.choice(UNPARSEABLE_DATES)
+
+# Function to make a free-text value, sometimes with characters the cleaning removes
+def text_value(rnd, col_idx):
+    kind = col_idx % 4
+    if kind == 0:
+        value = f"{rnd.choice(FIRST_NAMES)} {rnd.choice(LAST_NAMES)}"
+    elif kind == 1:
+        value = f"{rnd.randint(1, 250)} {rnd.choice(STREETS)}, {rnd.choice(CITIES)}"
+    elif kind == 2:
+        value = f"{rnd.randrange(10 ** 9, 10 ** 10)}"
+    else:
+        value = f"ACC{rnd.randrange(10 ** 7, 10 ** 8)}"
+
+    dirt = rnd.random()
+    if dirt < 0.01:
+        value = value + '|'
+    elif dirt < 0.02:
+        value = value.replace(' ', '\r\n', 1)
+    elif dirt < 0.03 and kind == 2:
+        value = value[:4] + 'E+' + value[4:]
+    return value
+
+# Function to make one data row
+def data_row(rnd, spec, rules, width, dirt):
+    bvn = rules['bvn']
+    dates = set(rules['dates'])
+    genders = set(rules['genders'])
+
+    row = []
+    for col_idx in range(width):
+        if col_idx == bvn:
+            first = rnd.choice('13456789') if rnd.random() < dirt['bad_bvn'] else '2'
+            value = first + str(rnd.randrange(10 ** 9, 10 ** 10))
+        elif col_idx in dates:
+            value = messy_date(rnd) if rnd.random() < dirt['messy_dates'] else clean_date(rnd)
+        elif col_idx in genders:
+            value = rnd.choice(GENDERS)
+        else:
+            value = text_value(rnd, col_idx)
+        row.append(value)
+
+    if rnd.random() < dirt['blanks']:
+        row[rnd.choice(rules['required'])] = rnd.choice([None, ''])
+    return row
+
+# Function to generate rows for a file type, `rows` data rows after the header
+def generate_rows(file_type, rows, seed=0, **dirt):
+    dirt = dict(DEFAULT_DIRT, **dirt)
+    spec = FILE_SPECS[file_type]
+    rules = compile_rules(spec)
+    width = rules['width'] + EXTRA_COLUMNS
+    rnd = random.Random(seed)
+
+    yield header_row(spec, width)
+    recent = []
+    for _ in range(rows):
+        if recent and rnd.random() < dirt['duplicates']:
+            yield list(rnd.choice(recent))
+            continue
+        row = data_row(rnd, spec, rules, width, dirt)
+        if len(recent) < DUPLICATE_POOL:
+            recent.append(row)
+        else:
+            recent[rnd.randrange(DUPLICATE_POOL)] = row
+        yield row
+
+# Function to write a synthetic workbook. Rows are streamed to a write-only
+# workbook so large files can be generated without holding them in memory.
+def write_workbook(path, file_type, rows, seed=0, **dirt):
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet('Sheet1')
+    for row in generate_rows(file_type, rows, seed, **dirt):
+        sheet.append(row)
+    workbook.save(path)
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic CDT workbook")
+    parser.add_argument('file_type', choices=list(FILE_SPECS), help="file type to generate")
+    parser.add_argument('rows', type=int, help="number of data rows")
+    parser.add_argument('--output', help="workbook path (default: Synthetic-<file type>.xlsx)")
+    parser.add_argument('--seed', type=int, default=0, help="random seed")
+    for name, share in DEFAULT_DIRT.items():
+        parser.add_argument('--' + name.replace('_', '-'), type=float, default=share,
+                            help=f"share of rows with {name.replace('_', ' ')} (default {share})")
+    args = parser.parse_args(argv)
+
+    path = args.output or f"Synthetic-{args.file_type}.xlsx"
+    write_workbook(path, args.file_type, args.rows, args.seed,
+                   **{name: getattr(args, name) for name in DEFAULT_DIRT})
+    print(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,237 @@
+# Parsing and checking one large sheet in row chunks across worker processes.
+#
+# Reading the sheet XML is the slowest part of a large file, so the parent process
+# cuts the unzipped XML into chunks of whole rows and each worker parses its chunks
+# with openpyxl's own sheet parser and applies the row-local rules (cleaning, blank,
+# BVN, date and gender checks) to every row. The parent takes the chunks back in
+# order and makes the decisions that depend on the rows before: missing rows are
+# filled in as iter_rows does, duplicates are found with the same deduplicator, and
+# the rule results of duplicates are dropped. The rows and statuses that come out are
+# the same as from fused_pass over iter_rows, so the outputs are identical.
+import io, re, zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from openpyxl import load_workbook
+from openpyxl.worksheet._reader import WorkSheetParser
+
+from dates import add_date_counts, new_date_counts
+from dedup import key_digest
+from processing import apply_row_rules, apply_rule_result, clean_row, row_rule_result
+
+# Bytes of sheet XML in each chunk (about 10,000 rows of a CDT file)
+ROW_CHUNK_BYTES = 4 * 1024 * 1024
+
+# Bytes read from the zip at a time
+READ_SIZE = 1024 * 1024
+
+# Chunks handed to the pool ahead of the one being merged, per worker
+CHUNKS_AHEAD = 2
+
+ROW_PATTERN = re.compile(rb'<(?:\w{1,10}:)?row[\s>/]')
+ROW_NUMBER_PATTERN = re.compile(rb'\sr\s*=\s*["\']')
+ROOT_PATTERN = re.compile(rb'<(\w{1,10}:)?worksheet[\s>]')
+SHEET_DATA_PATTERN = re.compile(rb'<(\w{1,10}:)?sheetData[\s>]')
+# A shared formula is written once and referred to by later cells, so the rows
+# after it cannot be parsed apart from it
+SHARED_FORMULA_PATTERN = re.compile(rb'\st\s*=\s*["\']shared["\']')
+
+# Options of the sheet parser for the file a worker is parsing, kept between chunks
+worker_parser_options = {}
+
+
+# Function to find the start of the first row in `buffer` from `pos` that can begin
+# a chunk: one with its row number, as the parser counts on from the row before
+# when it is missing
+def next_row_start(buffer, row_tag, pos):
+    while True:
+        pos = buffer.find(row_tag, pos)
+        if pos == -1:
+            return None
+        end = buffer.find(b'>', pos)
+        if end == -1:
+            return None
+        if buffer[pos + len(row_tag):pos + len(row_tag) + 1].isspace() and ROW_NUMBER_PATTERN.search(buffer, pos, end):
+            return pos
+        pos += len(row_tag)
+
+# Function to build the tags that close a chunk cut before the end of the sheet
+def closing_tags(head):
+    root = ROOT_PATTERN.search(head)
+    sheet_data = SHEET_DATA_PATTERN.search(head)
+    return b'</' + (sheet_data.group(1) or b'') + b'sheetData></' + (root.group(1) or b'') + b'worksheet>'
+
+# Function to get the parser options of a workbook in a worker process. The shared
+# strings and date styles are read once per worker, not once per chunk.
+def parser_options(file_path):
+    if file_path not in worker_parser_options:
+        workbook = load_workbook(file_path, read_only=True)
+        worker_parser_options.clear()
+        worker_parser_options[file_path] = {
+            'shared_strings': workbook.shared_strings,
+            'data_only': workbook.data_only,
+            'epoch': workbook.epoch,
+            'date_formats': workbook._date_formats,
+            'timedelta_formats': workbook._timedelta_formats,
+        }
+        workbook.close()
+    return worker_parser_options[file_path]
+
+# Function to turn the cells of a parsed row into values, as iter_rows does
+def row_values(cells, max_col):
+    if not cells and not max_col:
+        return ()
+    width = max_col or cells[-1]['column']
+    values = [None] * width
+    for cell in cells:
+        if 1 <= cell['column'] <= width:
+            values[cell['column'] - 1] = cell['value']
+    return tuple(values)
+
+# Function run in a worker process: parses one chunk of a sheet and applies the row
+# rules to a copy of every row. Returns one entry per row (the row number, its values,
+# its duplicate digest, and its status, changed cells and cleaning counts as a data
+# row) and the date counters of the chunk.
+def parse_chunk(file_path, document, max_col, width, rules):
+    parser = WorkSheetParser(io.BytesIO(document), **parser_options(file_path))
+    entries = []
+    dates = new_date_counts()
+    for idx, cells in parser.parse():
+        values = row_values(cells, max_col)
+        row = list(values)
+        if len(row) < width:
+            row.extend([None] * (width - len(row)))
+        status, patch, changes = row_rule_result(row, rules, dates)
+        entries.append((idx, values, key_digest(row, rules['dedup']), status, patch,
+                        changes if any(changes.values()) else None))
+    return entries, dates
+
+
+# The rows of the active sheet of a workbook, parsed in chunks across `workers`
+# processes. `rows` yields the row values in the order iter_rows would, and
+# `rule_pass` takes them (padded, and through the parse cache if it is on) and
+# yields the same (status, row) pairs as fused_pass.
+class SheetChunks:
+    def __init__(self, file_path, rules, workers, chunk_bytes=ROW_CHUNK_BYTES):
+        self.file_path = file_path
+        self.rules = rules
+        self.workers = workers
+        self.chunk_bytes = chunk_bytes
+        self.executor = None
+        self.chunks = 0
+        # Worker results of the rows passed on, or None for rows filled in
+        self.results = deque()
+        # Date counters of the chunks taken back so far
+        self.dates = new_date_counts()
+
+    # Function to cut the XML of a sheet into documents of whole rows that parse on their own
+    def documents(self, worksheet_path):
+        with zipfile.ZipFile(self.file_path) as archive, archive.open(worksheet_path) as source:
+            head = None
+            shared = False
+            buffer = b''
+            for data in iter(lambda: source.read(READ_SIZE), b''):
+                buffer += data
+                if head is None:
+                    match = ROW_PATTERN.search(buffer)
+                    if match is None:
+                        continue
+                    head, buffer = buffer[:match.start()], buffer[match.start():]
+                    row_tag = match.group(0)[:-1]
+                    tail = closing_tags(head)
+
+                while not shared and len(buffer) > self.chunk_bytes:
+                    cut = next_row_start(buffer, row_tag, self.chunk_bytes)
+                    if cut is None:
+                        break
+                    if SHARED_FORMULA_PATTERN.search(buffer, 0, cut):
+                        # The rest of the sheet goes in one chunk
+                        shared = True
+                        break
+                    yield head + buffer[:cut] + tail
+                    buffer = buffer[cut:]
+            # The last chunk has the real end of the sheet
+            if head is not None:
+                yield head + buffer
+
+    # Function to yield the rows of the sheet, filling in missing rows and stopping
+    # after the last row of the sheet dimension, as ReadOnlyWorksheet does
+    def rows(self, sheet):
+        max_col = sheet.max_column
+        max_row = sheet.max_row
+        width = max(max_col or 0, self.rules['width'])
+        empty_row = (None,) * max_col if max_col is not None else []
+        self.executor = ProcessPoolExecutor(max_workers=self.workers)
+
+        counter = 1
+        idx = 1
+        pending = deque()
+        documents = self.documents(sheet._worksheet_path)
+        while True:
+            # Keep the pool busy while the oldest chunk is merged
+            while len(pending) <= self.workers * CHUNKS_AHEAD:
+                document = next(documents, None)
+                if document is None:
+                    break
+                pending.append(self.executor.submit(parse_chunk, self.file_path, document, max_col, width, self.rules))
+                self.chunks += 1
+            if not pending:
+                break
+
+            stop = False
+            entries, dates = pending.popleft().result()
+            add_date_counts(self.dates, dates)
+            for entry in entries:
+                idx = entry[0]
+                if max_row is not None and idx > max_row:
+                    stop = True
+                    break
+                # Some rows are missing
+                while counter < idx:
+                    counter += 1
+                    self.results.append(None)
+                    yield empty_row
+                if counter == idx:
+                    counter += 1
+                    self.results.append(entry)
+                    yield entry[1]
+            if stop:
+                break
+
+        if max_row is not None and max_row < idx:
+            for _ in range(counter, max_row + 1):
+                self.results.append(None)
+                yield empty_row
+
+    # Function to pass over the rows yielded by `rows` (header first), using the rule
+    # results of the workers. Rows filled in go through the rules here. The date
+    # counters of the workers are added to `dates` at the end.
+    def rule_pass(self, rows, changes, deduplicator, dates=None):
+        for row_num, row in enumerate(rows, start=1):
+            result = self.results.popleft()
+            if row_num == 1:
+                clean_row(row, changes)
+                yield 'header', row
+                continue
+
+            if result is None:
+                if deduplicator.seen(row):
+                    yield 'duplicate', row
+                else:
+                    yield apply_row_rules(row, self.rules, changes, dates), row
+                continue
+
+            _, _, digest, status, patch, row_changes = result
+            if deduplicator.seen_digest(digest):
+                yield 'duplicate', row
+                continue
+            apply_rule_result(row, patch, row_changes, changes)
+            yield status, row
+        if dates is not None:
+            add_date_counts(dates, self.dates)
+
+    # Function to stop the worker processes
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
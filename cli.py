@@ -0,0 +1,297 @@
+# Command line entry point for processing CDT files without the web app.
+#
+#   python cli.py process drops/ month-end.zip --workers 8 --force
+#   python cli.py watch /srv/sftp/inbox --interval 10
+#   python cli.py replay --workers 8
+#
+# Files go through the same pipeline as /upload (see batch.py): each workbook is
+# copied into the folder for its type and processed across worker processes.
+# Files processed before are recorded in a ledger by content hash and skipped,
+# unless --force is given. openpyxl, dateutil and the processing modules are only
+# imported once there is a file to process, so an idle watch stays light. `replay`
+# runs the current rules again over the uploads kept in the parse cache.
+import argparse, hashlib, json, os, sys, time
+
+# Ledger of processed files, kept in the working folder
+LEDGER_FILE = 'processed_files.json'
+
+# Seconds between two looks at the watched folder
+WATCH_INTERVAL = 5
+
+# Size of the chunks read while hashing a file
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Extensions picked up from folders; file types are checked once processing is imported
+SOURCE_EXTENSIONS = ('.xlsx', '.csv', '.tsv', '.txt', '.zip')
+
+
+# Function to check if a file in a folder should be picked up. Hidden files and
+# Excel lock files (~$name.xlsx) are left alone.
+def is_source_file(filename):
+    return (filename.lower().endswith(SOURCE_EXTENSIONS)
+            and not filename.startswith(('.', '~$')))
+
+# Function to list the files named on the command line, looking inside folders
+def list_sources(paths):
+    sources = []
+    for path in paths:
+        if os.path.isdir(path):
+            for filename in sorted(os.listdir(path)):
+                file_path = os.path.join(path, filename)
+                if is_source_file(filename) and os.path.isfile(file_path):
+                    sources.append(file_path)
+        elif os.path.isfile(path):
+            sources.append(path)
+        else:
+            print(f"Skipping {path}: not found", file=sys.stderr)
+    return sources
+
+# Function to hash a file with SHA-256 (the same hash the result cache uses)
+def hash_file(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as source:
+        for chunk in iter(lambda: source.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# Function to get the size and modification time used to tell if a file changed
+def file_state(file_path):
+    stat = os.stat(file_path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+# Remembers which files were processed, by content hash, in a JSON file.
+# Entries also keep the name, size and modification time the file had, so an
+# unchanged file is recognised without reading it again.
+class Ledger:
+    def __init__(self, path=LEDGER_FILE):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path) as ledger_file:
+                self.entries = json.load(ledger_file)
+        self.states = {(entry['name'], entry['size'], entry['mtime']): content_hash
+                       for content_hash, entry in self.entries.items()}
+
+    # Function to get the hash of a file, without reading it if the ledger already has it
+    def content_hash(self, file_path):
+        size, mtime = file_state(file_path)
+        known = self.states.get((os.path.basename(file_path), size, mtime))
+        return known or hash_file(file_path)
+
+    # Function to check if a file with this content was processed before
+    def seen(self, content_hash):
+        return content_hash in self.entries
+
+    # Function to record a processed file
+    def add(self, file_path, content_hash):
+        size, mtime = file_state(file_path)
+        name = os.path.basename(file_path)
+        self.entries[content_hash] = {
+            'name': name,
+            'size': size,
+            'mtime': mtime,
+            'processed_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        }
+        self.states[(name, size, mtime)] = content_hash
+
+    # Function to write the ledger, replacing the old file in one step
+    def save(self):
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as ledger_file:
+            json.dump(self.entries, ledger_file, indent=2)
+        os.replace(temp_path, self.path)
+
+
+# Function to process source files (workbooks or zips) as one batch and record
+# the ones that went through in the ledger. `sources` is a list of (path, hash).
+# Returns the number of sources that failed.
+def process_sources(sources, args, ledger):
+    # Imported here so the commands start without openpyxl and the processing modules
+    from processing import ensure_folders
+    from batch import batch_messages, extract_zip, is_batch_member, process_batch, stage_file
+
+    ensure_folders()
+    staged = []
+    for source_path, content_hash in sources:
+        if source_path.lower().endswith('.zip'):
+            file_paths, skipped = extract_zip(source_path)
+            for name in skipped:
+                print(f"Skipping {name} in {source_path}: not a known file type", file=sys.stderr)
+        elif is_batch_member(source_path):
+            file_paths = [stage_file(source_path)]
+        else:
+            print(f"Skipping {source_path}: not a known file type", file=sys.stderr)
+            continue
+        staged.append((source_path, content_hash, file_paths))
+
+    file_paths = [file_path for _, _, paths in staged for file_path in paths]
+    if not file_paths:
+        return 0
+
+    batch = process_batch(file_paths, args.workers, processing_options(args))
+    for category, message in batch_messages(batch):
+        print(f"[{category}] {message}", flush=True)
+
+    failed_paths = {result['file_path'] for result in batch['files'] if result['error'] is not None}
+    failed = 0
+    for source_path, content_hash, paths in staged:
+        if failed_paths.intersection(paths):
+            failed += 1
+        else:
+            ledger.add(source_path, content_hash)
+    ledger.save()
+    return failed
+
+# Function to build the processing options from the command line flags, which are
+# stored under the names of the app config settings
+def processing_options(args):
+    from processing import options_from_settings
+    return options_from_settings(vars(args))
+
+# Function to pick the sources not processed before, with their hashes
+def new_sources(source_paths, ledger, force=False):
+    sources = []
+    for source_path in source_paths:
+        content_hash = ledger.content_hash(source_path)
+        if force or not ledger.seen(content_hash):
+            sources.append((source_path, content_hash))
+    return sources
+
+
+# Function for the process command: processes the named files and folders once
+def process_command(args):
+    ledger = Ledger(args.ledger)
+    source_paths = list_sources(args.paths)
+    sources = new_sources(source_paths, ledger, args.force)
+    if len(sources) < len(source_paths):
+        print(f"Skipping {len(source_paths) - len(sources)} files processed before", file=sys.stderr)
+    if not sources:
+        print("No new files to process.", file=sys.stderr)
+        return 0
+    return 1 if process_sources(sources, args, ledger) else 0
+
+# Function for the watch command: looks at the inbox every interval and processes
+# new files once their size and modification time stop changing between two looks,
+# so files still being copied in are left until they are complete.
+def watch_command(args):
+    ledger = Ledger(args.ledger)
+    previous = {}
+    # Hashes of files that failed, so they are not retried until their content changes
+    failed = set()
+    print(f"Watching {args.inbox} every {args.interval:g} seconds", file=sys.stderr)
+    while True:
+        current = {}
+        for file_path in list_sources([args.inbox]):
+            try:
+                current[file_path] = file_state(file_path)
+            except FileNotFoundError:
+                continue
+
+        # With --once there is no earlier look, so every file is taken as complete
+        settled = [file_path for file_path, state in current.items()
+                   if args.once or previous.get(file_path) == state]
+        sources = [(source_path, content_hash) for source_path, content_hash
+                   in new_sources(settled, ledger, args.force) if content_hash not in failed]
+        if sources:
+            process_sources(sources, args, ledger)
+            failed.update(content_hash for _, content_hash in sources if not ledger.seen(content_hash))
+            if args.force:
+                # --force reprocesses what is in the inbox at start, not on every look
+                args.force = False
+
+        if args.once:
+            return 0
+        previous = current
+        time.sleep(args.interval)
+
+# Function for the replay command: processes the uploads kept in the parse cache
+# again, reading their parsed sheets instead of the workbooks, which were replaced
+# by the cleaned files. Only the latest upload of each file name is replayed, unless
+# uploads are named by hash.
+def replay_command(args):
+    from processing import FILE_SPECS, ensure_folders, get_file_type
+    from batch import batch_messages, process_batch
+    from parse_cache import cached_uploads
+
+    uploads = {}
+    for content_hash, file_name in cached_uploads():
+        if not args.uploads or file_name in args.uploads or content_hash in args.uploads:
+            key = content_hash if content_hash in args.uploads else file_name
+            uploads[key] = (content_hash, file_name)
+    if not uploads:
+        print("No uploads in the parse cache to replay.", file=sys.stderr)
+        return 0
+
+    ensure_folders()
+    content_hashes = [content_hash for content_hash, _ in uploads.values()]
+    file_paths = [os.path.join(FILE_SPECS[get_file_type(file_name)]['folder'], file_name)
+                  for _, file_name in uploads.values()]
+    batch = process_batch(file_paths, args.workers, dict(processing_options(args), parse_cache=True),
+                          content_hashes=content_hashes)
+    for category, message in batch_messages(batch):
+        print(f"[{category}] {message}", flush=True)
+    return 1 if any(result['error'] for result in batch['files']) else 0
+
+
+# Function to add the processing flags shared by the commands. Each is stored under
+# the name of its app config setting (see OPTION_SETTINGS in processing.py).
+def add_processing_arguments(parser):
+    parser.add_argument('--workers', type=int, metavar='N', help="number of worker processes (default: one per core)")
+    parser.add_argument('--engine', dest='PROCESSING_ENGINE', choices=['openpyxl', 'pandas'], help="cleaning engine")
+    parser.add_argument('--streaming-min-file-size', dest='STREAMING_MIN_FILE_SIZE', type=int, metavar='BYTES',
+                        help="bytes from which files are processed in streaming mode (0 for every file)")
+    parser.add_argument('--cache', dest='RESULT_CACHE', action='store_true',
+                        help="reuse the results of identical files processed before")
+    parser.add_argument('--text-compression', dest='TEXT_COMPRESSION', choices=['gzip'], help="compress the text export")
+    parser.add_argument('--exception-export', dest='EXCEPTION_EXPORT', choices=['csv', 'parquet'],
+                        help="also export the exceptions as a table")
+    parser.add_argument('--profile', dest='PROFILE_JOBS', action='store_true',
+                        help="dump cProfile stats of each file to the profiles folder")
+    parser.add_argument('--customer-index', dest='CUSTOMER_INDEX', metavar='PATH', help="SQLite customer index for the cross-file checks")
+    parser.add_argument('--parse-cache', dest='PARSE_CACHE', action='store_true',
+                        help="keep parsed sheets as Arrow files and reuse them")
+    parser.add_argument('--row-workers', dest='ROW_WORKERS', type=int, metavar='N',
+                        help="processes that parse the rows of each large file in chunks")
+    parser.add_argument('--delta-store', dest='DELTA_STORE', metavar='PATH',
+                        help="SQLite store of the last submission of each file, to only check changed rows")
+
+# Function to add the ledger flags of the commands that take new files
+def add_ledger_arguments(parser):
+    parser.add_argument('--ledger', default=LEDGER_FILE, help=f"ledger of processed files (default {LEDGER_FILE})")
+    parser.add_argument('--force', action='store_true', help="process files even if the ledger has them")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Process CDT files without the web app")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    process_parser = commands.add_parser('process', help="process workbooks, folders of workbooks or zip files")
+    process_parser.add_argument('paths', nargs='+', help="workbooks, folders of workbooks or zip files")
+    add_processing_arguments(process_parser)
+    add_ledger_arguments(process_parser)
+    process_parser.set_defaults(run=process_command)
+
+    watch_parser = commands.add_parser('watch', help="process new files as they arrive in a folder")
+    watch_parser.add_argument('inbox', help="folder to watch")
+    watch_parser.add_argument('--interval', type=float, default=WATCH_INTERVAL,
+                              help=f"seconds between two looks at the folder (default {WATCH_INTERVAL})")
+    watch_parser.add_argument('--once', action='store_true', help="process what is in the folder now and exit")
+    add_processing_arguments(watch_parser)
+    add_ledger_arguments(watch_parser)
+    watch_parser.set_defaults(run=watch_command)
+
+    replay_parser = commands.add_parser('replay', help="process the uploads in the parse cache again under the current rules")
+    replay_parser.add_argument('uploads', nargs='*', help="file names or hashes to replay (default: all)")
+    add_processing_arguments(replay_parser)
+    replay_parser.set_defaults(run=replay_command)
+
+    args = parser.parse_args(argv)
+    try:
+        return args.run(args)
+    except KeyboardInterrupt:
+        return 130
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,250 @@
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
+
+from openpyxl import load_workbook
+from datetime import datetime, date
+import os
+
+from processing import (
+    GENDER_CODES, compile_rules, new_summary, output_paths, clean_row, report_cleaning,
+    new_write_only_workbook, processing_options, open_customer_index
+)
+from metrics import stage_clock, record_stage, record_timing
+from progress import ProgressReporter
+from dates import DATE_FORMAT, normalize_date_string
+from text_export import open_text_file
+from exception_report import ExceptionWorkbook
+
+# Substrings removed by clean_cell_value, in the order it removes them
+CLEANING_STEPS = [('exponential', 'E+'), ('pipe', '|'), ('carriage_return', '\r'), ('line_break', '\n')]
+
+
+# Function to read the active sheet into a header row and a DataFrame of the data rows,
+# with the width of the sheet as read. Columns are numbered from 0, keep the cell
+# values as Python objects and are padded to `width` for the rules. With
+# `parsed` (a parse_cache.ParsedUpload) the sheet is read from the parse cache on a
+# hit, and saved to it on a miss.
+def read_sheet(file_path, width, parsed=None):
+    if parsed is not None and parsed.hit:
+        return read_cached_sheet(parsed, width)
+
+    workbook = load_workbook(file_path, read_only=True)
+    try:
+        sheet = workbook.active
+        title = sheet.title
+        rows = sheet.iter_rows(values_only=True)
+        if parsed is not None:
+            rows = parsed.record(title, sheet.max_row, sheet.max_column, rows)
+        rows = [list(row) for row in rows]
+    finally:
+        workbook.close()
+
+    source_width = max([sheet.max_column or 0] + [len(row) for row in rows])
+    width = max(width, source_width)
+    for row in rows:
+        if len(row) < width:
+            row.extend([None] * (width - len(row)))
+
+    header = rows[0] if rows else None
+    frame = pd.DataFrame(rows[1:], columns=range(width), dtype=object)
+    return title, header, frame, source_width
+
+# Function to build the header row and DataFrame from the columns of a cached sheet
+def read_cached_sheet(parsed, width):
+    columns = parsed.columns()
+    row_count = len(columns[0]) if columns else 0
+    source_width = len(columns)
+    width = max(width, source_width)
+    columns += [[None] * row_count for _ in range(width - len(columns))]
+
+    header = [column[0] for column in columns] if row_count else None
+    frame = pd.DataFrame({col_idx: column[1:] for col_idx, column in enumerate(columns)}, dtype=object)
+    return parsed.title, header, frame, source_width
+
+# Function to find the string cells of a column
+def string_mask(column):
+    return column.map(type) == str
+
+# Function to remove E+, pipes, carriage returns and line breaks from a column,
+# adding the number of cells changed by each step to `changes`
+def clean_column(column, changes):
+    is_string = string_mask(column)
+    if not is_string.any():
+        return column
+
+    text = column[is_string]
+    for key, token in CLEANING_STEPS:
+        found = text.str.contains(token, regex=False).astype(bool)
+        count = int(found.sum())
+        if count:
+            changes[key] += count
+            text = text.where(~found, text.str.replace(token, '', regex=False))
+
+    column = column.copy()
+    column[is_string] = text
+    return column
+
+# Function to format the dates of a column. Each distinct string is parsed once.
+# Also returns a mask of the non-empty strings that could not be parsed.
+def format_date_column(column, dates=None):
+    types = column.map(type)
+    column = column.copy()
+    unparsed = pd.Series(False, index=column.index)
+
+    is_string = types == str
+    if is_string.any():
+        strings = column[is_string]
+        formatted = {}
+        failed = set()
+        for value in strings.unique():
+            parsed = normalize_date_string(value, dates)
+            formatted[value] = value if parsed is None else parsed
+            if parsed is None and value.strip():
+                failed.add(value)
+        column[is_string] = strings.map(formatted)
+        if failed:
+            unparsed[is_string] = strings.isin(failed)
+
+    is_date = types.map(lambda value_type: issubclass(value_type, (datetime, date)))
+    if is_date.any():
+        column[is_date] = column[is_date].map(lambda value: value.strftime(DATE_FORMAT))
+    return column, unparsed
+
+# Function to replace M/Male and F/Female with their codes in a column
+def replace_gender_column(column):
+    is_gender = column.isin(list(GENDER_CODES))
+    if not is_gender.any():
+        return column
+    column = column.copy()
+    column[is_gender] = column[is_gender].map(GENDER_CODES)
+    return column
+
+# Function to write DataFrame rows to a write-only sheet
+def append_frame(sheet, frame):
+    for row in frame.itertuples(index=False, name=None):
+        sheet.append(row)
+
+# Function to write the header and rows as pipe-delimited text, joining whole columns at once
+def write_pipe_delimited_text(text_file_path, header, frame, compression=None):
+    with open_text_file(text_file_path, compression) as text_file:
+        text_file.write('|'.join(['' if cell is None else str(cell) for cell in header]) + '\n')
+        if frame.empty:
+            return
+        text = frame.where(frame.notna(), '').astype(object).apply(lambda column: column.map(str))
+        lines = text[0]
+        for col in text.columns[1:]:
+            lines = lines + '|' + text[col]
+        text_file.write('\n'.join(lines) + '\n')
+
+
+# Columnar processing: the sheet is loaded into a DataFrame once and every rule runs as
+# a column operation. Produces the same files, messages and summary as process_workbook.
+def process_workbook_columnar(file_path, spec, notify, options=None, progress=None, parsed=None):
+    if pd is None:
+        raise ImportError("The pandas engine needs pandas installed (pip install pandas).")
+
+    notify(f"Processing file: {file_path}",'success')
+
+    options = processing_options(options)
+    progress = progress or ProgressReporter()
+    rules = compile_rules(spec)
+    summary = new_summary(file_path)
+    paths = output_paths(file_path, options)
+    changes = summary['changes']
+    start = stage_clock()
+
+    progress.stage('load')
+    title, header, frame, source_width = read_sheet(file_path, rules['width'], parsed)
+    start = record_timing(summary, 'load', start)
+    if header is None:
+        report_cleaning(summary, notify)
+        return summary
+    progress.stage('rules', len(frame))
+
+    # Remove duplicates (compared on the raw values, or on the key columns of the spec)
+    step = start
+    summary['rows'] = len(frame)
+    duplicated = frame.duplicated(subset=rules['dedup'], keep='first')
+    summary['duplicates'] = int(duplicated.sum())
+    duplicate_rows = frame[duplicated]
+    frame = frame[~duplicated]
+    step = record_stage(summary, 'dedup', step)
+
+    # Clean cell values, header included
+    clean_row(header, changes)
+    for col in frame.columns:
+        frame[col] = clean_column(frame[col], changes)
+    step = record_stage(summary, 'clean', step)
+
+    # Check for blank required columns
+    required = frame[rules['required']]
+    blank = (required.isna() | required.eq('')).any(axis=1)
+    step = record_stage(summary, 'blank_check', step)
+
+    # Check for rows where BVN No does not start with '2'
+    invalid_bvn = pd.Series(False, index=frame.index)
+    if rules['bvn'] is not None:
+        bvn = frame[rules['bvn']]
+        is_string = string_mask(bvn)
+        invalid_bvn[is_string] = ~bvn[is_string].str.startswith('2').astype(bool)
+        invalid_bvn &= ~blank
+
+    blank_rows = frame[blank]
+    non_bvn_rows = frame[invalid_bvn]
+    frame = frame[~(blank | invalid_bvn)].copy()
+    summary['blank_rows'] = len(blank_rows)
+    summary['invalid_bvn'] = len(non_bvn_rows)
+    summary['rows_written'] = len(frame)
+    step = record_stage(summary, 'bvn_check', step)
+
+    # Format the date columns and replace gender values on the rows that are kept
+    unparsed_dates = pd.Series(False, index=frame.index)
+    for col in rules['dates']:
+        frame[col], unparsed = format_date_column(frame[col], summary['dates'])
+        unparsed_dates |= unparsed
+    summary['unparsed_dates'] = int(unparsed_dates.sum())
+    step = record_stage(summary, 'date_format', step)
+    for col in rules['genders']:
+        frame[col] = replace_gender_column(frame[col])
+    record_stage(summary, 'gender_map', step)
+    start = record_timing(summary, 'rules', start)
+
+    report_cleaning(summary, notify)
+
+    # Outputs keep the width of the sheet, without the columns padded for the rules
+    header = header[:source_width]
+    output_frame = frame[frame.columns[:source_width]]
+
+    progress.stage('exceptions')
+    exceptions = ExceptionWorkbook(paths['exceptions'], header, options['exception_export'])
+    for status, rows in [('blank', blank_rows), ('invalid_bvn', non_bvn_rows),
+                         ('duplicate', duplicate_rows), ('unparsed_date', frame[unparsed_dates])]:
+        exceptions.add_rows(status, rows.itertuples(index=False, name=None))
+    customer_index = open_customer_index(file_path, spec, rules, options, exceptions)
+    if customer_index is not None:
+        customer_index.add_rows(frame.itertuples(index=False, name=None))
+        summary['customer_index'] = customer_index.close(notify)
+    summary['outputs'].update(exceptions.save(notify))
+    start = record_timing(summary, 'exceptions', start)
+
+    # Replace the upload with the cleaned workbook once it is fully written
+    progress.stage('save')
+    temp_path = file_path + '.tmp'
+    output, output_sheet = new_write_only_workbook(title, header)
+    append_frame(output_sheet, output_frame)
+    output.save(temp_path)
+    os.replace(temp_path, file_path)
+    summary['outputs']['xlsx'] = file_path
+    start = record_timing(summary, 'save', start)
+
+    # Convert to pipe-delimited text file
+    if spec['export_text']:
+        progress.stage('text_export')
+        write_pipe_delimited_text(paths['text'], header, output_frame, options['text_compression'])
+        notify(f"Conversion completed. The text file is saved as: {paths['text']}",'success')
+        summary['outputs']['text'] = paths['text']
+        record_timing(summary, 'text_export', start)
+
+    return summary
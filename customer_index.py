@@ -0,0 +1,141 @@
+import sqlite3, time
+
+# Rows looked up in and written to the index at once
+INDEX_BATCH_ROWS = 10000
+
+# Seconds to wait for another process writing to the index
+INDEX_TIMEOUT = 30
+
+# Customers of every borrower file processed. Customer IDs are only unique within an
+# institution, so they are keyed on the institution first; the BVN index finds a
+# BVN held at other institutions.
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS customers (
+    institution TEXT NOT NULL,
+    customer_id TEXT NOT NULL,
+    file_type TEXT NOT NULL,
+    bvn TEXT,
+    source_file TEXT,
+    updated_at TEXT,
+    PRIMARY KEY (institution, customer_id, file_type)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS customers_by_bvn ON customers (bvn, institution);
+"""
+
+
+# Function to turn a customer ID or BVN cell into the text kept in the index.
+# Numbers stored as such in Excel (2012345678.0) are written without the decimals.
+def index_key(value):
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    value = str(value).strip()
+    return value or None
+
+# Function to open the index, creating it the first time
+def open_index(path):
+    connection = sqlite3.connect(path, timeout=INDEX_TIMEOUT)
+    # WAL lets other processes look up customers while a file is being indexed
+    connection.execute('PRAGMA journal_mode=WAL')
+    # Safe with WAL (a crash can only lose the last commits) and much faster for bulk inserts
+    connection.execute('PRAGMA synchronous=NORMAL')
+    connection.executescript(INDEX_SCHEMA)
+    connection.execute('CREATE TEMP TABLE lookup (key TEXT PRIMARY KEY)')
+    return connection
+
+
+# Checks the rows kept from one file against the index and adds them to it, a batch
+# of rows at a time so a large file takes one query per batch rather than per row.
+# `role` comes from the file spec:
+#   'borrower'  - rows whose BVN is already held at another institution go to the
+#                 'shared_bvn' sheet, then the customers are added to the index
+#   'reference' - rows whose customer ID is not in any borrower file of the same
+#                 institution go to the 'unknown_borrower' sheet
+# Flagged rows are kept in the cleaned file, as rows with unparseable dates are.
+class CustomerIndexBatch:
+    def __init__(self, path, role, file_type, institution, source_file, rules, exceptions,
+                 batch_rows=INDEX_BATCH_ROWS):
+        if role not in ('borrower', 'reference'):
+            raise ValueError(f"Unknown customer index role: {role}")
+        self.role = role
+        self.file_type = file_type
+        self.institution = institution
+        self.source_file = source_file
+        self.customer = rules['customer']
+        self.bvn = rules['bvn']
+        self.exceptions = exceptions
+        self.batch_rows = batch_rows
+        self.rows = []
+        self.counts = {'indexed': 0, 'unknown_borrowers': 0, 'shared_bvns': 0}
+        self.connection = open_index(path)
+
+    # Function to add a kept row, checking the batch once it is full
+    def add(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_rows:
+            self.flush()
+
+    # Function to add several kept rows
+    def add_rows(self, rows):
+        for row in rows:
+            self.add(row)
+
+    # Function to fill the lookup table with the keys of a batch
+    def load_lookup(self, keys):
+        self.connection.execute('DELETE FROM lookup')
+        self.connection.executemany('INSERT OR IGNORE INTO lookup VALUES (?)',
+                                    ((key,) for key in keys if key is not None))
+
+    # Function to find the customer IDs of the batch not in a borrower file of this institution
+    def unknown_customers(self, customer_ids):
+        self.load_lookup(customer_ids)
+        return {key for (key,) in self.connection.execute(
+            'SELECT key FROM lookup WHERE NOT EXISTS ('
+            'SELECT 1 FROM customers WHERE institution = ? AND customer_id = lookup.key)',
+            (self.institution,))}
+
+    # Function to find the BVNs of the batch held by customers of other institutions
+    def shared_bvns(self, bvns):
+        self.load_lookup(bvns)
+        return {key for (key,) in self.connection.execute(
+            'SELECT DISTINCT lookup.key FROM lookup JOIN customers ON customers.bvn = lookup.key '
+            'WHERE customers.institution != ?', (self.institution,))}
+
+    # Function to check the collected rows and, for borrower files, index them
+    def flush(self):
+        if not self.rows:
+            return
+        customer_ids = [index_key(row[self.customer]) for row in self.rows]
+        bvns = [index_key(row[self.bvn]) if self.bvn is not None else None for row in self.rows]
+
+        with self.connection:
+            if self.role == 'reference':
+                unknown = self.unknown_customers(customer_ids)
+                for row, customer_id in zip(self.rows, customer_ids):
+                    if customer_id in unknown:
+                        self.exceptions.add('unknown_borrower', row)
+                        self.counts['unknown_borrowers'] += 1
+            else:
+                shared = self.shared_bvns(bvns)
+                for row, bvn in zip(self.rows, bvns):
+                    if bvn in shared:
+                        self.exceptions.add('shared_bvn', row)
+                        self.counts['shared_bvns'] += 1
+
+                updated_at = time.strftime('%Y-%m-%dT%H:%M:%S')
+                entries = [(self.institution, customer_id, self.file_type, bvn, self.source_file, updated_at)
+                           for customer_id, bvn in zip(customer_ids, bvns) if customer_id is not None]
+                self.connection.executemany('INSERT OR REPLACE INTO customers VALUES (?, ?, ?, ?, ?, ?)', entries)
+                self.counts['indexed'] += len(entries)
+        self.rows = []
+
+    # Function to check the last batch, close the index and report the counts
+    def close(self, notify):
+        try:
+            self.flush()
+        finally:
+            self.connection.close()
+        if self.role == 'borrower':
+            notify(f"Customer index updated with {self.counts['indexed']} customers of {self.institution}.",'success')
+        return self.counts
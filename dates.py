@@ -0,0 +1,129 @@
+from collections import OrderedDict
+from datetime import datetime, date
+import re, threading
+
+# Output format for every date column
+DATE_FORMAT = '%d-%b-%Y'
+
+# Number of distinct date strings kept in the cache (least recently used are evicted)
+DATE_CACHE_SIZE = 65536
+
+MONTHS = {
+    'jan': 1, 'feb': 2, 'mar': 3, 'apr': 4, 'may': 5, 'jun': 6,
+    'jul': 7, 'aug': 8, 'sep': 9, 'oct': 10, 'nov': 11, 'dec': 12
+}
+
+# Formats seen in submissions, tried before falling back to dateutil
+DAY_MONTH_YEAR = re.compile(r'(\d{1,2})/(\d{1,2})/(\d{4})')     # 05/01/2020
+YEAR_MONTH_DAY = re.compile(r'(\d{4})-(\d{1,2})-(\d{1,2})')     # 2020-01-05
+DAY_MON_YEAR = re.compile(r'(\d{1,2})-([A-Za-z]{3})-(\d{4})')   # 05-Jan-2020
+EXCEL_SERIAL = re.compile(r'\d{5}(\.\d+)?')                    # 43831 or 43831.5
+
+# Formatted dates (None for text that is not a date) by the string they were parsed
+# from, least recently used first. Shared by the files processed at the same time.
+date_cache = OrderedDict()
+date_cache_lock = threading.Lock()
+
+
+# Function to try the known formats. Returns a date, None when the value is known
+# not to be a date, or False when dateutil has to decide.
+# The results match parser.parse(value, dayfirst=True) for these formats.
+def parse_known_format(value):
+    match = DAY_MONTH_YEAR.fullmatch(value)
+    if match:
+        day, month, year = (int(part) for part in match.groups())
+        if month > 12:
+            return False
+    else:
+        match = YEAR_MONTH_DAY.fullmatch(value)
+        if match:
+            year, first, second = (int(part) for part in match.groups())
+            # With dayfirst, dateutil reads yyyy-aa-bb as year-day-month when both fit
+            if first <= 12 and second <= 12:
+                day, month = first, second
+            elif first <= 12:
+                day, month = second, first
+            else:
+                return False
+        else:
+            match = DAY_MON_YEAR.fullmatch(value)
+            if match:
+                month = MONTHS.get(match.group(2).lower())
+                if month is None:
+                    return False
+                day, year = int(match.group(1)), int(match.group(3))
+            elif EXCEL_SERIAL.fullmatch(value):
+                # dateutil reads a 5 digit number as an out of range year
+                return None
+            else:
+                return False
+
+    try:
+        return date(year, month, day)
+    except ValueError:
+        return False
+
+# Function to parse a value with dateutil. It is imported on first use, as most
+# values take the fast path and command line runs should start quickly.
+def parse_with_dateutil(value):
+    from dateutil import parser
+    return parser.parse(value, dayfirst=True)
+
+# Function to create the date counters of one file: cache hits and misses, how the
+# misses were parsed (fast path or dateutil) and how many of them were not dates
+def new_date_counts():
+    return {'hits': 0, 'misses': 0, 'fast_path': 0, 'fallback': 0, 'unparsed': 0}
+
+# Function to parse a date string that missed the cache. Returns the formatted date
+# (None if it cannot be parsed) and 'fast_path' or 'fallback' for how it was parsed.
+def parse_date_string(value):
+    parsed = parse_known_format(value)
+    if parsed is not False:
+        return parsed.strftime(DATE_FORMAT) if parsed else None, 'fast_path'
+    try:
+        return parse_with_dateutil(value).strftime(DATE_FORMAT), 'fallback'
+    except (ValueError, TypeError, OverflowError):
+        return None, 'fallback'
+
+# Function to normalise one date string. Returns None if it cannot be parsed.
+# Pass `counts` (from new_date_counts) to count the lookup for the file being processed.
+def normalize_date_string(value, counts=None):
+    with date_cache_lock:
+        cached = date_cache.get(value, date_cache)
+        if cached is not date_cache:
+            date_cache.move_to_end(value)
+    if cached is not date_cache:
+        if counts is not None:
+            counts['hits'] += 1
+        return cached
+
+    formatted, method = parse_date_string(value)
+    if counts is not None:
+        counts['misses'] += 1
+        counts[method] += 1
+        if formatted is None:
+            counts['unparsed'] += 1
+    with date_cache_lock:
+        date_cache[value] = formatted
+        if len(date_cache) > DATE_CACHE_SIZE:
+            date_cache.popitem(last=False)
+    return formatted
+
+# Function to parse and format a date value. Values that are not dates are returned unchanged.
+def format_date_value(value, counts=None):
+    if isinstance(value, str):
+        formatted = normalize_date_string(value, counts)
+        return value if formatted is None else formatted
+    elif isinstance(value, (datetime, date)):
+        return value.strftime(DATE_FORMAT)
+    return value
+
+# Function to add the date counters of part of a file to those of the whole file
+def add_date_counts(counts, part):
+    for key, value in part.items():
+        counts[key] += value
+
+# Function to empty the cache
+def clear_date_cache():
+    with date_cache_lock:
+        date_cache.clear()
@@ -0,0 +1,97 @@
+from hashlib import blake2b
+import os, sqlite3, tempfile
+
+# Memory allowed for the digests of rows already seen before they spill to disk
+DEDUP_MEMORY_BUDGET = 64 * 1024 * 1024
+
+# Size of a row digest in bytes (128 bits, so collisions are not a practical concern)
+DIGEST_SIZE = 16
+
+# Approximate memory taken by one digest in a Python set (bytes object and set slot)
+DIGEST_ENTRY_SIZE = 100
+
+
+# Function to give equal numbers one form before they are hashed. pandas compares
+# cells by value (1, 1.0 and True are the same value), so whole floats and bools
+# become ints here; other values are compared through their repr.
+def digest_value(value):
+    if type(value) is float and value.is_integer():
+        return int(value)
+    if type(value) is bool:
+        return int(value)
+    return value
+
+# Function to reduce a row (or its key columns) to a fixed-size digest
+def row_digest(values):
+    values = tuple(digest_value(value) for value in values)
+    return blake2b(repr(values).encode('utf-8', 'surrogatepass'), digest_size=DIGEST_SIZE).digest()
+
+# Function to get the digest a row is compared on: the whole row, or only the
+# columns in `key_indices`
+def key_digest(row, key_indices=None):
+    if key_indices is not None:
+        row = [row[col_idx] for col_idx in key_indices]
+    return row_digest(row)
+
+
+# Tracks the rows seen so far as digests instead of full row tuples. Once the digests
+# kept in memory reach the memory budget they are moved to a temporary SQLite table
+# and later rows are looked up there as well.
+class RowDeduplicator:
+    def __init__(self, key_indices=None, memory_budget=DEDUP_MEMORY_BUDGET, spill_folder=None):
+        self.key_indices = key_indices
+        self.max_digests = max(1, memory_budget // DIGEST_ENTRY_SIZE)
+        self.spill_folder = spill_folder
+        self.digests = set()
+        self.db = None
+        self.db_path = None
+        self.spilled = 0
+        self.spills = 0
+
+    # Function to check a row, remembering it if it was not seen before
+    def seen(self, row):
+        return self.seen_digest(key_digest(row, self.key_indices))
+
+    # Function to check the digest of a row worked out elsewhere (see key_digest)
+    def seen_digest(self, digest):
+        if digest in self.digests:
+            return True
+        if self.db is not None and self.db.execute("SELECT 1 FROM digests WHERE digest = ?", (digest,)).fetchone():
+            return True
+
+        self.digests.add(digest)
+        if len(self.digests) >= self.max_digests:
+            self.spill()
+        return False
+
+    # Function to move the in-memory digests to the disk table
+    def spill(self):
+        if self.db is None:
+            fd, self.db_path = tempfile.mkstemp(suffix='.dedup.sqlite', dir=self.spill_folder)
+            os.close(fd)
+            self.db = sqlite3.connect(self.db_path)
+            # Scratch data: no journal and no fsync
+            self.db.execute("PRAGMA journal_mode = OFF")
+            self.db.execute("PRAGMA synchronous = OFF")
+            self.db.execute("CREATE TABLE digests (digest BLOB PRIMARY KEY) WITHOUT ROWID")
+
+        self.db.executemany("INSERT OR IGNORE INTO digests VALUES (?)", ((digest,) for digest in self.digests))
+        self.db.commit()
+        self.spilled += len(self.digests)
+        self.spills += 1
+        self.digests = set()
+
+    # Function to report how many digests were kept in memory and on disk
+    def stats(self):
+        return {
+            'in_memory': len(self.digests),
+            'spilled': self.spilled,
+            'spills': self.spills,
+        }
+
+    # Function to remove the disk table
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            os.remove(self.db_path)
+            self.db = None
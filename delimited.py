@@ -0,0 +1,139 @@
+import csv, os
+from collections import deque
+
+from processing import (
+    DELIMITED_FORMATS, DELIMITED_ENCODING, compile_rules, padded_rows, new_summary, output_paths, processing_options, fused_pass, count_status,
+    report_cleaning, open_customer_index, new_deduplicator, open_delta, close_delta, delta_pass
+)
+from metrics import stage_clock, new_row_profile, record_row_profile, record_timing
+from progress import ProgressReporter
+from text_export import PipeDelimitedWriter, pipe_delimited_line
+from exception_report import ExceptionWorkbook
+
+
+# Function to get the csv reader and writer settings of a delimited file
+def delimited_format(file_path):
+    return DELIMITED_FORMATS[os.path.splitext(file_path)[1].lower()]
+
+# Function to read the rows of a delimited file as lists, header first. Empty fields
+# are read as None, as empty cells are from a workbook, and every row is padded to
+# the width of the header, as the rows of a sheet are to its width.
+def read_delimited_rows(source, file_format):
+    width = 0
+    reader = csv.reader(source, **file_format)
+    for row_num, row in enumerate(reader, start=1):
+        if row_num == 1:
+            width = max(width, len(row))
+        row = [value if value != '' else None for value in row]
+        if len(row) < width:
+            row.extend([None] * (width - len(row)))
+        yield row
+
+# Writes the cleaned rows of a pipe-delimited file. The file is not quoted, so the
+# lines are joined as for the text export: the rules take the pipes, carriage returns
+# and line breaks out of every value, and quotes are written as they were read.
+class PipeRowWriter:
+    def __init__(self, output_file):
+        self.file = output_file
+
+    # Function to write one row
+    def writerow(self, row):
+        self.file.write(pipe_delimited_line(row) + '\n')
+
+# Function to open the writer of the cleaned rows of a delimited file
+def delimited_writer(output_file, file_format):
+    if file_format.get('quoting') == csv.QUOTE_NONE:
+        return PipeRowWriter(output_file)
+    return csv.writer(output_file, lineterminator='\n', **file_format)
+
+
+# Delimited processing: CSV, tab- and pipe-delimited uploads are read line by line,
+# without a workbook, and go through the same row pass as the workbook engines. The
+# cleaned rows replace the upload in the same format, and the exceptions workbook and
+# text export are written as for a workbook.
+def process_delimited_file(file_path, spec, notify, options=None, progress=None):
+    notify(f"Processing file: {file_path}",'success')
+
+    options = processing_options(options)
+    progress = progress or ProgressReporter()
+    rules = compile_rules(spec)
+    summary = new_summary(file_path)
+    paths = output_paths(file_path, options)
+    file_format = delimited_format(file_path)
+    temp_path = file_path + '.tmp'
+
+    exceptions = None
+    customer_index = None
+    text_writer = PipeDelimitedWriter(paths['text'], options['text_compression']) if spec['export_text'] else None
+    profile = new_row_profile()
+    start = stage_clock()
+
+    # The number of rows is not known without reading the file
+    progress.stage('rules')
+    deduplicator = new_deduplicator(rules, options)
+    delta = open_delta(file_path, rules, options)
+    try:
+        with open(file_path, newline='', encoding=DELIMITED_ENCODING) as source, \
+                open(temp_path, 'w', newline='', encoding='utf-8') as output_file:
+            output = delimited_writer(output_file, file_format)
+            # Rows are written back at the width they were read
+            widths = deque()
+            rows = padded_rows(read_delimited_rows(source, file_format), rules['width'], widths)
+            if delta is not None:
+                row_pass = delta_pass(rows, rules, summary['changes'], deduplicator, delta, summary['dates'])
+            else:
+                row_pass = fused_pass(rows, rules, summary['changes'], deduplicator, profile, summary['dates'])
+            for status, row in row_pass:
+                width = widths.popleft()
+                count_status(summary, status)
+                progress.rows(summary['rows'])
+                if status == 'header':
+                    exceptions = ExceptionWorkbook(paths['exceptions'], row[:width], options['exception_export'])
+                    customer_index = open_customer_index(file_path, spec, rules, options, exceptions)
+                elif status != 'keep':
+                    exceptions.add(status, row)
+                    if status != 'unparsed_date':
+                        continue
+
+                if customer_index is not None and status != 'header':
+                    customer_index.add(row)
+                if len(row) > width:
+                    row = row[:width]
+                output.writerow(row)
+                if text_writer:
+                    text_writer.write_row(row)
+    except BaseException:
+        # The upload is left as it was
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    finally:
+        summary['dedup'] = deduplicator.stats()
+        deduplicator.close()
+        if text_writer:
+            text_writer.close()
+    record_row_profile(summary, profile)
+    start = record_timing(summary, 'rules', start)
+
+    report_cleaning(summary, notify)
+
+    progress.stage('exceptions')
+    if customer_index is not None:
+        summary['customer_index'] = customer_index.close(notify)
+    if delta is not None:
+        close_delta(delta, summary, notify)
+    if exceptions is not None:
+        summary['outputs'].update(exceptions.save(notify))
+    start = record_timing(summary, 'exceptions', start)
+
+    # Replace the upload with the cleaned file once it is fully written
+    progress.stage('save')
+    os.replace(temp_path, file_path)
+    summary['outputs']['csv'] = file_path
+    record_timing(summary, 'save', start)
+
+    if text_writer:
+        notify(f"Conversion completed. The text file is saved as: {paths['text']}",'success')
+        summary['outputs']['text'] = paths['text']
+
+    return summary
@@ -0,0 +1,244 @@
+import csv, json, sqlite3, time, uuid
+
+from customer_index import index_key
+from exception_report import export_columns
+
+# Rows looked up in and written to the store at once
+DELTA_BATCH_ROWS = 10000
+
+# Seconds to wait for another process writing to the store
+DELTA_TIMEOUT = 30
+
+# Submissions still being written after this many seconds are taken to have failed,
+# and their rows are removed the next time the store is opened
+DELTA_STALE_SECONDS = 24 * 60 * 60
+
+# The rows of the last submission of each file type from each institution. A row is
+# known by the digest of its raw values (its fingerprint), and keeps its status, the
+# cells the rules changed and its cleaning counts, so the same row sent again next
+# month does not go through the rules. The key is the record the row is about (the
+# customer ID by default), which tells a changed row from a new one. Rows of a
+# submission being processed stay pending until it is done.
+DELTA_SCHEMA = """
+CREATE TABLE IF NOT EXISTS submissions (
+    institution TEXT NOT NULL,
+    file_type TEXT NOT NULL,
+    submission TEXT NOT NULL,
+    ruleset TEXT NOT NULL,
+    source_file TEXT,
+    rows INTEGER,
+    submitted_at TEXT,
+    PRIMARY KEY (institution, file_type)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS pending_submissions (
+    submission TEXT PRIMARY KEY,
+    started_at REAL
+);
+CREATE TABLE IF NOT EXISTS row_results (
+    submission TEXT NOT NULL,
+    fingerprint BLOB NOT NULL,
+    row_key TEXT,
+    status TEXT NOT NULL,
+    patch TEXT NOT NULL,
+    changes TEXT,
+    PRIMARY KEY (submission, fingerprint)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS row_results_by_key ON row_results (submission, row_key);
+"""
+
+
+# Function to open the store, creating it the first time
+def open_store(path):
+    connection = sqlite3.connect(path, timeout=DELTA_TIMEOUT)
+    # WAL lets other processes read the store while a submission is being written
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    connection.executescript(DELTA_SCHEMA)
+    connection.execute('CREATE TEMP TABLE fingerprint_lookup (fingerprint BLOB PRIMARY KEY)')
+    connection.execute('CREATE TEMP TABLE key_lookup (key TEXT PRIMARY KEY)')
+    return connection
+
+# Function to remove the rows of submissions that never finished
+def remove_stale_submissions(connection, max_age=DELTA_STALE_SECONDS):
+    with connection:
+        stale = [submission for (submission,) in connection.execute(
+            'SELECT submission FROM pending_submissions WHERE started_at < ?', (time.time() - max_age,))]
+        for submission in stale:
+            connection.execute('DELETE FROM row_results WHERE submission = ?', (submission,))
+            connection.execute('DELETE FROM pending_submissions WHERE submission = ?', (submission,))
+
+
+# Compares one submission with the last one of the same file type from the same
+# institution and stores its rows for the next. The row pass (processing.delta_pass)
+# looks up a batch of rows at a time with `lookup`, runs the rules only on the rows
+# not found, and records every data row that is not a duplicate. Rows are counted as:
+#   'unchanged' - the same values were in the last submission; its results are reused
+#   'changed'   - new values for a key that was in the last submission
+#   'added'     - new values for a key that was not (or for a row with no key)
+#   'removed'   - keys of the last submission with no rows in this one
+# Results stored under other rules are not reused, but still tell which rows changed.
+# With a last submission to compare with, the added and changed rows (as cleaned) and
+# the removed keys are written to a CSV report with a 'change' column.
+class DeltaStore:
+    def __init__(self, path, institution, file_type, source_file, ruleset, key_columns, report_path,
+                 batch_rows=DELTA_BATCH_ROWS):
+        self.institution = institution
+        self.file_type = file_type
+        self.source_file = source_file
+        self.ruleset = ruleset
+        self.key_columns = key_columns
+        self.report_path = report_path
+        self.batch_rows = batch_rows
+        self.submission = uuid.uuid4().hex
+        self.entries = []
+        # Stored text of the results found by the last lookup, written back as it is
+        self.stored = {}
+        self.rows = 0
+        self.counts = {'added': 0, 'changed': 0, 'unchanged': 0, 'removed': 0, 'reused': 0}
+        self.header = None
+        self.report_file = None
+        self.connection = open_store(path)
+        remove_stale_submissions(self.connection)
+
+        last = self.connection.execute(
+            'SELECT submission, ruleset FROM submissions WHERE institution = ? AND file_type = ?',
+            (institution, file_type)).fetchone()
+        self.previous = last[0] if last else None
+        self.reuse = last is not None and last[1] == ruleset
+        with self.connection:
+            self.connection.execute('INSERT INTO pending_submissions VALUES (?, ?)', (self.submission, time.time()))
+
+    # Function to get the key of a raw data row: the text of its key columns as JSON,
+    # or None when it has no key columns or they are all blank
+    def row_key(self, row):
+        if not self.key_columns:
+            return None
+        values = [index_key(row[col_idx]) for col_idx in self.key_columns]
+        if all(value is None for value in values):
+            return None
+        return json.dumps(values)
+
+    # Function to look up a batch of rows in the last submission. Returns the results
+    # stored for the fingerprints found (None when they cannot be reused), by
+    # fingerprint, and the set of the keys found.
+    def lookup(self, fingerprints, keys):
+        if self.previous is None:
+            return {}, set()
+        with self.connection:
+            self.connection.execute('DELETE FROM fingerprint_lookup')
+            self.connection.executemany('INSERT OR IGNORE INTO fingerprint_lookup VALUES (?)',
+                                        ((fingerprint,) for fingerprint in fingerprints))
+            results = {}
+            self.stored = {}
+            for fingerprint, status, patch, changes in self.connection.execute(
+                    'SELECT row_results.fingerprint, status, patch, changes FROM fingerprint_lookup '
+                    'JOIN row_results ON row_results.submission = ? '
+                    'AND row_results.fingerprint = fingerprint_lookup.fingerprint', (self.previous,)):
+                if self.reuse:
+                    results[fingerprint] = (status, json.loads(patch), json.loads(changes) if changes else None)
+                    self.stored[fingerprint] = (patch, changes)
+                else:
+                    results[fingerprint] = None
+
+            self.connection.execute('DELETE FROM key_lookup')
+            self.connection.executemany('INSERT OR IGNORE INTO key_lookup VALUES (?)',
+                                        ((key,) for key in keys if key is not None))
+            known_keys = {key for (key,) in self.connection.execute(
+                'SELECT key FROM key_lookup WHERE EXISTS ('
+                'SELECT 1 FROM row_results WHERE submission = ? AND row_key = key_lookup.key)', (self.previous,))}
+        return results, known_keys
+
+    # Function to keep the cleaned header row for the report
+    def set_header(self, header):
+        self.header = list(header)
+
+    # Function to record a data row with its change, its results from the rules and the
+    # row as cleaned. Rows are written to the store a batch at a time.
+    def record(self, fingerprint, key, change, status, patch, row_changes, row):
+        self.rows += 1
+        self.counts[change] += 1
+        if fingerprint in self.stored:
+            self.counts['reused'] += 1
+            patch, row_changes = self.stored[fingerprint]
+        else:
+            if change != 'unchanged':
+                self.report_row(change, row)
+            patch = json.dumps(patch)
+            row_changes = json.dumps(row_changes) if row_changes and any(row_changes.values()) else None
+        self.entries.append((self.submission, fingerprint, key, status, patch, row_changes))
+        if len(self.entries) >= self.batch_rows:
+            self.flush()
+
+    # Function to write the recorded rows to the store
+    def flush(self):
+        if not self.entries:
+            return
+        with self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO row_results VALUES (?, ?, ?, ?, ?, ?)', self.entries)
+        self.entries = []
+
+    # Function to add a row to the report, when there is a last submission to compare with
+    def report_row(self, change, row):
+        if self.previous is None:
+            return
+        if self.report_file is None:
+            self.report_file = open(self.report_path, 'w', newline='', errors='ignore')
+            self.report = csv.writer(self.report_file)
+            self.report.writerow(['change'] + export_columns(self.header or [])[1:])
+        self.report.writerow([change] + list(row))
+
+    # Function to find the keys of the last submission with no rows in this one, and
+    # the number of rows each had. Rows with no key are counted together under None
+    # unless the same values came back.
+    def removed_keys(self):
+        return self.connection.execute(
+            'SELECT row_key, COUNT(*) FROM row_results AS last '
+            'WHERE submission = :previous AND NOT EXISTS ('
+            'SELECT 1 FROM row_results WHERE submission = :current AND fingerprint = last.fingerprint) '
+            'AND (row_key IS NULL OR NOT EXISTS ('
+            'SELECT 1 FROM row_results WHERE submission = :current AND row_key = last.row_key)) '
+            'GROUP BY row_key', {'previous': self.previous, 'current': self.submission}).fetchall()
+
+    # Function to store the last batch, report the removed keys and make this submission
+    # the one the next is compared with. Returns the counts for the summary.
+    def close(self, notify):
+        try:
+            self.flush()
+            if self.previous is not None:
+                for key, rows in self.removed_keys():
+                    self.counts['removed'] += rows
+                    if key is not None:
+                        removed = [None] * len(self.header or [])
+                        for col_idx, value in zip(self.key_columns, json.loads(key)):
+                            if col_idx < len(removed):
+                                removed[col_idx] = value
+                        self.report_row('removed', removed)
+
+            submitted_at = time.strftime('%Y-%m-%dT%H:%M:%S')
+            with self.connection:
+                # Another submission of the same file may have finished since this one started
+                replaced = self.connection.execute(
+                    'SELECT submission FROM submissions WHERE institution = ? AND file_type = ?',
+                    (self.institution, self.file_type)).fetchone()
+                self.connection.execute('INSERT OR REPLACE INTO submissions VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                        (self.institution, self.file_type, self.submission, self.ruleset,
+                                         self.source_file, self.rows, submitted_at))
+                self.connection.execute('DELETE FROM pending_submissions WHERE submission = ?', (self.submission,))
+                if replaced is not None:
+                    self.connection.execute('DELETE FROM row_results WHERE submission = ?', (replaced[0],))
+        finally:
+            self.connection.close()
+            if self.report_file is not None:
+                self.report_file.close()
+
+        if self.previous is None:
+            notify(f"First {self.file_type} from {self.institution}: {self.rows} rows stored for the next delta.",'success')
+        else:
+            notify(f"Changes since the last {self.file_type} from {self.institution}: {self.counts['added']} added, "
+                   f"{self.counts['changed']} changed, {self.counts['removed']} removed, "
+                   f"{self.counts['unchanged']} unchanged.",'success')
+        return self.counts
+
+    # Function to get the path of the report, or None when it was not written
+    def report_output(self):
+        return self.report_path if self.report_file is not None else None
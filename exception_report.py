@@ -0,0 +1,161 @@
+import csv, os
+import openpyxl
+
+# Sheets of the exception workbook in the order they are saved, keyed by row status
+EXCEPTION_SHEETS = {
+    'blank': "Blank Rows",
+    'invalid_bvn': "Non-BVN Start With 2",
+    'duplicate': "Duplicates",
+    'unparsed_date': "Unparseable Dates",
+    'unknown_borrower': "Unknown Borrowers",
+    'shared_bvn': "BVNs At Other Institutions",
+}
+
+# Message reported for each sheet that has rows
+EXCEPTION_MESSAGES = {
+    'blank': "Blank rows copied to",
+    'invalid_bvn': "Invalid Bvn copied to",
+    'duplicate': "Duplicate rows copied to",
+    'unparsed_date': "Rows with unparseable dates copied to",
+    'unknown_borrower': "Rows for borrowers not in the customer index copied to",
+    'shared_bvn': "Rows with BVNs held at other institutions copied to",
+}
+
+# Formats the exceptions can also be exported to, one table with a rule column
+EXCEPTION_EXPORT_FORMATS = ['csv', 'parquet']
+
+# Number of rows collected before they are written to the Parquet file
+PARQUET_BATCH_ROWS = 50000
+
+
+# Function to get the path of the export table saved next to an exception workbook
+def exception_export_path(path, export):
+    return os.path.splitext(path)[0] + '.' + export
+
+# Function to name the columns of an export table after the header row.
+# Empty and repeated headers get a column number so every name is unique.
+def export_columns(header):
+    columns = ['rule']
+    for col_idx, name in enumerate(header, start=1):
+        name = '' if name is None else str(name)
+        if not name or name in columns:
+            name = f"{name or 'column'}_{col_idx}"
+        columns.append(name)
+    return columns
+
+# Function to drop the empty cells past `width` that a row was padded with for the
+# rules, so the row keeps the width of the upload. Values past it are kept.
+def trim_padding(row, width):
+    end = len(row)
+    while end > width and row[end - 1] is None:
+        end -= 1
+    return row if end == len(row) else row[:end]
+
+# Function to turn a value into text for a Parquet string column
+def export_value(value):
+    return None if value is None else str(value)
+
+
+# Collects the rows moved out or flagged by the rules into one write-only workbook
+# per upload, with a sheet per rule. Rows are appended as they arrive and only the
+# sheets of rules that have rows are saved. Rows are written at the width of the header,
+# without the padding the rules read. With `export` set to 'csv' or 'parquet' the
+# same rows are also written to one table next to the workbook.
+class ExceptionWorkbook:
+    def __init__(self, path, header, export=None):
+        if export not in [None] + EXCEPTION_EXPORT_FORMATS:
+            raise ValueError(f"Unknown exception export format: {export}")
+        self.path = path
+        self.header = list(header)
+        self.export = export
+        self.export_path = exception_export_path(path, export) if export else None
+        self.workbook = None
+        self.sheets = {}
+        self.counts = dict.fromkeys(EXCEPTION_SHEETS, 0)
+
+        self.export_file = None
+        self.export_rows = []
+        self.parquet = None
+        if export == 'parquet':
+            # pyarrow is optional and only needed for this export
+            try:
+                import pyarrow
+                import pyarrow.parquet
+            except ImportError:
+                raise ImportError("The Parquet exception export needs pyarrow installed (pip install pyarrow).")
+            self.parquet = pyarrow
+            self.parquet_writer = None
+
+    # Function to add one row under the sheet for its status
+    def add(self, status, row):
+        row = trim_padding(row, len(self.header))
+        if self.workbook is None:
+            self.open_workbook()
+        if not self.counts[status]:
+            self.sheets[status].append(self.header)
+        self.sheets[status].append(row)
+        self.counts[status] += 1
+        if self.export:
+            self.add_export_row(status, row)
+
+    # Function to add several rows with the same status
+    def add_rows(self, status, rows):
+        for row in rows:
+            self.add(status, row)
+
+    # Function to create the workbook with the sheet of every status, in the order of
+    # EXCEPTION_SHEETS. A sheet gets its header with its first row; the sheets still
+    # without rows are removed on save.
+    def open_workbook(self):
+        self.workbook = openpyxl.Workbook(write_only=True)
+        self.sheets = {status: self.workbook.create_sheet(title) for status, title in EXCEPTION_SHEETS.items()}
+
+    # Function to add a row to the export table
+    def add_export_row(self, status, row):
+        if self.export == 'csv':
+            if self.export_file is None:
+                self.export_file = open(self.export_path, 'w', newline='', errors='ignore')
+                self.csv_writer = csv.writer(self.export_file)
+                self.csv_writer.writerow(export_columns(self.header))
+            self.csv_writer.writerow([EXCEPTION_SHEETS[status]] + list(row))
+        else:
+            self.export_rows.append([EXCEPTION_SHEETS[status]] + [export_value(value) for value in row])
+            if len(self.export_rows) >= PARQUET_BATCH_ROWS:
+                self.write_parquet_rows()
+
+    # Function to write the collected rows to the Parquet file
+    def write_parquet_rows(self):
+        pa = self.parquet
+        columns = export_columns(self.header)
+        width = len(columns)
+        rows = [row + [None] * (width - len(row)) for row in self.export_rows]
+        table = pa.table({name: pa.array([row[col_idx] for row in rows], type=pa.string())
+                          for col_idx, name in enumerate(columns)})
+        if self.parquet_writer is None:
+            self.parquet_writer = pa.parquet.ParquetWriter(self.export_path, table.schema)
+        self.parquet_writer.write_table(table)
+        self.export_rows = []
+
+    # Function to save the workbook and export, reporting each sheet written.
+    # Returns the output paths by role for the summary.
+    def save(self, notify):
+        outputs = {}
+        if self.workbook is not None:
+            for status, sheet in self.sheets.items():
+                if not self.counts[status]:
+                    self.workbook.remove(sheet)
+            self.workbook.save(self.path)
+            outputs['exceptions'] = self.path
+            for status in EXCEPTION_SHEETS:
+                if self.counts[status]:
+                    notify(f"{EXCEPTION_MESSAGES[status]}: {self.path}",'success')
+
+        if self.export_file is not None:
+            self.export_file.close()
+        if self.export_rows:
+            self.write_parquet_rows()
+        if self.parquet is not None and self.parquet_writer is not None:
+            self.parquet_writer.close()
+        if self.export and self.workbook is not None:
+            outputs['exceptions_export'] = self.export_path
+        return outputs
@@ -0,0 +1,210 @@
+import codecs, hashlib, os, posixpath, re, shutil, tempfile, zipfile
+import xml.etree.ElementTree as ElementTree
+
+from processing import DELIMITED_ENCODING
+
+# Largest upload accepted, per file, in bytes
+MAX_UPLOAD_BYTES = 200 * 1024 * 1024
+
+# Largest number of data rows accepted in a workbook (None for no limit)
+MAX_UPLOAD_ROWS = 1048575
+
+# Largest total size of the files inside a workbook once unzipped, and the largest
+# ratio of unzipped to zipped size, so a small upload cannot expand without bound
+MAX_UNZIPPED_BYTES = 4 * 1024 * 1024 * 1024
+MAX_COMPRESSION_RATIO = 200
+
+# Size of the chunks read from a sheet while counting its rows
+SCAN_CHUNK_SIZE = 1024 * 1024
+
+# Bytes of a sheet read to find its dimension, which comes before the rows
+DIMENSION_SCAN_BYTES = 64 * 1024
+
+NAMESPACES = {
+    'main': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main',
+    'rel': 'http://schemas.openxmlformats.org/officeDocument/2006/relationships',
+    'pkg': 'http://schemas.openxmlformats.org/package/2006/relationships',
+}
+DIMENSION_PATTERN = re.compile(rb'<(?:\w+:)?dimension\s+ref="[A-Z]*\d*(?::[A-Z]*(\d+))?"')
+ROW_PATTERN = re.compile(rb'<(?:\w{1,10}:)?row[\s>/]')
+# Longest row tag the pattern matches
+ROW_TAG_BYTES = 16
+
+
+# Raised when an upload is refused before it is processed
+class UploadRejected(Exception):
+    pass
+
+# Raised when an upload goes past the size limit while it is being received
+class UploadTooLarge(UploadRejected):
+    pass
+
+
+# Writable file that an upload is streamed into as the request body is parsed. The
+# SHA-256 and size are worked out on the way, and the upload is refused as soon as it
+# goes past `max_bytes`. The file is written next to where uploads are kept so it can
+# be moved into place without copying, and is deleted on close unless it was moved.
+class HashingUpload:
+    def __init__(self, folder, max_bytes=MAX_UPLOAD_BYTES):
+        os.makedirs(folder, exist_ok=True)
+        handle, self.path = tempfile.mkstemp(prefix='.upload-', dir=folder)
+        self.file = os.fdopen(handle, 'w+b')
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.max_bytes = max_bytes
+        self.moved = False
+
+    # Function to write a chunk of the upload
+    def write(self, data):
+        self.size += len(data)
+        if self.max_bytes is not None and self.size > self.max_bytes:
+            # The request parse stops here, so nothing else will close the file
+            self.close()
+            raise UploadTooLarge(f"File is larger than the {self.max_bytes / (1024 * 1024):g} MB limit.")
+        self.digest.update(data)
+        return self.file.write(data)
+
+    # Function to get the SHA-256 hex digest of everything written
+    def hexdigest(self):
+        return self.digest.hexdigest()
+
+    # Function to move the finished upload to `file_path`. On the same volume this
+    # is a rename, so the upload is never copied.
+    def move_to(self, file_path):
+        self.file.close()
+        shutil.move(self.path, file_path)
+        self.moved = True
+
+    def close(self):
+        self.file.close()
+        if not self.moved:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+    # Reading and seeking go to the file, for callers that read the upload in place
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+
+# Function to find the path of the active sheet inside a workbook zip, as openpyxl
+# picks it: the sheet of the active tab, or the first one
+def active_sheet_path(archive):
+    workbook = ElementTree.fromstring(archive.read('xl/workbook.xml'))
+    sheets = workbook.findall('main:sheets/main:sheet', NAMESPACES)
+    if not sheets:
+        raise UploadRejected("The workbook has no sheets.")
+    view = workbook.find('main:bookViews/main:workbookView', NAMESPACES)
+    active = int(view.get('activeTab', 0)) if view is not None else 0
+    sheet = sheets[active if active < len(sheets) else 0]
+    relation_id = sheet.get(f"{{{NAMESPACES['rel']}}}id")
+
+    relations = ElementTree.fromstring(archive.read('xl/_rels/workbook.xml.rels'))
+    for relation in relations.findall('pkg:Relationship', NAMESPACES):
+        if relation.get('Id') == relation_id:
+            target = relation.get('Target')
+            # Targets are relative to xl/ unless they start at the root of the package
+            return target.lstrip('/') if target.startswith('/') else posixpath.normpath(posixpath.join('xl', target))
+    raise UploadRejected("The workbook does not say where its sheets are.")
+
+# Function to count the rows of a sheet. The dimension at the top of the sheet is
+# used when it has one; otherwise the row tags are counted in the unzipped XML,
+# stopping once `stop_after` is passed.
+def sheet_row_count(archive, sheet_path, stop_after=None):
+    with archive.open(sheet_path) as sheet:
+        start = sheet.read(DIMENSION_SCAN_BYTES)
+        match = DIMENSION_PATTERN.search(start)
+        if match and match.group(1):
+            return int(match.group(1))
+
+        rows = 0
+        tail = b''
+        chunk = start
+        while chunk:
+            data = tail + chunk
+            # Tags starting in the last ROW_TAG_BYTES may be cut off, so they are
+            # counted with the next chunk instead
+            cutoff = max(len(data) - ROW_TAG_BYTES, 0)
+            rows += sum(1 for match in ROW_PATTERN.finditer(data) if match.start() < cutoff)
+            tail = data[cutoff:]
+            if stop_after is not None and rows > stop_after:
+                return rows
+            chunk = sheet.read(SCAN_CHUNK_SIZE)
+        return rows + len(ROW_PATTERN.findall(tail))
+
+# Function to check that a saved upload is a workbook the pipeline can read, before
+# the slow parse: a zip with the parts of an xlsx, that does not unzip to more than
+# the limits, and whose active sheet is within `max_rows` data rows.
+# Returns the number of data rows. Raises UploadRejected with the reason otherwise.
+def validate_workbook(file_path, max_rows=MAX_UPLOAD_ROWS, max_unzipped=MAX_UNZIPPED_BYTES,
+                      max_ratio=MAX_COMPRESSION_RATIO):
+    if not zipfile.is_zipfile(file_path):
+        raise UploadRejected("The file is not an xlsx workbook.")
+    try:
+        with zipfile.ZipFile(file_path) as archive:
+            members = {member.filename: member for member in archive.infolist()}
+            for required in ('[Content_Types].xml', 'xl/workbook.xml', 'xl/_rels/workbook.xml.rels'):
+                if required not in members:
+                    raise UploadRejected(f"The workbook is damaged: {required} is missing.")
+
+            unzipped = sum(member.file_size for member in members.values())
+            zipped = sum(member.compress_size for member in members.values())
+            if unzipped > max_unzipped or (zipped and unzipped / zipped > max_ratio):
+                raise UploadRejected("The workbook unzips to more data than is allowed.")
+
+            sheet_path = active_sheet_path(archive)
+            if sheet_path not in members:
+                raise UploadRejected(f"The workbook is damaged: {sheet_path} is missing.")
+            # The header row is not a data row
+            rows = max(sheet_row_count(archive, sheet_path, None if max_rows is None else max_rows + 1) - 1, 0)
+    except (zipfile.BadZipFile, ElementTree.ParseError, KeyError, ValueError, EOFError) as e:
+        raise UploadRejected(f"The workbook is damaged: {e}")
+
+    if max_rows is not None and rows > max_rows:
+        raise UploadRejected(f"The workbook has more than the {max_rows} rows allowed.")
+    return rows
+
+# Function to check that a saved upload is a delimited text file within `max_rows`
+# data rows, in the encoding it will be read with (Excel saves "CSV" in the Windows
+# code page, "CSV UTF-8" in UTF-8). Lines are counted, so quoted values spanning lines
+# count more than once. Returns the number of data rows. Raises UploadRejected with
+# the reason otherwise.
+def validate_delimited(file_path, max_rows=MAX_UPLOAD_ROWS):
+    lines = 0
+    last = b'\n'
+    decoder = codecs.getincrementaldecoder(DELIMITED_ENCODING)()
+    with open(file_path, 'rb') as source:
+        for chunk in iter(lambda: source.read(SCAN_CHUNK_SIZE), b''):
+            # Text files do not have NUL bytes; workbooks and UTF-16 text do
+            if b'\0' in chunk:
+                raise UploadRejected("The file is not UTF-8 delimited text.")
+            try:
+                decoder.decode(chunk)
+            except UnicodeDecodeError as e:
+                line = lines + chunk[:max(e.start, 0)].count(b'\n') + 1
+                raise UploadRejected(f"The file is not UTF-8 text (line {line}). "
+                                     "Save it as CSV UTF-8 and upload it again.")
+            lines += chunk.count(b'\n')
+            last = chunk[-1:]
+            if max_rows is not None and lines > max_rows + 1:
+                break
+    # The last line may not end with a line break
+    if last != b'\n':
+        lines += 1
+    rows = max(lines - 1, 0)
+    if max_rows is not None and rows > max_rows:
+        raise UploadRejected(f"The file has more than the {max_rows} rows allowed.")
+    try:
+        decoder.decode(b'', final=True)
+    except UnicodeDecodeError:
+        raise UploadRejected("The file is not UTF-8 text (it ends part way through a character). "
+                             "Save it as CSV UTF-8 and upload it again.")
+    return rows
+
+# Function to check a saved upload by the extension of its original `filename`:
+# workbooks with validate_workbook and delimited text with validate_delimited
+def validate_upload(file_path, filename, max_rows=MAX_UPLOAD_ROWS):
+    if filename.lower().endswith('.xlsx'):
+        return validate_workbook(file_path, max_rows)
+    return validate_delimited(file_path, max_rows)
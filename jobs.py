@@ -0,0 +1,255 @@
+from concurrent.futures import ThreadPoolExecutor
+import json, os, re, threading, time, uuid
+
+from processing import process_uploaded_file
+from batch import process_batch, batch_messages
+from metrics import observe_summary
+from workspace import JOB_STATUS_FOLDER, WORKSPACE_FOLDER, remove_workspace
+
+# Number of uploads processed at the same time
+JOB_WORKERS = 2
+
+# Number of jobs kept for status polling; the oldest finished jobs are dropped first
+MAX_JOBS = 1000
+
+# Folder with the status of each job, written each time it changes, so an app process
+# can answer for the jobs of the others. Must be shared by all of them, like WORKSPACE_FOLDER.
+JOB_STATUS_PATH = os.path.join(WORKSPACE_FOLDER, JOB_STATUS_FOLDER)
+
+# Seconds between two reads of the status of a job running in another process
+JOB_POLL_INTERVAL = 0.5
+
+jobs = {}
+jobs_lock = threading.Lock()
+# Notified whenever a job changes, for the progress event streams
+job_updated = threading.Condition(jobs_lock)
+executor = None
+
+
+# Function to start the worker pool on first use
+def get_executor():
+    global executor
+    with jobs_lock:
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix='dq-job')
+    return executor
+
+# Function to create a job record and add it to the job list
+def new_job(filename, file_paths):
+    job = {
+        'id': uuid.uuid4().hex,
+        'filename': filename,
+        'file_paths': file_paths,
+        'status': 'queued',
+        'messages': [],
+        'progress': None,
+        'version': 0,
+        'timings': {},
+        'summary': None,
+        'error': None,
+        'submitted_at': time.time(),
+        'started_at': None,
+        'finished_at': None,
+    }
+    with jobs_lock:
+        jobs[job['id']] = job
+        trim_jobs()
+    save_job(job)
+    return job
+
+# Function to queue a saved upload for processing. Returns the new job.
+def submit_job(file_path, filename, options=None, content_hash=None):
+    job = new_job(filename, [file_path])
+    get_executor().submit(run_job, job, options, content_hash)
+    return job
+
+# Function to queue several saved uploads to be processed across worker processes.
+# `content_hashes` has the SHA-256 of each upload, where known.
+def submit_batch_job(file_paths, filename, workers=None, options=None, content_hashes=None):
+    job = new_job(filename, file_paths)
+    get_executor().submit(run_batch_job, job, workers, options, content_hashes)
+    return job
+
+# Function to drop the oldest finished jobs once MAX_JOBS is reached
+def trim_jobs():
+    finished = [job_id for job_id, job in jobs.items() if job['status'] in ('done', 'failed')]
+    for job_id in finished[:max(0, len(jobs) - MAX_JOBS)]:
+        del jobs[job_id]
+
+# Function to get the path of the status file of a job
+def job_status_path(job_id):
+    return os.path.join(JOB_STATUS_PATH, f'{job_id}.json')
+
+# Function to write the status of a job to its file. It is written to a temporary
+# file and renamed, so other processes never read part of it.
+def save_job(job):
+    path = job_status_path(job['id'])
+    temporary = f'{path}.{os.getpid()}.tmp'
+    try:
+        os.makedirs(JOB_STATUS_PATH, exist_ok=True)
+        with open(temporary, 'w') as status_file:
+            json.dump(job, status_file)
+        os.replace(temporary, path)
+    except OSError:
+        # The job still runs; only the other processes do not see this change
+        pass
+
+# Function to read the status of a job from its file. Returns None for an unknown job.
+def load_job(job_id):
+    if not re.fullmatch(r'[0-9a-f]{32}', job_id):
+        return None
+    try:
+        with open(job_status_path(job_id)) as status_file:
+            return json.load(status_file)
+    except (OSError, ValueError):
+        return None
+
+# Function to tell the event streams that a job changed
+def touch_job(job):
+    with job_updated:
+        job['version'] += 1
+        job_updated.notify_all()
+    save_job(job)
+
+# Function to wait until a job changes after `version`, or `timeout` seconds pass.
+# A job of another process is followed by reading its status file. Returns the job.
+def wait_for_job(job, version, timeout=None):
+    with job_updated:
+        if jobs.get(job['id']) is job:
+            job_updated.wait_for(lambda: job['version'] != version, timeout)
+            return job
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        job = load_job(job['id']) or job
+        if job['version'] != version or (deadline is not None and time.monotonic() >= deadline):
+            return job
+        time.sleep(JOB_POLL_INTERVAL)
+
+# Function to build the progress callback of a job
+def job_progress(job):
+    def report(progress):
+        job['progress'] = progress
+        touch_job(job)
+    return report
+
+# Function to mark a job as started
+def start_job(job):
+    job['started_at'] = time.time()
+    job['timings']['queued'] = job['started_at'] - job['submitted_at']
+    job['status'] = 'running'
+    touch_job(job)
+
+# Function to remove the workspace of a job once its outputs are published. The
+# workspace of a failed job is kept, with the upload in it, to look into.
+def clean_up_workspace(job, options):
+    if job['status'] == 'done' and options and options.get('workspace'):
+        remove_workspace(options['workspace'])
+
+# Function to process one job on a worker thread
+def run_job(job, options, content_hash=None):
+    start_job(job)
+
+    # Messages that the upload page used to flash
+    def notify(message, category='message'):
+        job['messages'].append((category, message))
+        touch_job(job)
+
+    start = time.perf_counter()
+    try:
+        summary = process_uploaded_file(job['file_paths'][0], notify, options, content_hash, job_progress(job))
+    except Exception as e:
+        job['error'] = str(e)
+        notify(f"Processing failed: {e}", 'danger')
+        job['status'] = 'failed'
+    else:
+        processing_time = time.perf_counter() - start
+        job['summary'] = summary
+        observe_summary(summary)
+        if summary:
+            job['timings'].update(summary['timings'])
+        job['timings']['processing'] = processing_time
+        notify(f'File processed successfully in {processing_time:.2f} seconds', 'success')
+        notify(f"{job['filename']} has been processed successfully.", 'success')
+        job['status'] = 'done'
+    finally:
+        clean_up_workspace(job, options)
+        job['finished_at'] = time.time()
+        touch_job(job)
+
+# Function to process a batch job: the worker thread waits on the process pool
+def run_batch_job(job, workers, options, content_hashes=None):
+    start_job(job)
+    try:
+        batch = process_batch(job['file_paths'], workers, options, job_progress(job), content_hashes)
+    except Exception as e:
+        job['error'] = str(e)
+        job['messages'].append(('danger', f"Processing failed: {e}"))
+        job['status'] = 'failed'
+    else:
+        job['messages'].extend(batch_messages(batch))
+        for result in batch['files']:
+            observe_summary(result['summary'])
+        job['summary'] = {
+            'files': [dict(result['summary'] or {}, file_path=result['file_path'], error=result['error'])
+                      for result in batch['files']],
+            'workers': batch['workers'],
+            'parallelism': batch['parallelism'],
+        }
+        job['timings'].update(processing=batch['wall_time'], cpu=batch['cpu_time'])
+        job['status'] = 'failed' if any(result['error'] for result in batch['files']) else 'done'
+    finally:
+        clean_up_workspace(job, options)
+        job['finished_at'] = time.time()
+        touch_job(job)
+
+# Function to find a job by ID, in this process or from its status file
+def get_job(job_id):
+    with jobs_lock:
+        job = jobs.get(job_id)
+    return job if job is not None else load_job(job_id)
+
+# Function to read the most recently changed job status files
+def stored_jobs(limit):
+    if not os.path.isdir(JOB_STATUS_PATH):
+        return []
+    changed = []
+    for entry in os.scandir(JOB_STATUS_PATH):
+        if entry.name.endswith('.json'):
+            try:
+                changed.append((entry.stat().st_mtime, entry.name[:-len('.json')]))
+            except OSError:
+                # Expired while the folder was listed
+                continue
+    changed.sort(reverse=True)
+    loaded = (load_job(job_id) for _, job_id in changed[:limit])
+    return [job for job in loaded if job is not None]
+
+# Function to list the most recent jobs first, from all processes
+def list_jobs(limit=50):
+    with jobs_lock:
+        recent = {job['id']: job for job in list(jobs.values())[-limit:]}
+    for job in stored_jobs(limit):
+        recent.setdefault(job['id'], job)
+    return sorted(recent.values(), key=lambda job: job['submitted_at'], reverse=True)[:limit]
+
+# Function to count the jobs of this process by status
+def job_counts():
+    with jobs_lock:
+        statuses = [job['status'] for job in jobs.values()]
+    return {status: statuses.count(status) for status in ('queued', 'running', 'done', 'failed')}
+
+# Function to turn a job into a JSON-friendly dict for the status endpoints
+def job_status(job):
+    return {
+        'id': job['id'],
+        'filename': job['filename'],
+        'status': job['status'],
+        'messages': [{'category': category, 'message': message} for category, message in job['messages']],
+        'progress': job['progress'],
+        'timings': {stage: round(seconds, 4) for stage, seconds in job['timings'].items()},
+        'summary': job['summary'],
+        'error': job['error'],
+        'submitted_at': job['submitted_at'],
+        'started_at': job['started_at'],
+        'finished_at': job['finished_at'],
+    }
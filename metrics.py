@@ -0,0 +1,192 @@
+import cProfile, os, sys, threading, time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Folder for the cProfile dumps of profiled jobs
+PROFILE_FOLDER = 'profiles'
+
+# The row rules are timed on one row in this many; their totals are estimated from the sample
+STAGE_SAMPLE_ROWS = 100
+
+# Stages of the row pass, in the order they run on a row
+ROW_STAGES = ['dedup', 'clean', 'blank_check', 'bvn_check', 'date_format', 'gender_map']
+
+# Exposed metrics: name, type and help text
+STAGE_METRICS = [
+    ('wall', 'dq_stage_wall_seconds_total', 'counter', "Wall time spent in each pipeline stage"),
+    ('cpu', 'dq_stage_cpu_seconds_total', 'counter', "CPU time spent in each pipeline stage"),
+    ('rows_in', 'dq_stage_rows_in_total', 'counter', "Rows entering each pipeline stage"),
+    ('rows_out', 'dq_stage_rows_out_total', 'counter', "Rows leaving each pipeline stage"),
+]
+
+registry = {'files': {}, 'rows': {}, 'stages': {}, 'memory': {}}
+registry_lock = threading.Lock()
+
+
+# Function to get the peak resident memory of this process in bytes (None if unknown)
+def peak_rss():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+# Function to get the current resident memory of this process in bytes, read from
+# /proc/self/statm (None where there is no /proc)
+def current_rss():
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+# Function to read the clocks at the start of a stage
+def stage_clock():
+    return time.perf_counter(), time.process_time(), current_rss()
+
+# Function to add a measurement to the metrics of a stage in the summary
+def add_stage(summary, stage, wall, cpu, memory=None):
+    metrics = summary['stages'].setdefault(stage, {'wall': 0, 'cpu': 0, 'memory': None, 'rows_in': None, 'rows_out': None})
+    metrics['wall'] += wall
+    metrics['cpu'] += cpu
+    if memory is not None:
+        metrics['memory'] = (metrics['memory'] or 0) + memory
+
+# Function to add the wall time, CPU time and memory change of a stage since `start`
+# (from stage_clock) to the summary, and return the clocks for the next stage.
+# Memory is the resident memory of the process at the end of the stage less at its
+# start, so it is negative when the stage frees more than it keeps.
+def record_stage(summary, stage, start):
+    now = stage_clock()
+    memory = now[2] - start[2] if now[2] is not None and start[2] is not None else None
+    add_stage(summary, stage, now[0] - start[0], now[1] - start[1], memory)
+    return now
+
+# Function to record a top-level stage: as record_stage, also adding its wall time to the timings
+def record_timing(summary, stage, start):
+    now = record_stage(summary, stage, start)
+    summary['timings'][stage] = summary['timings'].get(stage, 0) + now[0] - start[0]
+    return now
+
+# Function to start the sampled timings of the row stages
+def new_row_profile():
+    return {stage: {'wall': 0, 'cpu': 0, 'rows': 0} for stage in ROW_STAGES}
+
+# Function to time one row stage: runs `step(*args)` and returns its result
+def profile_step(profile, stage, step, *args):
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    result = step(*args)
+    sample = profile[stage]
+    sample['wall'] += time.perf_counter() - start_wall
+    sample['cpu'] += time.process_time() - start_cpu
+    sample['rows'] += 1
+    return result
+
+# Function to estimate the total time of each row stage from its sampled rows
+def record_row_profile(summary, profile):
+    counts = stage_row_counts(summary)
+    for stage in ROW_STAGES:
+        sample = profile[stage]
+        rows_in = counts[stage][0]
+        if sample['rows'] and rows_in:
+            scale = rows_in / sample['rows']
+            add_stage(summary, stage, sample['wall'] * scale, sample['cpu'] * scale)
+
+# Function to work out the rows in and out of each stage from the summary counts
+def stage_row_counts(summary):
+    rows = summary['rows']
+    unique = rows - summary['duplicates']
+    not_blank = unique - summary['blank_rows']
+    kept = summary['rows_written']
+    exceptions = summary['duplicates'] + summary['blank_rows'] + summary['invalid_bvn'] + summary['unparsed_dates']
+    return {
+        'load': (rows, rows),
+        'dedup': (rows, unique),
+        'clean': (unique, unique),
+        'blank_check': (unique, not_blank),
+        'bvn_check': (not_blank, kept),
+        'date_format': (kept, kept),
+        'gender_map': (kept, kept),
+        'rules': (rows, kept),
+        'exceptions': (exceptions, exceptions),
+        'remove_rows': (rows, kept),
+        'save': (kept, kept),
+        'text_export': (kept, kept),
+    }
+
+# Function to fill in the rows in and out of each recorded stage
+def record_stage_rows(summary):
+    counts = stage_row_counts(summary)
+    for stage, metrics in summary['stages'].items():
+        if stage in counts:
+            metrics['rows_in'], metrics['rows_out'] = counts[stage]
+
+# Function to run `function(*args)` under cProfile, dumping the stats to the profile
+# folder. Returns the function's result and the path of the dump.
+def run_profiled(name, function, *args):
+    os.makedirs(PROFILE_FOLDER, exist_ok=True)
+    profile_path = os.path.join(PROFILE_FOLDER, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.prof")
+    profiler = cProfile.Profile()
+    try:
+        result = profiler.runcall(function, *args)
+    finally:
+        profiler.dump_stats(profile_path)
+    return result, profile_path
+
+
+# Function to add the stages of a processed file to the totals exposed on /metrics
+def observe_summary(summary):
+    if not summary:
+        return
+    file_type = summary.get('file_type', 'unknown')
+    cached = 'true' if summary.get('cached') else 'false'
+    with registry_lock:
+        files_key = (file_type, cached)
+        registry['files'][files_key] = registry['files'].get(files_key, 0) + 1
+        registry['rows'][file_type] = registry['rows'].get(file_type, 0) + summary['rows']
+        for stage, metrics in summary.get('stages', {}).items():
+            totals = registry['stages'].setdefault((file_type, stage), dict.fromkeys(['wall', 'cpu', 'rows_in', 'rows_out'], 0))
+            for key in totals:
+                totals[key] += metrics[key] or 0
+            if metrics['memory'] is not None:
+                registry['memory'][(file_type, stage)] = max(registry['memory'].get((file_type, stage), metrics['memory']),
+                                                             metrics['memory'])
+
+# Function to format a metric line with its labels
+def metric_line(name, labels, value):
+    label_text = ','.join(f'{key}="{value}"' for key, value in labels.items())
+    return f"{name}{{{label_text}}} {value}"
+
+# Function to render the totals in the Prometheus text format. `jobs` is an
+# optional count of jobs by status.
+def render_metrics(jobs=None):
+    lines = ["# HELP dq_files_processed_total Files processed, by type and whether the result cache was used",
+             "# TYPE dq_files_processed_total counter"]
+    with registry_lock:
+        for (file_type, cached), count in sorted(registry['files'].items()):
+            lines.append(metric_line('dq_files_processed_total', {'file_type': file_type, 'cached': cached}, count))
+
+        lines += ["# HELP dq_rows_processed_total Data rows read from processed files",
+                  "# TYPE dq_rows_processed_total counter"]
+        for file_type, count in sorted(registry['rows'].items()):
+            lines.append(metric_line('dq_rows_processed_total', {'file_type': file_type}, count))
+
+        for key, name, metric_type, help_text in STAGE_METRICS:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+            for (file_type, stage), totals in sorted(registry['stages'].items()):
+                lines.append(metric_line(name, {'file_type': file_type, 'stage': stage}, totals[key]))
+
+        lines += ["# HELP dq_stage_memory_bytes_max Largest change of the process resident memory over each stage",
+                  "# TYPE dq_stage_memory_bytes_max gauge"]
+        for (file_type, stage), memory in sorted(registry['memory'].items()):
+            lines.append(metric_line('dq_stage_memory_bytes_max', {'file_type': file_type, 'stage': stage}, memory))
+
+    if jobs is not None:
+        lines += ["# HELP dq_jobs Jobs kept for status polling, by status", "# TYPE dq_jobs gauge"]
+        for status, count in sorted(jobs.items()):
+            lines.append(metric_line('dq_jobs', {'status': status}, count))
+    return '\n'.join(lines) + '\n'
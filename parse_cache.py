@@ -0,0 +1,193 @@
+import json, os, shutil, tempfile, time
+from datetime import datetime, date, time as day_time, timedelta
+
+from result_cache import ENTRY_FILE, entry_folder, evict, lookup
+
+# Folder holding the parsed sheets of uploads, one sub-folder per file hash
+PARSE_CACHE_FOLDER = 'parse_cache'
+
+# Total size of the parsed sheets; the least recently used are removed beyond it
+PARSE_CACHE_MAX_BYTES = 5 * 1024 * 1024 * 1024
+
+# Rows written to each Arrow file of an entry. Each file has its own column types,
+# so a sheet can be written as it is read without knowing all of its values first.
+PARSE_BATCH_ROWS = 65536
+
+# Cell value types kept in the cache, in the order of their union type codes
+CELL_TYPES = [type(None), str, bool, int, float, datetime, date, day_time, timedelta]
+
+
+# Function to import pyarrow, which is optional and only needed for this cache
+def require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+    except ImportError:
+        raise ImportError("The parse cache needs pyarrow installed (pip install pyarrow).")
+    return pyarrow
+
+# Function to get the Arrow type stored for a cell value type
+def arrow_type(pa, cell_type):
+    return {
+        type(None): pa.null(),
+        str: pa.string(),
+        bool: pa.bool_(),
+        int: pa.int64(),
+        float: pa.float64(),
+        datetime: pa.timestamp('us'),
+        date: pa.date32(),
+        day_time: pa.time64('us'),
+        timedelta: pa.duration('us'),
+    }[cell_type]
+
+# Function to turn the values of one column into an Arrow array. A column holding
+# one type of value (and blanks) becomes an array of that type; a mixed column
+# becomes a dense union, so every value reads back with the type it was parsed as.
+def encode_column(pa, values):
+    types = {type(value) for value in values} - {type(None)}
+    if len(types) <= 1:
+        return pa.array(values, type=arrow_type(pa, types.pop() if types else type(None)))
+
+    type_codes = {cell_type: code for code, cell_type in enumerate(CELL_TYPES)}
+    children = {cell_type: [] for cell_type in CELL_TYPES}
+    codes = []
+    offsets = []
+    for value in values:
+        child = children[type(value)]
+        codes.append(type_codes[type(value)])
+        offsets.append(len(child))
+        child.append(value)
+    arrays = [pa.nulls(len(children[cell_type])) if cell_type is type(None)
+              else pa.array(children[cell_type], type=arrow_type(pa, cell_type))
+              for cell_type in CELL_TYPES]
+    return pa.UnionArray.from_dense(pa.array(codes, type=pa.int8()), pa.array(offsets, type=pa.int32()),
+                                    arrays, [cell_type.__name__ for cell_type in CELL_TYPES],
+                                    list(range(len(CELL_TYPES))))
+
+
+# The parsed sheet of one upload, keyed by the SHA-256 of the file. On a hit the
+# rows are read back from Arrow files that are memory-mapped, so no column is copied
+# until it is turned into Python values. On a miss, `record` wraps the rows read
+# from the workbook and saves them as they pass, once the whole sheet has been read.
+class ParsedUpload:
+    def __init__(self, content_hash, file_name, cache_folder=PARSE_CACHE_FOLDER, max_bytes=PARSE_CACHE_MAX_BYTES):
+        self.pa = require_pyarrow()
+        self.content_hash = content_hash
+        self.file_name = file_name
+        self.cache_folder = cache_folder
+        self.max_bytes = max_bytes
+        self.folder = entry_folder(content_hash, cache_folder)
+        self.entry = lookup(content_hash, cache_folder)
+        self.hit = self.entry is not None
+        if self.hit:
+            self.title = self.entry['title']
+            self.max_row = self.entry['max_row']
+            self.max_column = self.entry['max_column']
+
+    # Function to read the cached sheet as whole columns, one list per column
+    def columns(self):
+        columns = [[] for _ in range(self.max_column)]
+        for table in self.tables():
+            for col_idx, column in enumerate(columns):
+                if col_idx < table.num_columns:
+                    column.extend(table.column(col_idx).to_pylist())
+                else:
+                    column.extend([None] * table.num_rows)
+        return columns
+
+    # Function to read the cached sheet back as rows, header first
+    def rows(self):
+        for table in self.tables():
+            for row in zip(*[column.to_pylist() for column in table.columns]):
+                yield list(row)
+
+    # Function to memory-map the Arrow files of the entry in order
+    def tables(self):
+        pa = self.pa
+        for part in self.entry['parts']:
+            with pa.memory_map(os.path.join(self.folder, part)) as source:
+                yield pa.ipc.open_file(source).read_all()
+
+    # Function to pass the rows read from a workbook through, saving them as they go
+    def record(self, title, max_row, max_column, rows):
+        os.makedirs(self.cache_folder, exist_ok=True)
+        temp_folder = tempfile.mkdtemp(prefix='.tmp-', dir=self.cache_folder)
+        self.parts = []
+        self.batch = []
+        self.saved_rows = 0
+        self.width = 0
+        self.failed = False
+        try:
+            for row in rows:
+                if not self.failed:
+                    # Copied, as the rules change the row in place once it is passed on
+                    self.batch.append(tuple(row))
+                    if len(self.batch) >= PARSE_BATCH_ROWS:
+                        self.write_part(temp_folder)
+                yield row
+            if self.batch:
+                self.write_part(temp_folder)
+            if not self.failed:
+                self.save(temp_folder, title, max_row, max_column)
+        finally:
+            shutil.rmtree(temp_folder, ignore_errors=True)
+
+    # Function to write the collected rows to the next Arrow file of the entry.
+    # A value Arrow cannot hold leaves the upload out of the cache.
+    def write_part(self, temp_folder):
+        pa = self.pa
+        width = max(len(row) for row in self.batch)
+        try:
+            columns = [encode_column(pa, [row[col_idx] if col_idx < len(row) else None for row in self.batch])
+                       for col_idx in range(width)]
+            part = f"part-{len(self.parts):05d}.arrow"
+            batch = pa.record_batch(columns, names=[str(col_idx) for col_idx in range(width)])
+            with pa.OSFile(os.path.join(temp_folder, part), 'wb') as sink:
+                with pa.ipc.new_file(sink, batch.schema) as writer:
+                    writer.write_batch(batch)
+        except (KeyError, OverflowError, pa.ArrowException):
+            self.failed = True
+        else:
+            self.parts.append(part)
+            self.saved_rows += len(self.batch)
+            self.width = max(self.width, width)
+        self.batch = []
+
+    # Function to describe the entry and rename it into place
+    def save(self, temp_folder, title, max_row, max_column):
+        size = sum(os.path.getsize(os.path.join(temp_folder, part)) for part in self.parts)
+        entry = {
+            'file_name': self.file_name,
+            'title': title,
+            'max_row': max_row,
+            # Rows may be wider than the sheet dimension says
+            'max_column': max(max_column or 0, self.width),
+            'rows': self.saved_rows,
+            'parts': self.parts,
+            'size': size,
+            'created_at': time.time(),
+        }
+        with open(os.path.join(temp_folder, ENTRY_FILE), 'w') as entry_file:
+            json.dump(entry, entry_file)
+        try:
+            os.rename(temp_folder, self.folder)
+        except OSError:
+            # Another job saved the same upload first
+            return
+        evict(self.cache_folder, self.max_bytes)
+
+
+# Function to list the uploads in the parse cache, oldest first, as (hash, file name)
+# pairs, for replaying them under new rules
+def cached_uploads(cache_folder=PARSE_CACHE_FOLDER):
+    uploads = []
+    if not os.path.isdir(cache_folder):
+        return uploads
+    for content_hash in os.listdir(cache_folder):
+        try:
+            with open(os.path.join(entry_folder(content_hash, cache_folder), ENTRY_FILE)) as entry_file:
+                entry = json.load(entry_file)
+            uploads.append((entry['created_at'], content_hash, entry['file_name']))
+        except (OSError, ValueError, KeyError):
+            continue
+    return [(content_hash, file_name) for _, content_hash, file_name in sorted(uploads)]
@@ -0,0 +1,861 @@
+import openpyxl
+from openpyxl import load_workbook
+from openpyxl.utils import column_index_from_string
+from bisect import bisect_left
+from collections import deque
+import csv, os
+from dates import format_date_value, new_date_counts
+from dedup import DEDUP_MEMORY_BUDGET, RowDeduplicator, key_digest, row_digest
+from text_export import PipeDelimitedWriter, text_output_path, write_pipe_delimited_rows
+from exception_report import ExceptionWorkbook, exception_export_path
+from progress import ProgressReporter
+from customer_index import CustomerIndexBatch
+from delta_store import DeltaStore
+from workspace import publish_outputs, workspace_notify
+from metrics import (
+    STAGE_SAMPLE_ROWS, stage_clock, record_timing, new_row_profile, profile_step, record_row_profile,
+    record_stage_rows, run_profiled
+)
+
+PROCESSED_FOLDER = 'processed'
+DATA_QUALITY_FOLDER = 'data quality'
+INDIVIDUAL_BORROWER_FOLDER = 'individual_borrower'
+CORPORATE_BORROWER_FOLDER = 'corporate_borrower'
+CREDIT_INFORMATION_FOLDER = 'credit_information'
+GUARANTORS_INFORMATION_FOLDER = 'guarantors_information'
+PRINCIPAL_OFFICERS_FOLDER = 'principal_officers'
+
+# Files at or above this size are processed in streaming mode (read-only input,
+# write-only outputs) so memory stays flat. Set to 0 to stream every upload.
+STREAMING_MIN_FILE_SIZE = 5 * 1024 * 1024
+
+# Processing options; callers pass a dict that overrides any of these
+#   streaming_min_file_size - see STREAMING_MIN_FILE_SIZE
+#   engine                  - 'openpyxl' (cell by cell) or 'pandas' (vectorized columns, needs pandas)
+#   dedup_memory_budget     - bytes of row digests kept in memory before they spill to disk
+#   dedup_spill_folder      - folder for the spilled digests (system temp folder if None)
+#   result_cache            - reuse the outputs of an identical file processed before
+#   text_compression        - None for a plain .txt export or 'gzip' for .txt.gz
+#   exception_export        - also export the exceptions as 'csv' or 'parquet' (None for neither)
+#   profile                 - run the file under cProfile and dump the stats to the profiles folder
+#   parse_cache             - keep the parsed sheet of each upload as Arrow files and read it
+#                             from there when the same file comes back (needs pyarrow)
+#   customer_index          - path of the SQLite customer index used for the cross-file checks
+#                             (None to leave them out); see customer_index.py
+#   workspace               - folder of the job the file was saved in (see workspace.py); the
+#                             outputs are written there and published to the shared folders at
+#                             the end. None to write them straight to the shared folders.
+#   row_workers             - processes that parse and check the rows of a file processed in
+#                             streaming mode, in chunks (see chunked.py); None to use one
+#   delta_store             - path of the SQLite store of the last submission of each file, so
+#                             only new and changed rows go through the rules (None to leave it
+#                             out); see delta_store.py
+DEFAULT_OPTIONS = {
+    'streaming_min_file_size': STREAMING_MIN_FILE_SIZE,
+    'engine': 'openpyxl',
+    'dedup_memory_budget': DEDUP_MEMORY_BUDGET,
+    'dedup_spill_folder': None,
+    'result_cache': False,
+    'text_compression': None,
+    'exception_export': None,
+    'profile': False,
+    'parse_cache': False,
+    'customer_index': None,
+    'workspace': None,
+    'row_workers': None,
+    'delta_store': None,
+}
+
+# App config settings (and command line flags, see cli.py) for each processing option
+OPTION_SETTINGS = {
+    'streaming_min_file_size': 'STREAMING_MIN_FILE_SIZE',
+    'engine': 'PROCESSING_ENGINE',
+    'result_cache': 'RESULT_CACHE',
+    'text_compression': 'TEXT_COMPRESSION',
+    'exception_export': 'EXCEPTION_EXPORT',
+    'profile': 'PROFILE_JOBS',
+    'customer_index': 'CUSTOMER_INDEX',
+    'parse_cache': 'PARSE_CACHE',
+    'row_workers': 'ROW_WORKERS',
+    'delta_store': 'DELTA_STORE',
+}
+
+ALL_COLUMNS_TO_V = ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H', 'I', 'J', 'K', 'L', 'M', 'N', 'O', 'P', 'Q', 'R', 'S', 'T', 'U', 'V']
+
+# Rules for each file type. The key is the name that must appear in the file name.
+#   folder           - where uploads of this type are saved
+#   required_columns - rows with a blank in any of these go to the Blank Rows sheet of the _Exceptions workbook
+#   date_columns     - values are normalised to dd-Mon-yyyy
+#   gender_columns   - M/Male and F/Female are replaced with 001/002
+#   bvn_column       - rows whose BVN does not start with '2' go to the Non-BVN Start With 2 sheet
+#                      (a column can only be one of the date, gender and BVN columns)
+#   customer_column  - optional customer ID column, used with customer_index
+#   customer_index   - optional role of the file in the customer index: 'borrower' files
+#                      add their customers to it, 'reference' files are checked against it
+#   export_text      - write a pipe-delimited .txt copy to the processed folder
+#   dedup_columns    - optional business key; duplicates are matched on these columns
+#                      instead of the whole row
+#   delta_columns    - optional key matching the rows of a submission to those of the last
+#                      one, for the delta store (the customer column if left out)
+# Adding a new file type only needs a new entry here.
+FILE_SPECS = {
+    "Individual-Borrower": {
+        'folder': INDIVIDUAL_BORROWER_FOLDER,
+        'required_columns': ['A', 'C', 'D', 'F', 'I'],
+        'date_columns': ['F'],
+        'gender_columns': ['K'],
+        'bvn_column': 'I',
+        'customer_column': 'A',
+        'customer_index': 'borrower',
+        'export_text': True,
+    },
+    "Credit-Information": {
+        'folder': CREDIT_INFORMATION_FOLDER,
+        'required_columns': ['A', 'B', 'C', 'D', 'E', 'H', 'J', 'M', 'S'],
+        'date_columns': ['D', 'E', 'P', 'R', 'U'],
+        'gender_columns': [],
+        'bvn_column': 'I',
+        'customer_column': 'A',
+        'customer_index': 'reference',
+        'export_text': True,
+    },
+    "Corporate-Borrower": {
+        'folder': CORPORATE_BORROWER_FOLDER,
+        'required_columns': ['B', 'F'],
+        'date_columns': ['E'],
+        'gender_columns': [],
+        'bvn_column': 'I',
+        'customer_column': 'A',
+        'customer_index': 'borrower',
+        'export_text': False,
+    },
+    "Guarantors-Information": {
+        'folder': GUARANTORS_INFORMATION_FOLDER,
+        'required_columns': ALL_COLUMNS_TO_V,
+        'date_columns': [],
+        'gender_columns': ['J'],
+        'bvn_column': 'I',
+        'export_text': True,
+    },
+    "Principal-Officers": {
+        'folder': PRINCIPAL_OFFICERS_FOLDER,
+        'required_columns': ALL_COLUMNS_TO_V,
+        'date_columns': ['E', 'V'],
+        'gender_columns': ['F', 'W'],
+        'bvn_column': 'I',
+        'export_text': True,
+    },
+}
+
+# Define the specific names to check for in the file name
+SPECIFIC_NAME = list(FILE_SPECS)
+
+# Delimited text files taken instead of a workbook, by extension, with the csv module
+# settings to read and write them (see delimited.py). Pipe-delimited files are not quoted.
+DELIMITED_FORMATS = {
+    '.csv': {'delimiter': ','},
+    '.tsv': {'delimiter': '\t'},
+    '.txt': {'delimiter': '|', 'quoting': csv.QUOTE_NONE},
+}
+
+# Encoding of delimited uploads; a byte order mark at the start is skipped
+DELIMITED_ENCODING = 'utf-8-sig'
+
+# Extensions of the files that can be processed
+INPUT_EXTENSIONS = ('.xlsx',) + tuple(DELIMITED_FORMATS)
+
+GENDER_CODES = {"M": "001", "Male": "001", "F": "002", "Female": "002"}
+
+
+# Function to create the output folder and the folder for each file type, under `root`
+def ensure_folders(root=''):
+    for folder in [PROCESSED_FOLDER, DATA_QUALITY_FOLDER] + [spec['folder'] for spec in FILE_SPECS.values()]:
+        os.makedirs(os.path.join(root, folder), exist_ok=True)
+
+# Default message handler when the caller does not collect messages
+def ignore_message(message, category='message'):
+    pass
+
+# Function to find the file type from a file name
+def get_file_type(filename):
+    basename = os.path.basename(filename)
+    for name in SPECIFIC_NAME:
+        if name in basename:
+            return name
+    return None
+
+# Function to check if a file is delimited text rather than a workbook
+def is_delimited_file(filename):
+    return os.path.splitext(filename)[1].lower() in DELIMITED_FORMATS
+
+# Function to check if a file should be processed in streaming mode
+def use_streaming(file_path, min_file_size=STREAMING_MIN_FILE_SIZE):
+    return os.path.getsize(file_path) >= min_file_size
+
+# Function to fill in the defaults for any processing options not given
+def processing_options(options=None):
+    return dict(DEFAULT_OPTIONS, **(options or {}))
+
+# Function to build the processing options from settings named as in the app config
+# (app.config in app.py, the command line flags in cli.py). Settings that are missing
+# or None take their defaults.
+def options_from_settings(settings):
+    return processing_options({option: settings[name] for option, name in OPTION_SETTINGS.items()
+                               if settings.get(name) is not None})
+
+# Function to process the uploaded file based on its type. `content_hash` is the
+# SHA-256 of the upload when the caller computed it while saving the file, and
+# `progress` is called with the stage, rows done, rows per second and ETA as it runs.
+def process_uploaded_file(file_path, notify=None, options=None, content_hash=None, progress=None):
+    notify = notify or ignore_message
+    options = processing_options(options)
+    file_type = get_file_type(file_path)
+    if file_type is None:
+        notify("Unknown file type.", 'danger')
+        return None
+
+    # Messages name the published outputs, not the copies in the job's workspace
+    workspace = options['workspace']
+    if workspace:
+        notify = workspace_notify(workspace, notify)
+
+    # Cached results would skip the customer index, whose checks depend on the files indexed
+    # since, and the delta store, whose report depends on the submission before
+    if options['result_cache'] and not options['customer_index'] and not options['delta_store']:
+        from result_cache import process_with_cache
+        summary = process_with_cache(file_path, file_type, notify, options, content_hash, progress)
+    else:
+        summary = process_file_type(file_path, file_type, notify, options, progress, content_hash)
+
+    if workspace:
+        summary = publish_outputs(workspace, summary)
+    return summary
+
+# Function to run the rules of a file type over a file, under cProfile if asked for
+def process_file_type(file_path, file_type, notify, options, progress=None, content_hash=None):
+    reporter = ProgressReporter(progress)
+    if options['profile']:
+        name = os.path.splitext(os.path.basename(file_path))[0]
+        summary, profile_path = run_profiled(name, run_engine, file_path, file_type, notify, options, reporter, content_hash)
+        summary['profile'] = profile_path
+        return summary
+    return run_engine(file_path, file_type, notify, options, reporter, content_hash)
+
+# Function to process a file with the engine chosen in the options
+def run_engine(file_path, file_type, notify, options, progress, content_hash=None):
+    spec = FILE_SPECS[file_type]
+    parsed = None
+    # Delimited files are quick enough to read that the parse cache is not used for them
+    if options['parse_cache'] and not is_delimited_file(file_path):
+        # Only loaded when asked for, as pyarrow is optional
+        from parse_cache import ParsedUpload
+        from result_cache import hash_file
+        parsed = ParsedUpload(content_hash or hash_file(file_path), os.path.basename(file_path))
+
+    if is_delimited_file(file_path):
+        # Read as text whatever the engine; imported here as it imports this module
+        from delimited import process_delimited_file
+        summary = process_delimited_file(file_path, spec, notify, options, progress)
+    elif options['engine'] == 'pandas' and not options['delta_store']:
+        # The columnar engine is only loaded when asked for, as pandas is optional. It
+        # checks whole columns at once, so the delta store (which skips rows) is not used with it.
+        from columnar import process_workbook_columnar
+        summary = process_workbook_columnar(file_path, spec, notify, options, progress, parsed)
+    elif (parsed is not None and parsed.hit) or use_streaming(file_path, options['streaming_min_file_size']):
+        # A cached sheet has no styles to keep, so it is written as in streaming mode
+        summary = process_workbook_streaming(file_path, spec, notify, options, progress, parsed)
+    else:
+        summary = process_workbook(file_path, spec, notify, options, progress, parsed)
+    summary['file_type'] = file_type
+    if parsed is not None:
+        summary['parse_cache'] = 'hit' if parsed.hit else 'miss'
+    record_stage_rows(summary)
+    return summary
+
+# Function to turn a file type spec into column indices for the row pass
+def compile_rules(spec):
+    def indices(columns):
+        return [column_index_from_string(col) - 1 for col in columns]
+
+    rules = {
+        'required': indices(spec['required_columns']),
+        'dates': indices(spec['date_columns']),
+        'genders': indices(spec['gender_columns']),
+        'bvn': column_index_from_string(spec['bvn_column']) - 1 if spec.get('bvn_column') else None,
+        'dedup': indices(spec['dedup_columns']) if spec.get('dedup_columns') else None,
+        'customer': column_index_from_string(spec['customer_column']) - 1 if spec.get('customer_column') else None,
+    }
+    # One column given two of the value rules would fail one of them on every row
+    roles = [(col, 'date') for col in spec['date_columns']] + [(col, 'gender') for col in spec['gender_columns']]
+    if spec.get('bvn_column'):
+        roles.append((spec['bvn_column'], 'BVN'))
+    seen = {}
+    for col, role in roles:
+        if col in seen:
+            raise ValueError(f"Column {col} is set as both a {seen[col]} and a {role} column.")
+        seen[col] = role
+    if spec.get('delta_columns'):
+        rules['delta'] = indices(spec['delta_columns'])
+    else:
+        rules['delta'] = [rules['customer']] if rules['customer'] is not None else []
+    # Rows are padded to this width so every rule column can be read
+    rules['width'] = max(rules['required'] + rules['dates'] + rules['genders'] + (rules['dedup'] or [])
+                         + rules['delta'] + [rules['bvn'] or 0, rules['customer'] or 0]) + 1
+    return rules
+
+# Function to create an empty set of cleaning counters
+def new_change_counts():
+    return {
+        'exponential': 0,
+        'pipe': 0,
+        'carriage_return': 0,
+        'line_break': 0
+    }
+
+# Function to clean cell values. Pass `changes` to add to running totals.
+def clean_cell_value(value, changes=None):
+    if changes is None:
+        changes = new_change_counts()
+
+    if isinstance(value, str):
+        if 'E+' in value:
+            value = value.replace('E+', '')
+            changes['exponential'] += 1
+        if '|' in value:
+            value = value.replace('|', '')
+            changes['pipe'] += 1
+        if '\r' in value:
+            value = value.replace('\r', '')
+            changes['carriage_return'] += 1
+        if '\n' in value:
+            value = value.replace('\n', '')
+            changes['line_break'] += 1
+
+    return value, changes
+
+# Function to clean every value of a row in place
+def clean_row(row, changes):
+    for col_idx, value in enumerate(row):
+        if value and isinstance(value, str):
+            row[col_idx] = clean_cell_value(value, changes)[0]
+
+# Function to check for blank required columns
+def has_blank_required(row, rules):
+    for col_idx in rules['required']:
+        if row[col_idx] in [None, '']:
+            return True
+    return False
+
+# Function to check for rows where BVN No does not start with '2'
+def has_invalid_bvn(row, rules):
+    if rules['bvn'] is not None:
+        bvn_cell_value = row[rules['bvn']]
+        if isinstance(bvn_cell_value, str) and not bvn_cell_value.startswith('2'):
+            return True
+    return False
+
+# Function to format the date columns of a row in place. Text that cannot be parsed
+# is returned unchanged by format_date_value; such rows get 'unparsed_date', others 'keep'.
+# Lookups are counted in `dates` (from new_date_counts), if given.
+def format_row_dates(row, rules, dates=None):
+    status = 'keep'
+    for col_idx in rules['dates']:
+        value = row[col_idx]
+        row[col_idx] = format_date_value(value, dates)
+        if row[col_idx] is value and isinstance(value, str) and value.strip():
+            status = 'unparsed_date'
+    return status
+
+# Function to replace the gender values of a row in place
+def map_row_genders(row, rules):
+    for col_idx in rules['genders']:
+        value = row[col_idx]
+        if value in GENDER_CODES:
+            row[col_idx] = GENDER_CODES[value]
+
+# Function to apply every row-local rule to one data row in place.
+# Returns 'blank' or 'invalid_bvn' when the row must be moved out, otherwise 'keep',
+# or 'unparsed_date' for a kept row with date text that could not be parsed.
+def apply_row_rules(row, rules, changes, dates=None):
+    clean_row(row, changes)
+    if has_blank_required(row, rules):
+        return 'blank'
+    if has_invalid_bvn(row, rules):
+        return 'invalid_bvn'
+    status = format_row_dates(row, rules, dates)
+    map_row_genders(row, rules)
+    return status
+
+# Function to apply the row rules to a copy of a data row, leaving the row as it was.
+# Returns the status, the cells the rules changed as (column, value) pairs and the
+# cleaning counts of the row, to be applied to the row later with apply_rule_result.
+def row_rule_result(row, rules, dates=None):
+    cleaned = list(row)
+    changes = new_change_counts()
+    status = apply_row_rules(cleaned, rules, changes, dates)
+    patch = [(col_idx, value) for col_idx, (value, raw) in enumerate(zip(cleaned, row)) if value is not raw]
+    return status, patch, changes
+
+# Function to apply the changed cells from row_rule_result to a row in place and add
+# its cleaning counts (a dict, or None for none) to `changes`
+def apply_rule_result(row, patch, row_changes, changes):
+    for col_idx, value in patch:
+        row[col_idx] = value
+    if row_changes:
+        for key, count in row_changes.items():
+            changes[key] += count
+
+# Function to apply the row rules as apply_row_rules does, timing each one into `profile`
+def profiled_row_rules(row, rules, changes, profile, dates=None):
+    profile_step(profile, 'clean', clean_row, row, changes)
+    if profile_step(profile, 'blank_check', has_blank_required, row, rules):
+        return 'blank'
+    if profile_step(profile, 'bvn_check', has_invalid_bvn, row, rules):
+        return 'invalid_bvn'
+    status = profile_step(profile, 'date_format', format_row_dates, row, rules, dates)
+    profile_step(profile, 'gender_map', map_row_genders, row, rules)
+    return status
+
+# Single pass over the rows of a sheet (header first). Yields a (status, row) pair
+# for every input row, where status is 'header', 'duplicate', 'blank', 'invalid_bvn',
+# 'keep' or 'unparsed_date' (kept). Duplicates are compared on the raw values, before cleaning.
+# With a `profile` (from new_row_profile), one row in STAGE_SAMPLE_ROWS has each rule timed.
+# Date lookups are counted in `dates` (the summary's date counters).
+def fused_pass(rows, rules, changes, deduplicator, profile=None, dates=None):
+    for row_num, row in enumerate(rows, start=1):
+        if row_num == 1:
+            clean_row(row, changes)
+            yield 'header', row
+            continue
+
+        if profile is not None and row_num % STAGE_SAMPLE_ROWS == 0:
+            if profile_step(profile, 'dedup', deduplicator.seen, row):
+                yield 'duplicate', row
+            else:
+                yield profiled_row_rules(row, rules, changes, profile, dates), row
+            continue
+
+        if deduplicator.seen(row):
+            yield 'duplicate', row
+            continue
+
+        yield apply_row_rules(row, rules, changes, dates), row
+
+# Row pass against the delta store (see delta_store.py): yields the same (status, row)
+# pairs as fused_pass, but the rules only run on the data rows that are new or changed
+# since the last submission of the file; the others take the results stored for them.
+# Rows are looked up a batch at a time, so they come out a batch behind the input.
+def delta_pass(rows, rules, changes, deduplicator, delta, dates=None):
+    batch = []
+    for row_num, row in enumerate(rows, start=1):
+        if row_num == 1:
+            clean_row(row, changes)
+            delta.set_header(row)
+            yield 'header', row
+            continue
+
+        batch.append(row)
+        if len(batch) >= delta.batch_rows:
+            yield from delta_batch(batch, rules, changes, deduplicator, delta, dates)
+            batch = []
+    yield from delta_batch(batch, rules, changes, deduplicator, delta, dates)
+
+# Function to pass over one batch of data rows for delta_pass. Duplicates are found
+# first, in order, and the rest are looked up in the store together.
+def delta_batch(rows, rules, changes, deduplicator, delta, dates=None):
+    entries = []
+    for row in rows:
+        digest = key_digest(row, rules['dedup'])
+        if deduplicator.seen_digest(digest):
+            entries.append((row, None, None))
+        else:
+            # Without dedup columns the duplicate digest is already the digest of the whole row
+            fingerprint = digest if rules['dedup'] is None else row_digest(row)
+            entries.append((row, fingerprint, delta.row_key(row)))
+
+    results, known_keys = delta.lookup([fingerprint for _, fingerprint, _ in entries if fingerprint is not None],
+                                       [key for _, _, key in entries])
+    for row, fingerprint, key in entries:
+        if fingerprint is None:
+            yield 'duplicate', row
+            continue
+
+        if fingerprint in results:
+            change = 'unchanged'
+        else:
+            change = 'changed' if key in known_keys else 'added'
+        result = results.get(fingerprint)
+        if result is None:
+            result = row_rule_result(row, rules, dates)
+        status, patch, row_changes = result
+        apply_rule_result(row, patch, row_changes, changes)
+        delta.record(fingerprint, key, change, status, patch, row_changes, row)
+        yield status, row
+
+# Function to pad rows read from a sheet to a fixed width. With `widths` (a deque), the
+# width of each row as read is appended to it, so the row can be written back at that
+# width once the rules have read it (the passes yield the rows in the same order).
+def padded_rows(rows, width, widths=None):
+    for row in rows:
+        row = list(row)
+        if widths is not None:
+            widths.append(len(row))
+        if len(row) < width:
+            row.extend([None] * (width - len(row)))
+        yield row
+
+# Function to build the paths of the outputs of a processed file (inside its workspace, if any)
+def output_paths(file_path, options=None):
+    options = processing_options(options)
+    root = options['workspace'] or ''
+    base_name = os.path.splitext(os.path.basename(file_path))[0]
+    paths = {
+        'text': text_output_path(os.path.join(root, PROCESSED_FOLDER, base_name + '.txt'), options['text_compression']),
+        'exceptions': os.path.join(root, DATA_QUALITY_FOLDER, f"{base_name}_Exceptions.xlsx"),
+    }
+    if options['exception_export']:
+        paths['exceptions_export'] = exception_export_path(paths['exceptions'], options['exception_export'])
+    if options['delta_store']:
+        paths['delta'] = os.path.join(root, DATA_QUALITY_FOLDER, f"{base_name}_Delta.csv")
+    return paths
+
+# Function to find the institution that sent a file: the part of the file name
+# before its type, e.g. 'Bank' for Bank-Credit-Information.xlsx
+def institution_name(file_path):
+    basename = os.path.basename(file_path)
+    file_type = get_file_type(basename)
+    return basename.split(file_type)[0].strip(' -_') or 'unknown'
+
+# Function to open the customer index for a file, or None when the options or
+# the file spec leave it out. Flagged rows are added to `exceptions`.
+def open_customer_index(file_path, spec, rules, options, exceptions):
+    if not options['customer_index'] or not spec.get('customer_index'):
+        return None
+    return CustomerIndexBatch(options['customer_index'], spec['customer_index'], get_file_type(file_path),
+                              institution_name(file_path), os.path.basename(file_path), rules, exceptions)
+
+# Function to open the delta store for a file, or None when the options leave it out
+def open_delta(file_path, rules, options):
+    if not options['delta_store']:
+        return None
+    # Imported here as it imports this module
+    from result_cache import ruleset_version
+    return DeltaStore(options['delta_store'], institution_name(file_path), get_file_type(file_path),
+                      os.path.basename(file_path), ruleset_version(), rules['delta'],
+                      output_paths(file_path, options)['delta'])
+
+# Function to close the delta store of a file, adding its counts and report to the summary
+def close_delta(delta, summary, notify):
+    summary['delta'] = delta.close(notify)
+    if delta.report_output():
+        summary['outputs']['delta'] = delta.report_output()
+
+# Function to open the rows of the active sheet of a workbook, or of its cached copy
+# when `parsed` (a parse_cache.ParsedUpload) has one. Rows read from the workbook are
+# saved to the parse cache as they pass. With `chunks` (a chunked.SheetChunks) the
+# sheet is parsed across its worker processes. Returns the sheet title, its
+# dimensions, the rows and the workbook to close (None for a cached sheet).
+def open_sheet_rows(file_path, parsed=None, chunks=None):
+    if parsed is not None and parsed.hit:
+        return parsed.title, parsed.max_row, parsed.max_column, parsed.rows(), None
+    workbook = load_workbook(file_path, read_only=True)
+    sheet = workbook.active
+    rows = sheet.iter_rows(values_only=True) if chunks is None else chunks.rows(sheet)
+    if parsed is not None:
+        rows = parsed.record(sheet.title, sheet.max_row, sheet.max_column, rows)
+    return sheet.title, sheet.max_row, sheet.max_column, rows, workbook
+
+# Function to create the duplicate tracker for a file
+def new_deduplicator(rules, options):
+    return RowDeduplicator(rules['dedup'], options['dedup_memory_budget'], options['dedup_spill_folder'])
+
+# Function to start the summary returned by the processing functions
+def new_summary(file_path):
+    return {
+        'file_path': file_path,
+        'rows': 0,
+        'rows_written': 0,
+        'duplicates': 0,
+        'blank_rows': 0,
+        'invalid_bvn': 0,
+        'unparsed_dates': 0,
+        'changes': new_change_counts(),
+        # Date cache hits and misses and how the misses were parsed, for this file
+        'dates': new_date_counts(),
+        'outputs': {},
+        'timings': {},
+        'stages': {},
+    }
+
+# Function to count a row status in the summary
+def count_status(summary, status):
+    if status == 'header':
+        return
+    summary['rows'] += 1
+    if status == 'keep':
+        summary['rows_written'] += 1
+    elif status == 'unparsed_date':
+        summary['rows_written'] += 1
+        summary['unparsed_dates'] += 1
+    elif status == 'duplicate':
+        summary['duplicates'] += 1
+    elif status == 'blank':
+        summary['blank_rows'] += 1
+    elif status == 'invalid_bvn':
+        summary['invalid_bvn'] += 1
+
+# Function to report duplicate and cleaning results
+def report_cleaning(summary, notify):
+    if summary['duplicates']:
+        notify(f'Duplicates were removed.','success')
+    else:
+        notify(f'No duplicates found.','success')
+    print_summary(summary['changes'], notify)
+
+# Function to print cleaning summary
+def print_summary(changes, notify):
+    if any(changes.values()):
+        notify("Cleaning Summary:",'success')
+        if changes['exponential'] > 0:
+            notify(f"Removed {changes['exponential']} exponentials (E+).",'success')
+        if changes['pipe'] > 0:
+            notify(f"Removed {changes['pipe']} pipe symbols (|).",'success')
+        if changes['carriage_return'] > 0:
+            notify(f"Removed {changes['carriage_return']} carriage returns (\\r).",'success')
+        if changes['line_break'] > 0:
+            notify(f"Removed {changes['line_break']} line breaks (\\n).",'success')
+    else:
+        notify(f"No cleaning needed.",'success')
+
+# Function to read the rows of an edit-mode sheet from A1, as the read-only engines do.
+# The bounds are passed explicitly since an edit-mode sheet can start at its first cell
+# in use; a sheet with no cells has no rows (with bounds it would give one empty cell).
+def sheet_rows(sheet, values_only=False):
+    if next(sheet.iter_rows(), None) is None:
+        return iter(())
+    return sheet.iter_rows(min_row=1, min_col=1, values_only=values_only)
+
+# Function to delete rows from the original sheet. Calling sheet.delete_rows once per
+# row shifts every cell below it each time (quadratic for large files), so the rows are
+# dropped and the remaining cells moved up in a single pass over the sheet's cells.
+def delete_rows_from_original(sheet, row_indices):
+    rows_to_delete = sorted(set(row_indices))
+    if not rows_to_delete:
+        return
+
+    first_row = rows_to_delete[0]
+    deleted = set(rows_to_delete)
+    cells = {}
+    for (row, col), cell in sheet._cells.items():
+        if row >= first_row:
+            if row in deleted:
+                continue
+            # Number of deleted rows above this one
+            row -= bisect_left(rows_to_delete, row)
+            cell.row = row
+        cells[(row, col)] = cell
+    sheet._cells = cells
+
+
+# In-memory processing: the workbook is loaded in edit mode (keeping styles and other
+# sheets), every rule is applied in one pass over the rows and the file is saved in place.
+# With `parsed` (a parse cache miss) the values read are also saved to the parse cache.
+def process_workbook(file_path, spec, notify, options=None, progress=None, parsed=None):
+    notify(f"Processing file: {file_path}",'success')
+
+    options = processing_options(options)
+    progress = progress or ProgressReporter()
+    rules = compile_rules(spec)
+    summary = new_summary(file_path)
+    paths = output_paths(file_path, options)
+    start = stage_clock()
+
+    progress.stage('load')
+    workbook = load_workbook(file_path)
+    sheet = workbook.active
+    start = record_timing(summary, 'load', start)
+    progress.stage('rules', max(sheet.max_row - 1, 0))
+
+    # The cells are read at the width of the sheet and only the values the rules read
+    # are padded, so no empty cells are added to the saved workbook
+    cell_rows = list(sheet_rows(sheet))
+    values = ([cell.value for cell in cells] for cells in cell_rows)
+    if parsed is not None:
+        values = parsed.record(sheet.title, sheet.max_row, sheet.max_column, values)
+    values = padded_rows(values, rules['width'])
+
+    exceptions = None
+    customer_index = None
+    rows_to_delete = []
+    profile = new_row_profile()
+    deduplicator = new_deduplicator(rules, options)
+    delta = open_delta(file_path, rules, options)
+    if delta is not None:
+        row_pass = delta_pass(values, rules, summary['changes'], deduplicator, delta, summary['dates'])
+    else:
+        row_pass = fused_pass(values, rules, summary['changes'], deduplicator, profile, summary['dates'])
+    try:
+        # The row pass comes first so it reads the values to the end
+        for (status, row), cells in zip(row_pass, cell_rows):
+            count_status(summary, status)
+            progress.rows(summary['rows'])
+            if status == 'header':
+                exceptions = ExceptionWorkbook(paths['exceptions'], row[:len(cells)], options['exception_export'])
+                customer_index = open_customer_index(file_path, spec, rules, options, exceptions)
+            elif status != 'keep':
+                exceptions.add(status, row)
+            if customer_index is not None and status in ('keep', 'unparsed_date'):
+                customer_index.add(row)
+            if status in ('header', 'keep', 'unparsed_date'):
+                for cell, value in zip(cells, row):
+                    if cell.value is not value:
+                        cell.value = value
+            else:
+                rows_to_delete.append(cells[0].row)
+    finally:
+        summary['dedup'] = deduplicator.stats()
+        deduplicator.close()
+    record_row_profile(summary, profile)
+    start = record_timing(summary, 'rules', start)
+
+    report_cleaning(summary, notify)
+
+    progress.stage('exceptions')
+    if customer_index is not None:
+        summary['customer_index'] = customer_index.close(notify)
+    if delta is not None:
+        close_delta(delta, summary, notify)
+    if exceptions is not None:
+        summary['outputs'].update(exceptions.save(notify))
+    start = record_timing(summary, 'exceptions', start)
+
+    progress.stage('remove_rows')
+    delete_rows_from_original(sheet, rows_to_delete)
+    start = record_timing(summary, 'remove_rows', start)
+
+    # Save the modified workbook
+    progress.stage('save')
+    workbook.save(file_path)
+    summary['outputs']['xlsx'] = file_path
+    start = record_timing(summary, 'save', start)
+
+    # Convert to pipe-delimited text file from the cleaned sheet still in memory
+    if spec['export_text']:
+        progress.stage('text_export')
+        write_pipe_delimited_rows(paths['text'], sheet_rows(sheet, values_only=True), options['text_compression'])
+        notify(f"Conversion completed. The text file is saved as: {paths['text']}",'success')
+        summary['outputs']['text'] = paths['text']
+        record_timing(summary, 'text_export', start)
+
+    return summary
+
+
+# Function to open a write-only workbook with a header row for data quality output
+def new_write_only_workbook(title, headers):
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet(title)
+    sheet.append(headers)
+    return workbook, sheet
+
+# Streaming processing: rows are read one at a time from a read-only workbook (or the
+# parse cache, see open_sheet_rows), go through the same row pass as process_workbook
+# and are appended to write-only outputs
+def process_workbook_streaming(file_path, spec, notify, options=None, progress=None, parsed=None):
+    notify(f"Processing file: {file_path}",'success')
+
+    options = processing_options(options)
+    progress = progress or ProgressReporter()
+    rules = compile_rules(spec)
+    summary = new_summary(file_path)
+    paths = output_paths(file_path, options)
+    temp_path = file_path + '.tmp'
+
+    exceptions = None
+    customer_index = None
+    output = None
+    text_writer = PipeDelimitedWriter(paths['text'], options['text_compression']) if spec['export_text'] else None
+    profile = new_row_profile()
+    start = stage_clock()
+
+    # A cached sheet is quick to read, so only workbooks are parsed across processes. Rows
+    # checked against the delta store go through the rules here, so it is not used then.
+    chunks = None
+    delta = open_delta(file_path, rules, options)
+    if options['row_workers'] and options['row_workers'] > 1 and not (parsed is not None and parsed.hit) \
+            and delta is None:
+        from chunked import SheetChunks
+        chunks = SheetChunks(file_path, rules, options['row_workers'])
+
+    title, max_row, max_column, source_rows, source = open_sheet_rows(file_path, parsed, chunks)
+    deduplicator = new_deduplicator(rules, options)
+    try:
+        # The row count comes from the sheet dimensions, which some writers leave out
+        progress.stage('rules', max_row - 1 if max_row else None)
+        # Rows are written back at the width they were read
+        widths = deque()
+        rows = padded_rows(source_rows, rules['width'], widths)
+        if chunks is not None:
+            row_pass = chunks.rule_pass(rows, summary['changes'], deduplicator, summary['dates'])
+        elif delta is not None:
+            row_pass = delta_pass(rows, rules, summary['changes'], deduplicator, delta, summary['dates'])
+        else:
+            row_pass = fused_pass(rows, rules, summary['changes'], deduplicator, profile, summary['dates'])
+
+        for status, row in row_pass:
+            width = widths.popleft()
+            count_status(summary, status)
+            progress.rows(summary['rows'])
+            if status == 'header':
+                exceptions = ExceptionWorkbook(paths['exceptions'], row[:width], options['exception_export'])
+                customer_index = open_customer_index(file_path, spec, rules, options, exceptions)
+                output = openpyxl.Workbook(write_only=True)
+                output_sheet = output.create_sheet(title)
+            elif status != 'keep':
+                exceptions.add(status, row)
+                if status != 'unparsed_date':
+                    continue
+
+            if customer_index is not None and status != 'header':
+                customer_index.add(row)
+            if len(row) > width:
+                row = row[:width]
+            output_sheet.append(row)
+            if text_writer:
+                text_writer.write_row(row)
+    finally:
+        if chunks is not None:
+            chunks.close()
+            summary['row_chunks'] = chunks.chunks
+        if source is not None:
+            source.close()
+        summary['dedup'] = deduplicator.stats()
+        deduplicator.close()
+        if text_writer:
+            text_writer.close()
+    record_row_profile(summary, profile)
+    start = record_timing(summary, 'rules', start)
+
+    report_cleaning(summary, notify)
+
+    progress.stage('exceptions')
+    if customer_index is not None:
+        summary['customer_index'] = customer_index.close(notify)
+    if delta is not None:
+        close_delta(delta, summary, notify)
+    if exceptions is not None:
+        summary['outputs'].update(exceptions.save(notify))
+    start = record_timing(summary, 'exceptions', start)
+
+    # Replace the upload with the cleaned workbook once it is fully written
+    progress.stage('save')
+    if output is not None:
+        output.save(temp_path)
+        os.replace(temp_path, file_path)
+        summary['outputs']['xlsx'] = file_path
+    record_timing(summary, 'save', start)
+
+    if text_writer:
+        notify(f"Conversion completed. The text file is saved as: {paths['text']}",'success')
+        summary['outputs']['text'] = paths['text']
+
+    return summary
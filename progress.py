@@ -0,0 +1,61 @@
+import time
+
+# Least time between two progress reports, in seconds
+PROGRESS_INTERVAL = 0.5
+
+# Rows between two looks at the clock, so the row loops stay cheap
+PROGRESS_ROWS = 1000
+
+
+# Tracks how far a file has got through the pipeline and passes it to `callback`
+# as a dict (stage, rows done and total, rows per second, ETA in seconds). Row
+# updates are throttled: the clock is only read every `every` rows and a report
+# sent at most once per `interval` seconds. Without a callback it does nothing.
+class ProgressReporter:
+    def __init__(self, callback=None, interval=PROGRESS_INTERVAL, every=PROGRESS_ROWS):
+        self.callback = callback
+        self.interval = interval
+        self.every = every
+        self.stage_name = None
+        self.rows_total = None
+        self.rows_done = 0
+        self.next_check = every
+        self.stage_started = self.last_report = time.perf_counter()
+
+    # Function to start a stage, reporting it straight away.
+    # `rows_total` is the number of rows the stage will go through, if known.
+    def stage(self, name, rows_total=None):
+        if self.callback is None:
+            return
+        self.stage_name = name
+        self.rows_total = rows_total
+        self.rows_done = 0
+        self.next_check = self.every
+        self.stage_started = time.perf_counter()
+        self.report()
+
+    # Function to update the rows done in the current stage
+    def rows(self, rows_done):
+        if rows_done < self.next_check or self.callback is None:
+            return
+        self.next_check = rows_done + self.every
+        self.rows_done = rows_done
+        if time.perf_counter() - self.last_report >= self.interval:
+            self.report()
+
+    # Function to send the current progress to the callback
+    def report(self):
+        now = time.perf_counter()
+        elapsed = now - self.stage_started
+        rows_per_second = self.rows_done / elapsed if elapsed > 0 and self.rows_done else None
+        eta = None
+        if rows_per_second and self.rows_total:
+            eta = max(0, self.rows_total - self.rows_done) / rows_per_second
+        self.last_report = now
+        self.callback({
+            'stage': self.stage_name,
+            'rows_done': self.rows_done,
+            'rows_total': self.rows_total,
+            'rows_per_second': rows_per_second,
+            'eta': eta,
+        })
@@ -0,0 +1,172 @@
+import hashlib, json, os, shutil, tempfile, time
+
+from processing import FILE_SPECS, output_paths, process_file_type
+from metrics import stage_clock, add_stage, record_timing
+from progress import ProgressReporter
+
+# Folder holding the outputs of processed files, one sub-folder per cache entry
+RESULT_CACHE_FOLDER = 'result_cache'
+
+# Total size of the cached outputs; the least recently used entries are removed beyond it
+RESULT_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+
+# Bump when a code change alters the outputs of a file without changing FILE_SPECS
+RULES_VERSION = 4
+
+# Size of the chunks read while hashing a file
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Name of the entry description inside an entry folder
+ENTRY_FILE = 'entry.json'
+
+
+# Function to hash a file already on disk
+def hash_file(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as source:
+        for chunk in iter(lambda: source.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# Function to identify the current rules: any change to a spec or to RULES_VERSION
+# gives a new version, so outputs cached under the old rules are no longer used
+def ruleset_version():
+    rules = json.dumps({'version': RULES_VERSION, 'specs': FILE_SPECS}, sort_keys=True)
+    return hashlib.sha256(rules.encode('utf-8')).hexdigest()[:16]
+
+# Function to build the cache key of a file. The type is part of the key as it
+# comes from the file name, not the contents, and so are the output formats.
+def cache_key(content_hash, file_type, options):
+    key = f"{content_hash}-{file_type}-{ruleset_version()}"
+    for option in ('text_compression', 'exception_export'):
+        if options[option]:
+            key += '-' + options[option]
+    return key
+
+# Function to get the folder of a cache entry
+def entry_folder(key, cache_folder=RESULT_CACHE_FOLDER):
+    return os.path.join(cache_folder, key)
+
+# Function to read a cache entry, marking it as recently used. Returns None on a miss.
+def lookup(key, cache_folder=RESULT_CACHE_FOLDER):
+    folder = entry_folder(key, cache_folder)
+    try:
+        with open(os.path.join(folder, ENTRY_FILE)) as entry_file:
+            entry = json.load(entry_file)
+        os.utime(folder)
+    except (OSError, ValueError):
+        return None
+    return entry
+
+# Function to store the outputs of a processed file under its key. The entry is
+# written to a temporary folder and renamed into place, so a half-written entry
+# is never read and two jobs storing the same file do not clash.
+def store(key, file_path, summary, messages, cache_folder=RESULT_CACHE_FOLDER, max_bytes=RESULT_CACHE_MAX_BYTES):
+    os.makedirs(cache_folder, exist_ok=True)
+    folder = entry_folder(key, cache_folder)
+    if os.path.isdir(folder):
+        return
+
+    temp_folder = tempfile.mkdtemp(prefix='.tmp-', dir=cache_folder)
+    try:
+        outputs = {}
+        size = 0
+        for role, path in summary['outputs'].items():
+            name = role + os.path.splitext(path)[1]
+            shutil.copyfile(path, os.path.join(temp_folder, name))
+            outputs[role] = name
+            size += os.path.getsize(path)
+
+        entry = {
+            'file_path': file_path,
+            'paths': dict(summary['outputs']),
+            'outputs': outputs,
+            'messages': messages,
+            'summary': summary,
+            'size': size,
+            'created_at': time.time(),
+        }
+        with open(os.path.join(temp_folder, ENTRY_FILE), 'w') as entry_file:
+            json.dump(entry, entry_file)
+        os.rename(temp_folder, folder)
+    except OSError:
+        shutil.rmtree(temp_folder, ignore_errors=True)
+        return
+
+    evict(cache_folder, max_bytes)
+
+# Function to remove the least recently used entries until the cache fits in `max_bytes`
+def evict(cache_folder=RESULT_CACHE_FOLDER, max_bytes=RESULT_CACHE_MAX_BYTES):
+    entries = []
+    for key in os.listdir(cache_folder):
+        folder = entry_folder(key, cache_folder)
+        try:
+            with open(os.path.join(folder, ENTRY_FILE)) as entry_file:
+                size = json.load(entry_file)['size']
+            entries.append((os.path.getmtime(folder), size, folder))
+        except (OSError, ValueError, KeyError):
+            continue
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, folder in sorted(entries):
+        if total <= max_bytes:
+            break
+        shutil.rmtree(folder, ignore_errors=True)
+        total -= size
+
+# Function to copy the outputs of a cache entry to where processing `file_path`
+# would have written them. Returns the messages and summary with the paths updated.
+def restore(entry, key, file_path, options, cache_folder=RESULT_CACHE_FOLDER):
+    folder = entry_folder(key, cache_folder)
+    # The cleaned upload replaces the file, whether a workbook or delimited text
+    paths = dict(output_paths(file_path, options), xlsx=file_path, csv=file_path)
+    renamed = {entry['file_path']: file_path}
+    outputs = {}
+    for role, name in entry['outputs'].items():
+        shutil.copyfile(os.path.join(folder, name), paths[role])
+        renamed[entry['paths'][role]] = paths[role]
+        outputs[role] = paths[role]
+
+    # Longer paths first, so no path is rewritten through a shorter one it contains
+    def rename(message):
+        for old_path in sorted(renamed, key=len, reverse=True):
+            message = message.replace(old_path, renamed[old_path])
+        return message
+
+    messages = [(category, rename(message)) for category, message in entry['messages']]
+    summary = dict(entry['summary'], file_path=file_path, outputs=outputs)
+    return messages, summary
+
+# Function to process a file, or reuse the outputs of an identical file processed
+# under the same rules. Messages are replayed so the caller sees the same report.
+def process_with_cache(file_path, file_type, notify, options, content_hash=None, progress=None):
+    start = stage_clock()
+    content_hash = content_hash or hash_file(file_path)
+    key = cache_key(content_hash, file_type, options)
+    hashed = stage_clock()
+
+    entry = lookup(key)
+    if entry is not None:
+        ProgressReporter(progress).stage('cache')
+        messages, summary = restore(entry, key, file_path, options)
+        for category, message in messages:
+            notify(message, category)
+        notify("Identical file processed before: results were taken from the cache.", 'success')
+        summary['timings'] = {}
+        summary['stages'] = {}
+        record_timing(summary, 'cache', start)
+        summary['cached'] = True
+        return summary
+
+    messages = []
+
+    def record(message, category='message'):
+        messages.append((category, message))
+        notify(message, category)
+
+    summary = process_file_type(file_path, file_type, record, options, progress, content_hash)
+    summary['timings']['hash'] = hashed[0] - start[0]
+    add_stage(summary, 'hash', hashed[0] - start[0], hashed[1] - start[1])
+    summary['cached'] = False
+    store(key, file_path, summary, messages)
+    return summary
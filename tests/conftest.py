@@ -0,0 +1,17 @@
+import os, sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from processing import ensure_folders
+
+
+# Empty working folder with the folders processing writes to, as the app and
+# command line tools run from the project folder
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    ensure_folders()
+    return tmp_path
@@ -0,0 +1,114 @@
+import io, os, zipfile
+
+import pytest
+from openpyxl import Workbook, load_workbook
+
+from batch import batch_messages, batch_waves, extract_zip, process_batch
+from exception_report import EXCEPTION_SHEETS
+from processing import PROCESSED_FOLDER
+
+# Columns A to V, enough for the rules of every file type
+WIDTH = 22
+
+
+# Function to make a data row with a customer ID in A and a BVN in I
+def data_row(customer_id, bvn):
+    row = [f'v{col_idx}' for col_idx in range(WIDTH)]
+    row[0] = customer_id
+    row[8] = bvn
+    return row
+
+# Function to save an upload of `rows` in the folder for its type. Returns its path.
+def save_upload(folder, filename, rows):
+    workbook = Workbook()
+    workbook.active.append([f'H{col_idx}' for col_idx in range(WIDTH)])
+    for row in rows:
+        workbook.active.append(row)
+    file_path = os.path.join(folder, filename)
+    workbook.save(file_path)
+    return file_path
+
+# Function to zip workbooks saved in the working folder under the given member names
+def zipped(members):
+    archive_file = io.BytesIO()
+    with zipfile.ZipFile(archive_file, 'w') as archive:
+        for name, file_path in members.items():
+            archive.write(file_path, name)
+    archive_file.seek(0)
+    return archive_file
+
+# Function to count the rows flagged with `status` in the exceptions workbook of a file
+def flagged_rows(summary, status):
+    sheet_name = EXCEPTION_SHEETS[status]
+    workbook = load_workbook(summary['outputs']['exceptions'], read_only=True)
+    rows = len(list(workbook[sheet_name].iter_rows(values_only=True))) - 1 if sheet_name in workbook.sheetnames else 0
+    workbook.close()
+    return rows
+
+
+def test_borrowers_are_indexed_before_reference_files(workdir):
+    file_paths = [
+        save_upload('credit_information', 'Bank-Credit-Information.xlsx',
+                    [data_row(f'C{index}', f'2{index:010d}') for index in range(0, 40, 2)]),
+        save_upload('individual_borrower', 'Bank-Individual-Borrower.xlsx',
+                    [data_row(f'C{index}', f'2{index:010d}') for index in range(30)]),
+        save_upload('corporate_borrower', 'Other-Corporate-Borrower.xlsx',
+                    [data_row(f'D{index}', f'2{index:010d}') for index in range(25, 35)]),
+    ]
+    assert batch_waves(file_paths, {'customer_index': 'index.sqlite3'}) == [[1], [2], [0]]
+    assert batch_waves(file_paths) == [[0, 1, 2]]
+
+    for run in range(3):
+        batch = process_batch(file_paths, 3, {'customer_index': f'index-{run}.sqlite3'})
+        assert [result['error'] for result in batch['files']] == [None, None, None]
+        credit, borrower, other = (result['summary'] for result in batch['files'])
+        # C30 to C38 are in no borrower file of Bank
+        assert credit['customer_index']['unknown_borrowers'] == 5
+        assert flagged_rows(credit, 'unknown_borrower') == 5
+        # Other is indexed after Bank, so its BVNs 25 to 29 are already held there
+        assert borrower['customer_index']['shared_bvns'] == 0
+        assert other['customer_index']['shared_bvns'] == 5
+        assert flagged_rows(other, 'shared_bvn') == 5
+
+
+def test_zip_members_land_in_the_folders_for_their_types(workdir):
+    borrower = save_upload('.', 'borrower.xlsx', [data_row('C1', '22212345678')])
+    credit = save_upload('.', 'credit.xlsx', [data_row('C1', '22212345678')] * 2)
+    archive = zipped({
+        'march/Bank-Individual-Borrower.xlsx': borrower,
+        '../../Bank-Credit-Information.xlsx': credit,
+        'notes.xlsx': credit,
+        'Bank-Corporate-Borrower.xlsx': credit,
+    })
+
+    file_paths, skipped = extract_zip(archive, max_bytes=os.path.getsize(borrower))
+    assert file_paths == [os.path.join('individual_borrower', 'Bank-Individual-Borrower.xlsx')]
+    assert skipped == ['../../Bank-Credit-Information.xlsx', 'notes.xlsx', 'Bank-Corporate-Borrower.xlsx']
+
+    # Members only keep their base names, so none can leave the folder for its type
+    archive.seek(0)
+    file_paths, skipped = extract_zip(archive)
+    assert file_paths == [os.path.join('individual_borrower', 'Bank-Individual-Borrower.xlsx'),
+                          os.path.join('credit_information', 'Bank-Credit-Information.xlsx'),
+                          os.path.join('corporate_borrower', 'Bank-Corporate-Borrower.xlsx')]
+    assert skipped == ['notes.xlsx']
+    batch = process_batch(file_paths, 2)
+    assert [result['error'] for result in batch['files']] == [None, None, None]
+    assert batch['files'][1]['summary']['duplicates'] == 1
+    assert batch_messages(batch)[-1][1].startswith('Processed 3 of 3 files')
+
+
+def test_zip_upload_is_processed_as_a_batch(workdir, monkeypatch):
+    from app import app
+    monkeypatch.setitem(app.config, 'BACKGROUND_JOBS', False)
+    monkeypatch.setitem(app.config, 'BATCH_WORKERS', 2)
+    archive = zipped({
+        'Bank-Individual-Borrower.xlsx': save_upload('.', 'borrower.xlsx', [data_row('C1', '22212345678')]),
+        'Bank-Credit-Information.xlsx': save_upload('.', 'credit.xlsx', [data_row('C1', '12345678')]),
+    })
+
+    response = app.test_client().post('/upload', data={'file': (archive, 'month-end.zip')},
+                                      content_type='multipart/form-data')
+    assert response.status_code == 302
+    assert os.path.isfile(os.path.join(PROCESSED_FOLDER, 'Bank-Individual-Borrower.txt'))
+    assert os.path.isfile(os.path.join(PROCESSED_FOLDER, 'Bank-Credit-Information.txt'))
@@ -0,0 +1,71 @@
+import json, os
+
+import cli
+from processing import DEFAULT_OPTIONS, OPTION_SETTINGS, PROCESSED_FOLDER
+from test_batch import data_row, save_upload, zipped
+
+
+# Function to parse a command line for the process command and build its options
+def command_options(argv):
+    parser = cli.argparse.ArgumentParser()
+    cli.add_processing_arguments(parser)
+    return cli.processing_options(parser.parse_args(argv))
+
+
+def test_flags_set_every_option_the_app_sets():
+    options = command_options(['--engine', 'pandas', '--streaming-min-file-size', '0', '--cache',
+                               '--text-compression', 'gzip', '--exception-export', 'csv', '--profile',
+                               '--customer-index', 'index.sqlite3', '--parse-cache', '--row-workers', '4',
+                               '--delta-store', 'delta.sqlite3'])
+    assert all(options[option] != DEFAULT_OPTIONS[option] for option in OPTION_SETTINGS)
+
+
+def test_flags_left_out_take_the_defaults():
+    assert command_options([]) == DEFAULT_OPTIONS
+
+
+# Function to save a one-row upload in `folder`. Returns its path.
+def dropped_file(folder, filename, customer_id='C1'):
+    os.makedirs(folder, exist_ok=True)
+    return save_upload(folder, filename, [data_row(customer_id, '22212345678')])
+
+
+def test_ledger_skips_files_processed_before(workdir, capsys, monkeypatch):
+    dropped_file('drops', 'Bank-Individual-Borrower.xlsx')
+    archive = zipped({'Bank-Credit-Information.xlsx': dropped_file('.', 'credit.xlsx')})
+    with open(os.path.join('drops', 'month-end.zip'), 'wb') as zip_file:
+        zip_file.write(archive.read())
+    dropped_file('drops', '~$Bank-Individual-Borrower.xlsx')
+
+    assert cli.main(['process', 'drops', '--workers', '1']) == 0
+    with open(cli.LEDGER_FILE) as ledger_file:
+        names = sorted(entry['name'] for entry in json.load(ledger_file).values())
+    assert names == ['Bank-Individual-Borrower.xlsx', 'month-end.zip']
+    assert os.path.isfile(os.path.join(PROCESSED_FOLDER, 'Bank-Credit-Information.txt'))
+
+    # Unchanged files are known by name, size and modification time, without reading them
+    capsys.readouterr()
+    with monkeypatch.context() as patched:
+        patched.setattr(cli, 'hash_file', None)
+        assert cli.main(['process', 'drops', '--workers', '1']) == 0
+    assert 'Skipping 2 files processed before' in capsys.readouterr().err
+
+    assert cli.main(['process', 'drops', '--workers', '1', '--force']) == 0
+    assert 'Processed 2 of 2 files' in capsys.readouterr().out
+
+
+def test_watch_processes_new_files_and_leaves_failed_ones(workdir, capsys):
+    dropped_file('inbox', 'Bank-Individual-Borrower.xlsx')
+    with open(os.path.join('inbox', 'Bank-Credit-Information.xlsx'), 'w') as damaged:
+        damaged.write('not a workbook')
+
+    assert cli.main(['watch', 'inbox', '--once', '--workers', '1']) == 0
+    assert 'Processed 1 of 2 files' in capsys.readouterr().out
+    ledger = cli.Ledger()
+    assert [entry['name'] for entry in ledger.entries.values()] == ['Bank-Individual-Borrower.xlsx']
+
+    # A new file is processed on the next look; the failed one is tried again as it is not in the ledger
+    dropped_file('inbox', 'Bank-Corporate-Borrower.xlsx', 'D1')
+    assert cli.main(['watch', 'inbox', '--once', '--workers', '1']) == 0
+    assert 'Processed 1 of 2 files' in capsys.readouterr().out
+    assert len(cli.Ledger().entries) == 2
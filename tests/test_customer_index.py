@@ -0,0 +1,42 @@
+import pytest
+
+from processing import process_uploaded_file
+from test_batch import data_row, flagged_rows, save_upload
+from test_engines import ENGINES
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_reference_rows_are_checked_against_borrowers(workdir, engine):
+    options = dict(ENGINES[engine], customer_index='index.sqlite3')
+    # Customer IDs stored as numbers: 7 in the borrower file is the same customer as 7.0
+    borrowers = save_upload('individual_borrower', 'Bank-Individual-Borrower.xlsx',
+                            [data_row(index, f'2{index:010d}') for index in range(10)])
+    credit = save_upload('credit_information', 'Bank-Credit-Information.xlsx',
+                         [data_row(float(index), f'2{index:010d}') for index in range(5, 15)])
+    other = save_upload('credit_information', 'Other-Credit-Information.xlsx',
+                        [data_row(index, f'2{index:010d}') for index in range(3)])
+
+    assert process_uploaded_file(borrowers, options=options)['customer_index']['indexed'] == 10
+    summary = process_uploaded_file(credit, options=options)
+    assert summary['customer_index']['unknown_borrowers'] == 5
+    assert flagged_rows(summary, 'unknown_borrower') == 5
+    # Flagged rows stay in the cleaned file
+    assert summary['rows_written'] == 10
+    # Customer IDs are only known within the institution whose borrower file has them
+    assert process_uploaded_file(other, options=options)['customer_index']['unknown_borrowers'] == 3
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_bvns_held_at_other_institutions_are_flagged(workdir, engine):
+    options = dict(ENGINES[engine], customer_index='index.sqlite3')
+    bank = save_upload('individual_borrower', 'Bank-Individual-Borrower.xlsx',
+                       [data_row(f'C{index}', f'2{index:010d}') for index in range(10)])
+    other = save_upload('corporate_borrower', 'Other-Corporate-Borrower.xlsx',
+                        [data_row(f'C{index}', f'2{index:010d}') for index in range(8, 12)])
+    process_uploaded_file(bank, options=options)
+
+    summary = process_uploaded_file(other, options=options)
+    assert summary['customer_index'] == {'indexed': 4, 'unknown_borrowers': 0, 'shared_bvns': 2}
+    assert flagged_rows(summary, 'shared_bvn') == 2
+    # When Bank's file comes again its own BVNs are not flagged, only the two Other holds too
+    assert process_uploaded_file(bank, options=options)['customer_index']['shared_bvns'] == 2
@@ -0,0 +1,67 @@
+import datetime, threading
+
+import pytest
+from dateutil import parser
+
+from dates import DATE_FORMAT, clear_date_cache, format_date_value, new_date_counts, normalize_date_string
+
+# Values the fast path must read as dateutil does, or leave to it
+EDGE_CASES = ['2020-13-05', '2020-05-13', '2020-13-13', '13/13/2020', '31/02/2020', '29/02/2021',
+              '29-Feb-2020', '05-Foo-2020', '5/1/2020', '05-jan-2020', '43831', '43831.5', '00/00/0000']
+
+
+# Function to normalise a date string with dateutil only
+def dateutil_date(value):
+    try:
+        return parser.parse(value, dayfirst=True).strftime(DATE_FORMAT)
+    except (ValueError, TypeError, OverflowError):
+        return None
+
+
+# Function to list every day of 2019 and 2020 in the formats the fast path reads
+def known_format_values():
+    day = datetime.date(2019, 1, 1)
+    while day.year < 2021:
+        yield from (day.strftime('%d/%m/%Y'), day.strftime('%Y-%m-%d'), day.strftime('%d-%b-%Y'))
+        day += datetime.timedelta(days=1)
+
+
+def test_fast_path_matches_dateutil():
+    clear_date_cache()
+    counts = new_date_counts()
+    for value in known_format_values():
+        assert normalize_date_string(value, counts) == dateutil_date(value), value
+    assert counts['fallback'] == 0 and counts['fast_path'] == counts['misses'] == 3 * 731
+
+
+@pytest.mark.parametrize('value', EDGE_CASES)
+def test_edge_cases_match_dateutil(value):
+    assert normalize_date_string(value) == dateutil_date(value)
+
+
+def test_values_that_are_not_dates_are_kept():
+    clear_date_cache()
+    counts = new_date_counts()
+    assert format_date_value('unknown', counts) == 'unknown'
+    assert format_date_value('unknown', counts) == 'unknown'
+    assert format_date_value(datetime.datetime(2020, 1, 5, 12), counts) == '05-Jan-2020'
+    assert format_date_value(None, counts) is None
+    assert counts == {'hits': 1, 'misses': 1, 'fast_path': 0, 'fallback': 1, 'unparsed': 1}
+
+
+def test_files_processed_at_once_keep_their_own_counts():
+    clear_date_cache()
+    values = list(known_format_values())
+    counts = [new_date_counts() for _ in range(4)]
+
+    def format_all(file_counts):
+        for value in values:
+            format_date_value(value, file_counts)
+    threads = [threading.Thread(target=format_all, args=(file_counts,)) for file_counts in counts]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert all(file_counts['hits'] + file_counts['misses'] == len(values) for file_counts in counts)
+    assert sum(file_counts['misses'] for file_counts in counts) >= len(values)
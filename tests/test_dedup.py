@@ -0,0 +1,32 @@
+import os
+
+from dedup import DIGEST_ENTRY_SIZE, RowDeduplicator, row_digest
+
+
+def test_spilled_digests_are_still_found(tmp_path):
+    rows = [[f'C{index % 7}', index % 3] for index in range(50)]
+    deduplicator = RowDeduplicator(memory_budget=4 * DIGEST_ENTRY_SIZE, spill_folder=str(tmp_path))
+    seen = set()
+    for row in rows:
+        assert deduplicator.seen(row) == (tuple(row) in seen)
+        seen.add(tuple(row))
+
+    assert deduplicator.stats()['spills'] > 0
+    assert os.listdir(tmp_path)
+    deduplicator.close()
+    assert not os.listdir(tmp_path)
+
+
+def test_key_columns_spill_too(tmp_path):
+    deduplicator = RowDeduplicator([0], memory_budget=DIGEST_ENTRY_SIZE, spill_folder=str(tmp_path))
+    results = [deduplicator.seen(row) for row in (['C1', 'a'], ['C2', 'b'], ['C1', 'c'], ['C3', 'a'], ['C2', 'd'])]
+    deduplicator.close()
+    assert results == [False, False, True, False, True]
+
+
+def test_numbers_are_compared_by_value():
+    assert row_digest(['C1', 1]) == row_digest(['C1', 1.0]) == row_digest(['C1', True])
+    assert row_digest(['C1', 0]) == row_digest(['C1', False])
+    assert row_digest(['C1', 1]) != row_digest(['C1', '1'])
+    assert row_digest(['C1', 1]) != row_digest(['C1', 1.5])
+    assert row_digest(['C1', None]) != row_digest(['C1', float('nan')])
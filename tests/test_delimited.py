@@ -0,0 +1,90 @@
+import csv, datetime, io
+
+import openpyxl
+import pytest
+
+from benchmarks.compare_engines import SUMMARY_KEYS, read_output
+from benchmarks.synthetic_data import generate_rows
+from ingest import UploadRejected, validate_delimited
+from processing import DELIMITED_FORMATS, process_uploaded_file
+
+HEADER = ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H', 'I', 'J', 'K']
+
+
+# Function to write an Individual-Borrower upload and process it
+def process_text(text, extension, encoding='utf-8', options=None):
+    file_path = f'individual_borrower/Bank-Individual-Borrower.{extension}'
+    with open(file_path, 'w', encoding=encoding, newline='') as upload:
+        upload.write(text)
+    summary = process_uploaded_file(file_path, options=options)
+    with open(file_path, encoding='utf-8') as cleaned:
+        return summary, cleaned.read()
+
+# Function to generate rows as they would be saved to a delimited file: dates as text
+# and blanks as None. Workbooks keep line breaks as '\n' only, and pipe-delimited
+# files, which are not quoted, cannot hold line breaks or pipes.
+def text_rows(file_type, plain, rows=300):
+    for row in generate_rows(file_type, rows, seed=2, duplicates=0.1, blanks=0.05, bad_bvn=0.05):
+        row = [value.strftime('%d/%m/%Y') if isinstance(value, datetime.datetime) else value or None
+               for value in row]
+        row = [value.replace('\r\n', '\n') if value else value for value in row]
+        if plain:
+            row = [value.replace('\n', ' ').replace('|', '') if value else value for value in row]
+        yield row
+
+
+@pytest.mark.parametrize('extension', DELIMITED_FORMATS)
+def test_delimited_upload_matches_the_workbook(workdir, extension):
+    file_format = DELIMITED_FORMATS[extension]
+    rows = list(text_rows('Individual-Borrower', file_format.get('quoting') == csv.QUOTE_NONE))
+    workbook = openpyxl.Workbook()
+    for row in rows:
+        workbook.active.append(row)
+    workbook.save('individual_borrower/Bank-Individual-Borrower.xlsx')
+    from_workbook = process_uploaded_file('individual_borrower/Bank-Individual-Borrower.xlsx')
+
+    file_path = f'individual_borrower/Bank-Individual-Borrower{extension}'
+    with open(file_path, 'w', encoding='utf-8', newline='') as upload:
+        csv.writer(upload, lineterminator='\n', **file_format).writerows(rows)
+    from_text = process_uploaded_file(file_path)
+
+    assert from_text['duplicates'] and from_text['blank_rows'] and from_text['invalid_bvn']
+    assert {key: from_text[key] for key in SUMMARY_KEYS} == {key: from_workbook[key] for key in SUMMARY_KEYS}
+    for name in ('text', 'exceptions'):
+        assert read_output(from_text['outputs'][name]) == read_output(from_workbook['outputs'][name]), name
+
+
+def test_pipe_delimited_quotes_are_written_as_read(workdir):
+    text = '|'.join(HEADER) + '\nC1|O"Brien|"Ada"|z|e|01/02/2020|g|h|2222|j|M\n'
+    summary, cleaned = process_text(text, 'txt')
+    assert summary['rows_written'] == 1
+    assert cleaned.splitlines()[1] == 'C1|O"Brien|"Ada"|z|e|01-Feb-2020|g|h|2222|j|001'
+
+
+def test_csv_quoting_round_trips(workdir):
+    text = ','.join(HEADER) + '\nC1,"Smith, Jane","say ""hi""",z,e,01/02/2020,g,h,2222,j,F\n'
+    _, cleaned = process_text(text, 'csv')
+    assert cleaned.splitlines()[1] == 'C1,"Smith, Jane","say ""hi""",z,e,01-Feb-2020,g,h,2222,j,002'
+
+
+def test_validate_delimited_rejects_windows_code_page(tmp_path):
+    path = tmp_path / 'Bank-Individual-Borrower.csv'
+    path.write_bytes(','.join(HEADER).encode() + b'\nC1,Caf\xe9,y\n')
+    with pytest.raises(UploadRejected, match=r'not UTF-8 text \(line 2\)'):
+        validate_delimited(str(path))
+
+
+def test_validate_delimited_accepts_utf8_with_bom(tmp_path):
+    path = tmp_path / 'Bank-Individual-Borrower.csv'
+    path.write_bytes(b'\xef\xbb\xbf' + ','.join(HEADER).encode() + '\nC1,Café,y\n'.encode())
+    assert validate_delimited(str(path)) == 1
+
+
+def test_upload_in_windows_code_page_is_refused(workdir):
+    from app import app
+    client = app.test_client()
+    data = {'file': (io.BytesIO(','.join(HEADER).encode() + b'\nC1,Caf\xe9,y\n'), 'Bank-Individual-Borrower.csv')}
+    response = client.post('/upload', data=data, headers={'Accept': 'application/json'},
+                           content_type='multipart/form-data')
+    assert response.status_code == 400
+    assert 'not UTF-8 text' in response.get_json()['error']
@@ -0,0 +1,32 @@
+import gzip, os
+
+import pytest
+
+from processing import PROCESSED_FOLDER, process_uploaded_file
+from test_batch import data_row, save_upload
+
+
+@pytest.mark.parametrize('compression', [None, 'gzip'])
+def test_text_export_is_downloaded(workdir, compression):
+    from app import app
+    file_path = save_upload('credit_information', 'Bank-Credit-Information.xlsx', [data_row('C1', '22212345678')])
+    summary = process_uploaded_file(file_path, options={'text_compression': compression})
+    filename = os.path.basename(summary['outputs']['text'])
+    assert summary['outputs']['text'] == os.path.join(PROCESSED_FOLDER, filename)
+
+    response = app.test_client().get(f'/download/{filename}')
+    assert response.status_code == 200
+    assert response.headers['Content-Disposition'] == f'attachment; filename={filename}'
+    text = response.get_data()
+    if compression:
+        text = gzip.decompress(text)
+    assert text.decode('utf-8').splitlines()[1].startswith('C1|')
+
+
+def test_only_processed_files_are_downloaded(workdir):
+    from app import app
+    client = app.test_client()
+    open('secret.txt', 'w').close()
+    assert client.get('/download/secret.txt').status_code == 404
+    assert client.get('/download/..%2Fsecret.txt').status_code == 404
+    assert client.get('/download/Bank-Credit-Information.txt').status_code == 404
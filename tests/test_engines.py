@@ -0,0 +1,238 @@
+import os, shutil, threading
+
+import openpyxl
+import pytest
+from openpyxl import load_workbook
+
+from benchmarks.compare_engines import SUMMARY_KEYS, read_output
+from benchmarks.synthetic_data import write_workbook as write_synthetic_workbook
+from dates import clear_date_cache
+from processing import FILE_SPECS, ensure_folders, get_file_type, process_uploaded_file
+from workspace import new_workspace
+
+# Options selecting each way a workbook can be processed
+ENGINES = {
+    'in_memory': {'streaming_min_file_size': float('inf')},
+    'streaming': {'streaming_min_file_size': 0},
+    'pandas': {'engine': 'pandas', 'streaming_min_file_size': float('inf')},
+    'chunked': {'streaming_min_file_size': 0, 'row_workers': 2},
+}
+
+# Share of rows with each kind of problem in the generated workbooks, high enough that
+# a few hundred rows go through every rule
+DIRT = {'duplicates': 0.1, 'blanks': 0.05, 'bad_bvn': 0.05, 'messy_dates': 0.2}
+
+# An Individual-Borrower sheet with columns A to I only; its rules read up to K
+NARROW_ROWS = [
+    list('ABCDEFGHI'),
+    ['C1', 'x', 'y', 'z', 'e', '01/02/2020', 'g', 'h', '2222'],
+    ['C2', 'x', 'y', 'z', 'e', '15/03/2020', 'g', 'h', '2222'],
+    [None, 'x', 'y', 'z', 'e', '01/02/2020', 'g', 'h', '2222'],
+]
+
+# Individual-Borrower rows that differ only in how column G holds the number 1
+MIXED_NUMBER_ROWS = [NARROW_ROWS[0]] + [['C1', 'x', 'y', 'z', 'e', '01/02/2020', value, 'h', '2222']
+                                        for value in (1, 1.0, True, 1.5, '1')]
+
+# NARROW_ROWS with nothing in column A, and with an empty first row
+OFFSET_SHEETS = {
+    'empty_first_column': [[None] + row[1:] for row in NARROW_ROWS],
+    'empty_first_row': [[None] * 9] + NARROW_ROWS,
+}
+
+
+# Function to save rows as the active sheet of an upload
+def write_workbook(file_path, rows):
+    workbook = openpyxl.Workbook()
+    for row in rows:
+        workbook.active.append(row)
+    workbook.save(file_path)
+
+# Function to get the widest row of the active sheet of a workbook, and its dimension
+def workbook_width(file_path):
+    workbook = load_workbook(file_path, read_only=True)
+    sheet = workbook.active
+    dimension = sheet.max_column
+    sheet.reset_dimensions()
+    width = max(len(row) for row in sheet.iter_rows(values_only=True))
+    workbook.close()
+    return max(width, dimension or 0)
+
+# Function to generate a workbook of `file_type` with DIRT problems. Returns its path.
+def generated_workbook(file_type, rows=300, seed=1):
+    path = f'Bank-{file_type}.xlsx'
+    if not os.path.exists(path):
+        write_synthetic_workbook(path, file_type, rows, seed, **DIRT)
+    return os.path.abspath(path)
+
+# Function to process a copy of `source` in its own working folder `folder`. Returns
+# the messages, the summary counts (`keys`) and the contents of every output.
+def process_copy(source, folder, options, keys=SUMMARY_KEYS):
+    os.makedirs(folder)
+    cwd = os.getcwd()
+    os.chdir(folder)
+    try:
+        ensure_folders()
+        filename = os.path.basename(source)
+        file_path = os.path.join(FILE_SPECS[get_file_type(filename)]['folder'], filename)
+        shutil.copyfile(source, file_path)
+        messages = []
+        summary = process_uploaded_file(file_path, lambda message, category='message': messages.append((category, message)),
+                                        options)
+        outputs = {name: read_output(path) for name, path in summary['outputs'].items()}
+    finally:
+        os.chdir(cwd)
+    return messages, {key: summary[key] for key in keys}, outputs
+
+
+@pytest.mark.parametrize('file_type', sorted(FILE_SPECS))
+def test_engines_write_the_same_outputs(workdir, file_type):
+    source = generated_workbook(file_type)
+    results = {engine: process_copy(source, engine, options) for engine, options in ENGINES.items()}
+
+    expected = results['in_memory']
+    assert expected[1]['duplicates'] and expected[1]['blank_rows'] and expected[1]['invalid_bvn']
+    for engine, result in results.items():
+        assert result == expected, engine
+
+
+@pytest.mark.parametrize('engine', ['in_memory', 'chunked'])
+def test_spilled_duplicates_write_the_same_outputs(workdir, engine):
+    source = generated_workbook('Credit-Information')
+    in_memory = process_copy(source, 'in_memory', ENGINES[engine])
+    spilled = process_copy(source, 'spilled', dict(ENGINES[engine], dedup_memory_budget=1000))
+    assert spilled == in_memory
+
+
+def test_small_row_chunks_write_the_same_outputs(workdir, monkeypatch):
+    import chunked
+    used = []
+
+    # Sheet chunks of about 20 rows, so the rows of every file are cut across chunks
+    class SmallChunks(chunked.SheetChunks):
+        def __init__(self, file_path, rules, workers):
+            super().__init__(file_path, rules, workers, chunk_bytes=4096)
+            used.append(self)
+    monkeypatch.setattr(chunked, 'SheetChunks', SmallChunks)
+
+    source = generated_workbook('Principal-Officers')
+    streaming = process_copy(source, 'streaming', ENGINES['streaming'])
+    assert process_copy(source, 'chunked', ENGINES['chunked']) == streaming
+    assert used[0].chunks > 5
+
+
+# Function to save two monthly submissions of a generated workbook, with a customer ID
+# for each distinct row: in the second, some rows are changed, two removed and one
+# added. Returns their paths.
+def monthly_submissions(file_type):
+    workbook = load_workbook(generated_workbook(file_type))
+    sheet = workbook.active
+    customers = {}
+    for row in sheet.iter_rows(min_row=2):
+        row[0].value = f"C{customers.setdefault(tuple(cell.value for cell in row[1:]), len(customers))}"
+    paths = []
+    for month in ('first', 'second'):
+        if month == 'second':
+            for row_num in range(2, sheet.max_row + 1, 15):
+                sheet.cell(row_num, 2).value = f'changed {row_num}'
+            sheet.delete_rows(3, 2)
+            sheet.append(['NEW1'] + [cell.value for cell in sheet[5][1:]])
+        os.makedirs(month)
+        paths.append(os.path.abspath(os.path.join(month, f'Bank-{file_type}.xlsx')))
+        workbook.save(paths[-1])
+    return paths
+
+
+@pytest.mark.parametrize('engine', ['in_memory', 'streaming'])
+def test_delta_store_reuses_rows_with_the_same_outputs(workdir, engine):
+    source, resubmitted = monthly_submissions('Individual-Borrower')
+    _, plain, plain_outputs = process_copy(resubmitted, 'plain', ENGINES[engine])
+
+    options = dict(ENGINES[engine], delta_store=os.path.abspath('delta.sqlite3'))
+    process_copy(source, 'first_run', options)
+    _, delta, delta_outputs = process_copy(resubmitted, 'second_run', options, SUMMARY_KEYS + ['delta'])
+
+    counts = delta.pop('delta')
+    assert counts['reused'] > 0 and counts['changed'] > 0 and counts['added'] > 0 and counts['removed'] > 0
+    assert delta_outputs.pop('delta')
+    assert (delta, delta_outputs) == (plain, plain_outputs)
+
+
+def test_files_processed_at_once_count_their_own_dates(workdir):
+    sources = [generated_workbook(file_type) for file_type in ('Credit-Information', 'Principal-Officers')]
+
+    # Function to process a copy of each source in its own workspace, on a thread each
+    def date_lookups():
+        clear_date_cache()
+        summaries = [None] * len(sources)
+
+        def run(index, source):
+            workspace = new_workspace()
+            ensure_folders(workspace)
+            file_path = os.path.join(workspace, FILE_SPECS[get_file_type(source)]['folder'], os.path.basename(source))
+            shutil.copyfile(source, file_path)
+            summaries[index] = process_uploaded_file(file_path, options=dict(ENGINES['in_memory'], workspace=workspace))
+        threads = [threading.Thread(target=run, args=item) for item in enumerate(sources)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return [summary['dates']['hits'] + summary['dates']['misses'] for summary in summaries]
+
+    alone = []
+    for source in sources:
+        clear_date_cache()
+        summary = process_copy(source, f'alone-{len(alone)}', ENGINES['in_memory'], ['dates'])[1]
+        alone.append(summary['dates']['hits'] + summary['dates']['misses'])
+    assert all(alone)
+    assert date_lookups() == alone
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_narrow_workbook_keeps_its_width(workdir, engine):
+    file_path = 'individual_borrower/Bank-Individual-Borrower.xlsx'
+    write_workbook(file_path, NARROW_ROWS)
+    summary = process_uploaded_file(file_path, options=ENGINES[engine])
+
+    assert summary['rows_written'] == 2
+    assert workbook_width(file_path) == 9
+    assert workbook_width(summary['outputs']['exceptions']) == 9
+    with open(summary['outputs']['text']) as text_file:
+        lines = text_file.read().splitlines()
+    assert lines[0] == 'A|B|C|D|E|F|G|H|I'
+    assert lines[1] == 'C1|x|y|z|e|01-Feb-2020|g|h|2222'
+
+
+def test_narrow_csv_keeps_its_width(workdir):
+    file_path = 'individual_borrower/Bank-Individual-Borrower.csv'
+    with open(file_path, 'w') as upload:
+        upload.write('\n'.join(','.join(value or '' for value in row) for row in NARROW_ROWS) + '\n')
+    summary = process_uploaded_file(file_path)
+
+    with open(file_path) as cleaned:
+        assert cleaned.read().splitlines() == ['A,B,C,D,E,F,G,H,I', 'C1,x,y,z,e,01-Feb-2020,g,h,2222',
+                                               'C2,x,y,z,e,15-Mar-2020,g,h,2222']
+    with open(summary['outputs']['text']) as text_file:
+        assert all(line.count('|') == 8 for line in text_file)
+
+
+def test_numbers_equal_in_value_are_duplicates(workdir):
+    write_workbook('Bank-Individual-Borrower.xlsx', MIXED_NUMBER_ROWS)
+    source = os.path.abspath('Bank-Individual-Borrower.xlsx')
+    results = {engine: process_copy(source, engine, options) for engine, options in ENGINES.items()}
+
+    expected = results['pandas']
+    assert expected[1]['duplicates'] == 2
+    for engine, result in results.items():
+        assert result == expected, engine
+
+
+@pytest.mark.parametrize('sheet', OFFSET_SHEETS)
+def test_sheets_read_from_a1(workdir, sheet):
+    write_workbook('Bank-Individual-Borrower.xlsx', OFFSET_SHEETS[sheet])
+    source = os.path.abspath('Bank-Individual-Borrower.xlsx')
+    results = {engine: process_copy(source, engine, options) for engine, options in ENGINES.items()}
+
+    expected = results['streaming']
+    for engine, result in results.items():
+        assert result == expected, engine
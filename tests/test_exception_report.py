@@ -0,0 +1,20 @@
+from openpyxl import load_workbook
+
+from exception_report import EXCEPTION_SHEETS, ExceptionWorkbook
+
+
+def test_sheets_are_saved_in_rule_order(tmp_path):
+    path = str(tmp_path / 'exceptions.xlsx')
+    exceptions = ExceptionWorkbook(path, ['A', 'B'])
+    exceptions.add('shared_bvn', ['C1', 'x'])
+    exceptions.add('duplicate', ['C2', 'y'])
+    exceptions.add('blank', [None, 'z'])
+    exceptions.add('duplicate', ['C3', 'w'])
+    messages = []
+    assert exceptions.save(lambda message, category='message': messages.append(message)) == {'exceptions': path}
+
+    workbook = load_workbook(path, read_only=True)
+    assert workbook.sheetnames == [EXCEPTION_SHEETS[status] for status in ('blank', 'duplicate', 'shared_bvn')]
+    assert list(workbook[EXCEPTION_SHEETS['duplicate']].values) == [('A', 'B'), ('C2', 'y'), ('C3', 'w')]
+    workbook.close()
+    assert len(messages) == 3
@@ -0,0 +1,100 @@
+import io, os, zipfile
+
+import openpyxl
+import pytest
+
+from ingest import UploadRejected, validate_delimited, validate_workbook
+from workspace import WORKSPACE_FOLDER
+
+HEADER = ['A', 'B', 'C']
+
+
+# Function to save a workbook with a header and `rows` data rows. Returns its path.
+def saved_workbook(path, rows, value='x'):
+    workbook = openpyxl.Workbook()
+    workbook.active.append(HEADER)
+    for index in range(rows):
+        workbook.active.append([f'C{index}', value, index])
+    workbook.save(path)
+    return str(path)
+
+# Function to post files to /upload, asking for a JSON answer
+def post_upload(client, files):
+    return client.post('/upload', data={'file': files}, content_type='multipart/form-data',
+                       headers={'Accept': 'application/json'})
+
+
+def test_workbook_rows_are_counted_and_limited(tmp_path):
+    path = saved_workbook(tmp_path / 'Bank-Individual-Borrower.xlsx', 20)
+    assert validate_workbook(path) == 20
+    assert validate_workbook(path, max_rows=20) == 20
+    with pytest.raises(UploadRejected, match='more than the 19 rows allowed'):
+        validate_workbook(path, max_rows=19)
+
+
+def test_workbook_that_unzips_too_far_is_rejected(tmp_path):
+    path = saved_workbook(tmp_path / 'Bank-Individual-Borrower.xlsx', 200, 'y' * 1000)
+    validate_workbook(path)
+    with pytest.raises(UploadRejected, match='unzips to more data'):
+        validate_workbook(path, max_ratio=10)
+    with pytest.raises(UploadRejected, match='unzips to more data'):
+        validate_workbook(path, max_unzipped=100 * 1024)
+
+
+def test_damaged_workbooks_are_rejected(tmp_path):
+    text = tmp_path / 'text.xlsx'
+    text.write_text('A,B\n1,2\n')
+    with pytest.raises(UploadRejected, match='not an xlsx workbook'):
+        validate_workbook(str(text))
+
+    source = saved_workbook(tmp_path / 'source.xlsx', 2)
+    damaged = tmp_path / 'damaged.xlsx'
+    with zipfile.ZipFile(source) as archive, zipfile.ZipFile(damaged, 'w') as copy:
+        for member in archive.infolist():
+            if member.filename != 'xl/workbook.xml':
+                copy.writestr(member, archive.read(member))
+    with pytest.raises(UploadRejected, match='xl/workbook.xml is missing'):
+        validate_workbook(str(damaged))
+
+
+def test_delimited_rows_are_counted_and_limited(tmp_path):
+    path = tmp_path / 'Bank-Individual-Borrower.csv'
+    path.write_text('A,B\n' + ''.join(f'C{index},x\n' for index in range(10)))
+    assert validate_delimited(str(path)) == 10
+    with pytest.raises(UploadRejected, match='more than the 9 rows allowed'):
+        validate_delimited(str(path), max_rows=9)
+
+    # Without a line break at the end the last row still counts
+    path.write_text('A,B\nC1,x\nC2,x')
+    assert validate_delimited(str(path)) == 2
+    path.write_bytes('A,B\n'.encode('utf-16'))
+    with pytest.raises(UploadRejected, match='not UTF-8 delimited text'):
+        validate_delimited(str(path))
+
+
+def test_uploads_over_the_limits_are_refused(workdir, monkeypatch):
+    from app import app
+    client = app.test_client()
+    workbook = saved_workbook(workdir / 'upload.xlsx', 20)
+    with open(workbook, 'rb') as upload:
+        content = upload.read()
+
+    monkeypatch.setitem(app.config, 'MAX_UPLOAD_BYTES', len(content) - 1)
+    response = post_upload(client, (io.BytesIO(content), 'Bank-Individual-Borrower.xlsx'))
+    assert response.status_code == 413
+    assert 'larger than' in response.get_json()['error']
+
+    monkeypatch.setitem(app.config, 'MAX_UPLOAD_BYTES', len(content))
+    monkeypatch.setitem(app.config, 'MAX_UPLOAD_ROWS', 10)
+    response = post_upload(client, (io.BytesIO(content), 'Bank-Individual-Borrower.xlsx'))
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'The workbook has more than the 10 rows allowed.'
+
+    response = post_upload(client, (io.BytesIO(b'A,B\n1,2\n'), 'Bank-Individual-Borrower.xlsx'))
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'The file is not an xlsx workbook.'
+
+    monkeypatch.setitem(app.config, 'MAX_CONTENT_LENGTH', 1024)
+    assert post_upload(client, (io.BytesIO(content), 'Bank-Individual-Borrower.xlsx')).status_code == 413
+    # Refused uploads leave nothing behind
+    assert not [name for name in os.listdir(WORKSPACE_FOLDER) if name.startswith('.upload-')]
@@ -0,0 +1,140 @@
+import io, json, os, threading, time
+
+import jobs
+from processing import PROCESSED_FOLDER, ensure_folders
+from test_batch import data_row, save_upload
+from workspace import JOB_STATUS_FOLDER, PUBLISH_LOCK, WORKSPACE_FOLDER, new_workspace, remove_expired
+
+
+# Function to create a job and drop it from this process, as if another app process
+# had accepted the upload
+def job_of_another_process(status='queued'):
+    job = jobs.new_job('Bank-Individual-Borrower.xlsx', [])
+    job['status'] = status
+    jobs.touch_job(job)
+    with jobs.jobs_lock:
+        del jobs.jobs[job['id']]
+    return job
+
+# Function to save an upload in a new workspace, as the upload route does. Returns
+# the workspace and the path of the upload.
+def workspace_upload(filename, folder, rows):
+    workspace = new_workspace()
+    ensure_folders(workspace)
+    return workspace, save_upload(os.path.join(workspace, folder), filename, rows)
+
+# Function to follow a job until it is done or failed, as the event stream does
+def finished_job(job):
+    while job['status'] not in ('done', 'failed'):
+        job = jobs.wait_for_job(job, job['version'], timeout=30)
+    return job
+
+
+def test_job_status_is_read_from_its_file(workdir):
+    from app import app
+    job = job_of_another_process()
+    client = app.test_client()
+
+    response = client.get(f"/jobs/{job['id']}")
+    assert response.status_code == 200
+    assert response.get_json()['status'] == 'queued'
+    assert job['id'] in [listed['id'] for listed in client.get('/jobs').get_json()]
+    assert client.get('/jobs/../../app.py').status_code == 404
+    assert client.get(f"/jobs/{'0' * 32}").status_code == 404
+
+
+def test_events_follow_a_job_of_another_process(workdir, monkeypatch):
+    from app import app
+    monkeypatch.setattr(jobs, 'JOB_POLL_INTERVAL', 0.01)
+    job = job_of_another_process('running')
+
+    # The other process finishes the job while the stream waits on its file
+    def finish():
+        time.sleep(0.1)
+        job['status'] = 'done'
+        jobs.touch_job(job)
+    threading.Thread(target=finish).start()
+
+    body = app.test_client().get(f"/jobs/{job['id']}/events").get_data(as_text=True)
+    statuses = [json.loads(event[len('data: '):])['status'] for event in body.strip().split('\n\n')]
+    assert statuses == ['running', 'done']
+
+
+def test_expired_workspaces_and_statuses_are_removed(workdir):
+    old = time.time() - 8 * 24 * 60 * 60
+    failed = new_workspace()
+    current = new_workspace()
+    upload = os.path.join(WORKSPACE_FOLDER, '.upload-abc')
+    open(upload, 'w').close()
+    open(os.path.join(WORKSPACE_FOLDER, PUBLISH_LOCK), 'w').close()
+    job = jobs.new_job('Bank-Individual-Borrower.xlsx', [])
+    status_file = jobs.job_status_path(job['id'])
+    for path in (failed, upload, status_file, os.path.join(WORKSPACE_FOLDER, PUBLISH_LOCK),
+                 os.path.join(WORKSPACE_FOLDER, JOB_STATUS_FOLDER)):
+        os.utime(path, (old, old))
+
+    assert remove_expired() == 3
+    assert not os.path.exists(failed) and not os.path.exists(upload) and not os.path.exists(status_file)
+    assert os.path.isdir(current)
+    assert os.path.exists(os.path.join(WORKSPACE_FOLDER, PUBLISH_LOCK))
+
+
+def test_job_publishes_its_outputs_and_removes_its_workspace(workdir):
+    workspace, file_path = workspace_upload('Bank-Credit-Information.xlsx', 'credit_information',
+                                            [data_row('C1', '22212345678')] * 2)
+    job = jobs.new_job('Bank-Credit-Information.xlsx', [file_path])
+    jobs.run_job(job, {'workspace': workspace})
+
+    assert job['status'] == 'done' and job['error'] is None
+    assert job['summary']['duplicates'] == 1
+    assert job['messages'][-1] == ('success', "Bank-Credit-Information.xlsx has been processed successfully.")
+    assert os.path.isfile(os.path.join(PROCESSED_FOLDER, 'Bank-Credit-Information.txt'))
+    assert not os.path.exists(workspace)
+    stored = jobs.load_job(job['id'])
+    assert stored['status'] == 'done' and stored['version'] == job['version']
+
+
+def test_failed_job_keeps_its_workspace(workdir):
+    workspace = new_workspace()
+    ensure_folders(workspace)
+    file_path = os.path.join(workspace, 'credit_information', 'Bank-Credit-Information.xlsx')
+    with open(file_path, 'w') as damaged:
+        damaged.write('not a workbook')
+    job = jobs.new_job('Bank-Credit-Information.xlsx', [file_path])
+    jobs.run_job(job, {'workspace': workspace})
+
+    assert job['status'] == 'failed' and job['error']
+    assert job['messages'][-1][0] == 'danger'
+    assert os.path.isfile(file_path)
+
+
+def test_batch_job_fails_when_one_of_its_files_does(workdir):
+    workspace, borrower = workspace_upload('Bank-Individual-Borrower.xlsx', 'individual_borrower',
+                                           [data_row('C1', '22212345678')])
+    damaged = os.path.join(workspace, 'credit_information', 'Bank-Credit-Information.xlsx')
+    with open(damaged, 'w') as upload:
+        upload.write('not a workbook')
+    job = jobs.new_job('month-end.zip', [borrower, damaged])
+    jobs.run_batch_job(job, 2, {'workspace': workspace})
+
+    assert job['status'] == 'failed'
+    assert [result['error'] is None for result in job['summary']['files']] == [True, False]
+    assert job['summary']['files'][0]['rows_written'] == 1
+    assert job['messages'][-1][1].startswith('Processed 1 of 2 files')
+    assert os.path.isdir(workspace)
+
+
+def test_upload_is_queued_and_polled(workdir):
+    from app import app
+    client = app.test_client()
+    upload = save_upload('.', 'upload.xlsx', [data_row('C1', '22212345678')])
+    with open(upload, 'rb') as upload_file:
+        response = client.post('/upload', data={'file': (io.BytesIO(upload_file.read()), 'Bank-Credit-Information.xlsx')},
+                               content_type='multipart/form-data', headers={'Accept': 'application/json'})
+    assert response.status_code == 202
+    job = finished_job(jobs.get_job(response.get_json()['id']))
+
+    status = client.get(f"/jobs/{job['id']}").get_json()
+    assert status['status'] == 'done'
+    assert status['summary']['rows_written'] == 1
+    assert status['progress']['stage'] == 'text_export'
@@ -0,0 +1,44 @@
+import pytest
+
+import metrics
+from metrics import current_rss, record_stage, stage_clock
+from processing import process_uploaded_file
+from test_batch import data_row, save_upload
+
+# Size of the block a stage holds on to in the memory test
+BLOCK_SIZE = 64 * 1024 * 1024
+
+
+@pytest.mark.skipif(current_rss() is None, reason="needs /proc/self/statm")
+def test_stage_memory_is_the_change_in_resident_memory():
+    summary = {'stages': {}}
+    start = stage_clock()
+    block = b'x' * BLOCK_SIZE
+    start = record_stage(summary, 'load', start)
+    del block
+    record_stage(summary, 'save', start)
+
+    assert summary['stages']['load']['memory'] > BLOCK_SIZE * 0.9
+    assert summary['stages']['save']['memory'] < -BLOCK_SIZE * 0.9
+
+
+def test_processed_files_are_served_on_metrics(workdir, monkeypatch):
+    from app import app
+    monkeypatch.setattr(metrics, 'registry', {'files': {}, 'rows': {}, 'stages': {}, 'memory': {}})
+    file_path = save_upload('credit_information', 'Bank-Credit-Information.xlsx',
+                            [data_row(f'C{index}', '22212345678') for index in range(5)] + [data_row('C0', '22212345678')])
+    summary = process_uploaded_file(file_path)
+    metrics.observe_summary(summary)
+    metrics.observe_summary(dict(summary, cached=True))
+
+    response = app.test_client().get('/metrics')
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain; version=0.0.4')
+    lines = response.get_data(as_text=True).splitlines()
+    assert 'dq_files_processed_total{file_type="Credit-Information",cached="false"} 1' in lines
+    assert 'dq_files_processed_total{file_type="Credit-Information",cached="true"} 1' in lines
+    assert 'dq_rows_processed_total{file_type="Credit-Information"} 12' in lines
+    assert 'dq_stage_rows_in_total{file_type="Credit-Information",stage="load"} 12' in lines
+    assert 'dq_stage_rows_out_total{file_type="Credit-Information",stage="rules"} 10' in lines
+    assert any(line.startswith('dq_stage_wall_seconds_total{file_type="Credit-Information",stage="load"}')
+               for line in lines)
@@ -0,0 +1,34 @@
+import os
+
+import pytest
+
+import cli
+from benchmarks.compare_engines import read_output
+from test_engines import ENGINES, generated_workbook
+from test_result_cache import process_upload
+
+
+@pytest.mark.parametrize('engine', ['in_memory', 'streaming', 'pandas'])
+def test_cached_sheet_gives_the_same_outputs(workdir, engine):
+    source = generated_workbook('Credit-Information')
+    options = dict(ENGINES[engine], parse_cache=True)
+    messages, summary, outputs = process_upload(source, options)
+    assert summary['parse_cache'] == 'miss'
+
+    cached_messages, cached, cached_outputs = process_upload(source, options)
+    assert cached['parse_cache'] == 'hit'
+    assert cached_messages == messages
+    assert cached_outputs == outputs
+    assert cached['rows_written'] == summary['rows_written'] and cached['unparsed_dates'] == summary['unparsed_dates']
+
+
+def test_replay_processes_the_original_upload_again(workdir, capsys):
+    source = generated_workbook('Credit-Information')
+    summary, outputs = process_upload(source, {'parse_cache': True})[1:]
+    for path in summary['outputs'].values():
+        os.remove(path)
+
+    assert cli.main(['replay', 'Other-Credit-Information.xlsx']) == 0
+    assert 'No uploads in the parse cache' in capsys.readouterr().err
+    assert cli.main(['replay', '--workers', '1']) == 0
+    assert {role: read_output(path) for role, path in summary['outputs'].items()} == outputs
@@ -0,0 +1,66 @@
+import os, shutil, time
+
+import result_cache
+from benchmarks.compare_engines import read_output
+from processing import FILE_SPECS, process_uploaded_file
+from test_engines import generated_workbook
+
+CACHED_NOTICE = ('success', "Identical file processed before: results were taken from the cache.")
+
+
+# Function to copy `source` in as an upload and process it. Returns the messages, the
+# summary and the contents of every output.
+def process_upload(source, options):
+    file_path = os.path.join(FILE_SPECS['Credit-Information']['folder'], os.path.basename(source))
+    shutil.copyfile(source, file_path)
+    messages = []
+    summary = process_uploaded_file(file_path, lambda message, category='message': messages.append((category, message)),
+                                    options)
+    return messages, summary, {role: read_output(path) for role, path in summary['outputs'].items()}
+
+# Function to store a cache entry with one output of `size` bytes
+def store_entry(key, size, max_bytes):
+    path = f'{key}.txt'
+    with open(path, 'wb') as output:
+        output.write(b'x' * size)
+    result_cache.store(key, path, {'outputs': {'text': path}}, [], max_bytes=max_bytes)
+
+
+def test_identical_file_is_restored_from_the_cache(workdir):
+    source = generated_workbook('Credit-Information')
+    options = {'result_cache': True, 'exception_export': 'csv'}
+    messages, summary, outputs = process_upload(source, options)
+    assert summary['cached'] is False
+    assert len(os.listdir(result_cache.RESULT_CACHE_FOLDER)) == 1
+
+    # The outputs of the first run are removed, so the second can only have them from the cache
+    for path in summary['outputs'].values():
+        os.remove(path)
+    cached_messages, cached, cached_outputs = process_upload(source, options)
+    assert cached['cached'] is True
+    assert cached_messages == messages + [CACHED_NOTICE]
+    assert cached['outputs'] == summary['outputs']
+    assert cached_outputs == outputs
+    assert cached['rows_written'] == summary['rows_written'] and cached['duplicates'] == summary['duplicates']
+
+
+def test_other_rules_or_formats_miss_the_cache(workdir, monkeypatch):
+    source = generated_workbook('Credit-Information')
+    process_upload(source, {'result_cache': True})
+    assert process_upload(source, {'result_cache': True, 'text_compression': 'gzip'})[1]['cached'] is False
+    monkeypatch.setattr(result_cache, 'RULES_VERSION', result_cache.RULES_VERSION + 1)
+    assert process_upload(source, {'result_cache': True})[1]['cached'] is False
+    assert len(os.listdir(result_cache.RESULT_CACHE_FOLDER)) == 3
+
+
+def test_least_recently_used_entries_are_evicted(workdir):
+    store_entry('first', 100, 1000)
+    store_entry('second', 100, 1000)
+    old = time.time() - 60
+    for key in ('first', 'second'):
+        os.utime(result_cache.entry_folder(key), (old, old))
+    assert result_cache.lookup('first') is not None
+
+    store_entry('third', 100, 250)
+    assert result_cache.lookup('second') is None
+    assert result_cache.lookup('first') is not None and result_cache.lookup('third') is not None
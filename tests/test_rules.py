@@ -0,0 +1,29 @@
+import pytest
+
+from processing import ALL_COLUMNS_TO_V, FILE_SPECS, compile_rules, process_uploaded_file
+
+
+@pytest.mark.parametrize('file_type', sorted(FILE_SPECS))
+def test_file_specs_compile(file_type):
+    compile_rules(FILE_SPECS[file_type])
+
+
+def test_column_with_two_rules_is_refused():
+    spec = dict(FILE_SPECS['Guarantors-Information'], date_columns=['I'], bvn_column='I')
+    with pytest.raises(ValueError, match='Column I is set as both a date and a BVN column'):
+        compile_rules(spec)
+
+
+def test_guarantor_bvns_are_not_read_as_dates(workdir):
+    row = [f'v{col}' for col in ALL_COLUMNS_TO_V]
+    row[8] = '22212345678'
+    row[9] = 'F'
+    file_path = 'guarantors_information/Bank-Guarantors-Information.csv'
+    with open(file_path, 'w', encoding='utf-8') as upload:
+        upload.write(','.join(ALL_COLUMNS_TO_V) + '\n' + ','.join(row) + '\n')
+
+    summary = process_uploaded_file(file_path)
+    assert summary['rows_written'] == 1
+    assert summary['unparsed_dates'] == 0
+    with open(file_path, encoding='utf-8') as cleaned:
+        assert cleaned.read().splitlines()[1].split(',')[8:10] == ['22212345678', '002']
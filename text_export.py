@@ -0,0 +1,72 @@
+import gzip
+
+# Number of lines joined and written to the text file at once
+TEXT_BATCH_ROWS = 10000
+
+# Size of the write buffer of an uncompressed text file
+TEXT_BUFFER_SIZE = 1024 * 1024
+
+# Compression level of gzip text files (1 is fastest, 9 is smallest)
+GZIP_LEVEL = 6
+
+
+# Function to get the path of a text file once its compression suffix is added
+def text_output_path(text_file_path, compression=None):
+    return text_file_path + '.gz' if compression == 'gzip' else text_file_path
+
+# Function to open a text file for writing, gzip-compressed when asked for.
+# Characters the file encoding cannot represent are dropped.
+def open_text_file(text_file_path, compression=None):
+    if compression == 'gzip':
+        return gzip.open(text_file_path, 'wt', compresslevel=GZIP_LEVEL, errors='ignore')
+    return open(text_file_path, 'w', errors='ignore', buffering=TEXT_BUFFER_SIZE)
+
+# Function to turn a row into a pipe-delimited line, with None as an empty string
+def pipe_delimited_line(row):
+    return '|'.join(['' if cell is None else cell if type(cell) is str else str(cell) for cell in row])
+
+
+# Writes rows as pipe-delimited lines, joining them in batches so the file is
+# written in a few large chunks rather than a line at a time
+class PipeDelimitedWriter:
+    def __init__(self, text_file_path, compression=None, batch_rows=TEXT_BATCH_ROWS):
+        self.path = text_file_path
+        self.file = open_text_file(text_file_path, compression)
+        self.batch_rows = batch_rows
+        self.lines = []
+        self.rows = 0
+
+    # Function to add one row
+    def write_row(self, row):
+        self.lines.append(pipe_delimited_line(row))
+        if len(self.lines) >= self.batch_rows:
+            self.flush()
+
+    # Function to add every row of an iterator
+    def write_rows(self, rows):
+        for row in rows:
+            self.write_row(row)
+
+    # Function to write the lines batched so far
+    def flush(self):
+        if self.lines:
+            self.file.write('\n'.join(self.lines) + '\n')
+            self.rows += len(self.lines)
+            self.lines = []
+
+    # Function to write the last batch and close the file
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self.file.close()
+
+
+# Function to write rows to a pipe-delimited text file. Returns the number of rows written.
+def write_pipe_delimited_rows(text_file_path, rows, compression=None):
+    writer = PipeDelimitedWriter(text_file_path, compression)
+    try:
+        writer.write_rows(rows)
+    finally:
+        writer.close()
+    return writer.rows
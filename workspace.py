@@ -0,0 +1,89 @@
+import os, shutil, time, uuid
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Folder holding one workspace per job. It must be on the same volume as the output
+# folders, so outputs are published by renaming them.
+WORKSPACE_FOLDER = 'workspaces'
+
+# Lock file taken while a job publishes its outputs
+PUBLISH_LOCK = '.publish.lock'
+
+# Folder under WORKSPACE_FOLDER with the status of each job as JSON (see jobs.py)
+JOB_STATUS_FOLDER = 'jobs'
+
+# Seconds the workspace of a failed job, an upload never finished and the status of
+# a job are kept before they are removed
+WORKSPACE_MAX_AGE = 7 * 24 * 60 * 60
+
+
+# Function to create an empty workspace for a job. Returns its path.
+def new_workspace(root=WORKSPACE_FOLDER, name=None):
+    path = os.path.join(root, name or uuid.uuid4().hex)
+    os.makedirs(path)
+    return path
+
+# Function to get where a file written inside a workspace is published
+def published_path(workspace, path):
+    return os.path.relpath(path, workspace)
+
+# Function to wrap a message handler so the paths in messages name the published
+# files rather than the copies inside the workspace
+def workspace_notify(workspace, notify):
+    prefix = os.path.join(workspace, '')
+
+    def report(message, category='message'):
+        notify(message.replace(prefix, ''), category)
+    return report
+
+# Function to move the outputs of a processed file from its workspace to the shared
+# folders. Each file is renamed into place, so readers see the old file or the new
+# one, never part of one. The lock keeps two jobs publishing files with the same
+# names from mixing their outputs. Returns the summary with the published paths.
+def publish_outputs(workspace, summary):
+    if not summary:
+        return summary
+    outputs = {}
+    lock_path = os.path.join(os.path.dirname(os.path.normpath(workspace)), PUBLISH_LOCK)
+    with open(lock_path, 'a') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        # The cleaned upload goes last, so its outputs are in place once it appears
+        for role, path in sorted(summary['outputs'].items(), key=lambda item: item[0] in ('xlsx', 'csv')):
+            target = published_path(workspace, path)
+            os.makedirs(os.path.dirname(target) or '.', exist_ok=True)
+            os.replace(path, target)
+            outputs[role] = target
+    return dict(summary, file_path=published_path(workspace, summary['file_path']), outputs=outputs)
+
+# Function to remove a workspace once its job has published everything
+def remove_workspace(workspace):
+    shutil.rmtree(workspace, ignore_errors=True)
+
+# Function to remove the workspaces, unfinished uploads and job statuses under `root`
+# not changed for `max_age` seconds. Returns the number removed.
+def remove_expired(root=WORKSPACE_FOLDER, max_age=WORKSPACE_MAX_AGE):
+    cutoff = time.time() - max_age
+    status_folder = os.path.join(root, JOB_STATUS_FOLDER)
+    removed = 0
+    for folder in (root, status_folder):
+        if not os.path.isdir(folder):
+            continue
+        for entry in os.scandir(folder):
+            if entry.name == PUBLISH_LOCK or entry.path == status_folder:
+                continue
+            try:
+                if entry.stat(follow_symlinks=False).st_mtime >= cutoff:
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    shutil.rmtree(entry.path)
+                else:
+                    os.remove(entry.path)
+            except OSError:
+                # Another app process removed it first
+                continue
+            removed += 1
+    return removed